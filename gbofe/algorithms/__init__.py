@@ -3,13 +3,24 @@ Module of algorithms for flow enforcement in DEM.
 """
 from gbofe.algorithms.base_strategy import FlowEnforcementStrategy
 from gbofe.algorithms.carve_method import RCarveMethod
+from gbofe.algorithms.carve_vectorized import RCarveVectorizedMethod
 from gbofe.algorithms.excavation_methods import NormalExcavationMethod, NormalExcavationModifiedMethod
+from gbofe.algorithms.excavation_vectorized import (
+    NormalExcavationVectorizedMethod, NormalExcavationModifiedVectorizedMethod
+)
 from gbofe.algorithms.gbofe_method import GBOFEMethod
+from gbofe.algorithms.gbofe_compiled import GBOFECompiledMethod
+from gbofe.algorithms.gbofe_vectorized import GBOFEVectorizedMethod
 
 __all__ = [
     'FlowEnforcementStrategy',
     'RCarveMethod',
+    'RCarveVectorizedMethod',
     'NormalExcavationMethod',
     'NormalExcavationModifiedMethod',
-    'GBOFEMethod'
+    'NormalExcavationVectorizedMethod',
+    'NormalExcavationModifiedVectorizedMethod',
+    'GBOFEMethod',
+    'GBOFECompiledMethod',
+    'GBOFEVectorizedMethod'
 ]
\ No newline at end of file
@@ -3,6 +3,10 @@ Base strategy for flow enforcement methods.
 """
 import numpy as np
 from abc import ABC, abstractmethod
+from typing import Union
+from gbofe.utils.counters import AlgorithmCounters
+from gbofe.utils.drainage_footprint import DrainageFootprint
+from gbofe.utils.drainage_graph import DrainageGraph
 
 class FlowEnforcementStrategy(ABC):
     """Base strategy for flow enforcement methods in DEM."""
@@ -11,29 +15,69 @@ class FlowEnforcementStrategy(ABC):
         self.gradient = gradient
         self._validate_gradient()
 
+        # Branch counts and level histograms of the last run
+        self.counters = AlgorithmCounters()
+
     def _validate_gradient(self) -> None:
         """Validates that the gradient is positive."""
         if self.gradient <= 0:
             raise ValueError("Gradient must be greater than 0")
 
     @abstractmethod
-    def apply(self, dem_data: np.ndarray, drainage_data: np.ndarray,
-              resolution: float) -> np.ndarray:
+    def apply(self, dem_data: np.ndarray, drainage_data: Union[np.ndarray, DrainageGraph],
+              resolution: float, in_place: bool = False) -> np.ndarray:
         """
         Applies the flow enforcement method.
 
+        With in_place the strategy owns the input buffers and corrects them
+        without a copy; buffers created with create_padded_array are also
+        padded without a copy.
+
         Args:
             dem_data: DEM data
-            drainage_data: Rasterized drainage data
+            drainage_data: Rasterized drainage data or its DrainageGraph
             resolution: Raster resolution
+            in_place: Whether dem_data and a drainage raster may be modified
 
         Returns:
             Corrected DEM
         """
         pass
 
+    @abstractmethod
+    def apply_footprint(self, elevations: np.ndarray, footprint: DrainageFootprint,
+                        resolution: float) -> None:
+        """
+        Applies the flow enforcement method to a drainage footprint in place.
+
+        Gives the same elevations as apply on the cells of the footprint,
+        without holding the rest of the DEM.
+
+        Args:
+            elevations: Elevation of each footprint cell, modified in place
+            footprint: Drainage footprint
+            resolution: Raster resolution
+        """
+        pass
+
     @staticmethod
-    def get_drainage_indices(drainage_data: np.ndarray,
+    def get_drainage_indices(drainage_data: Union[np.ndarray, DrainageGraph],
                              min_threshold: int = 1) -> np.ndarray:
         """Gets the indices where drainage exists."""
-        return np.argwhere(drainage_data >= min_threshold)
\ No newline at end of file
+        if isinstance(drainage_data, DrainageGraph):
+            return np.column_stack((drainage_data.rows, drainage_data.cols))
+        return np.argwhere(drainage_data >= min_threshold)
+
+    @staticmethod
+    def get_drainage_graph(drainage_data: Union[np.ndarray, DrainageGraph]) -> DrainageGraph:
+        """Gets the sparse drainage graph, building it from a raster when needed."""
+        if isinstance(drainage_data, DrainageGraph):
+            return drainage_data
+        return DrainageGraph.from_raster(drainage_data)
+
+    @staticmethod
+    def get_drainage_raster(drainage_data: Union[np.ndarray, DrainageGraph]) -> np.ndarray:
+        """Gets the dense drainage raster, rebuilding it from a graph when needed."""
+        if isinstance(drainage_data, DrainageGraph):
+            return drainage_data.to_raster(dtype=drainage_data.values.dtype)
+        return drainage_data
\ No newline at end of file
@@ -2,28 +2,44 @@
 Implementation of the r.carve method.
 """
 import numpy as np
+from typing import Union
 from gbofe.algorithms.base_strategy import FlowEnforcementStrategy
+from gbofe.utils.drainage_footprint import DrainageFootprint
+from gbofe.utils.drainage_graph import DrainageGraph
 
 class RCarveMethod(FlowEnforcementStrategy):
     """Implementation of the r.carve method for flow correction."""
 
-    def apply(self, dem_data: np.ndarray, drainage_data: np.ndarray,
-              resolution: float) -> np.ndarray:
+    def apply(self, dem_data: np.ndarray, drainage_data: Union[np.ndarray, DrainageGraph],
+              resolution: float, in_place: bool = False) -> np.ndarray:
         """
         Applies r.carve method by directly subtracting the gradient.
 
         Args:
             dem_data: DEM data
-            drainage_data: Rasterized drainage data
+            drainage_data: Rasterized drainage data or its DrainageGraph
             resolution: Raster resolution
+            in_place: Whether dem_data and a drainage raster may be modified
 
         Returns:
             Corrected DEM using r.carve
         """
-        corrected_dem = dem_data.copy()
+        corrected_dem = dem_data if in_place else dem_data.copy()
         drainage_indices = self.get_drainage_indices(drainage_data)
 
         for x, y in drainage_indices:
             corrected_dem[x, y] = corrected_dem[x, y] - self.gradient
 
-        return corrected_dem
\ No newline at end of file
+        return corrected_dem
+
+    def apply_footprint(self, elevations: np.ndarray, footprint: DrainageFootprint,
+                        resolution: float) -> None:
+        """
+        Applies r.carve method to a drainage footprint in place.
+
+        Args:
+            elevations: Elevation of each footprint cell, modified in place
+            footprint: Drainage footprint
+            resolution: Raster resolution
+        """
+        elevations[footprint.slots] -= self.gradient
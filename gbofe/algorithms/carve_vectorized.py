@@ -0,0 +1,31 @@
+"""
+Vectorized implementation of the r.carve method.
+"""
+import numpy as np
+from typing import Union
+from gbofe.algorithms.carve_method import RCarveMethod
+from gbofe.utils.drainage_graph import DrainageGraph
+
+class RCarveVectorizedMethod(RCarveMethod):
+    """Implementation of the r.carve method as a single masked subtraction."""
+
+    def apply(self, dem_data: np.ndarray, drainage_data: Union[np.ndarray, DrainageGraph],
+              resolution: float, in_place: bool = False) -> np.ndarray:
+        """
+        Applies r.carve method subtracting the gradient from all drainage cells at once.
+
+        Args:
+            dem_data: DEM data
+            drainage_data: Rasterized drainage data or its DrainageGraph
+            resolution: Raster resolution
+            in_place: Whether dem_data and a drainage raster may be modified
+
+        Returns:
+            Corrected DEM using r.carve
+        """
+        corrected_dem = dem_data if in_place else dem_data.copy()
+        rows, cols = self.get_drainage_indices(drainage_data).T
+
+        corrected_dem[rows, cols] -= self.gradient
+
+        return corrected_dem
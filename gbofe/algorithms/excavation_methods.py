@@ -2,29 +2,34 @@
 Implementation of normal and modified excavation methods.
 """
 import numpy as np
+from typing import Union
 from tqdm import tqdm
 from gbofe.algorithms.base_strategy import FlowEnforcementStrategy
-from gbofe.utils.geometric_utils import get_neighbors
-from gbofe.config import FLOW_ACCUMULATION_THRESHOLD, PROGRESS_MESSAGES
+from gbofe.utils.drainage_footprint import DrainageFootprint
+from gbofe.utils.drainage_graph import DrainageGraph
+from gbofe.utils.geometric_utils import get_neighbors, pad_array, unpad_array
+from gbofe.config import PAD_ELEVATION, PROGRESS_MESSAGES
 
 class NormalExcavationMethod(FlowEnforcementStrategy):
     """Implementation of the normalized excavation method."""
 
-    def apply(self, dem_data: np.ndarray, drainage_data: np.ndarray,
-              resolution: float) -> np.ndarray:
+    def apply(self, dem_data: np.ndarray, drainage_data: Union[np.ndarray, DrainageGraph],
+              resolution: float, in_place: bool = False) -> np.ndarray:
         """
         Applies the normalized excavation method based on minimum neighbors.
 
         Args:
             dem_data: DEM data
-            drainage_data: Rasterized drainage data
+            drainage_data: Rasterized drainage data or its DrainageGraph
             resolution: Raster resolution
+            in_place: Whether dem_data and a drainage raster may be modified
 
         Returns:
             Corrected DEM using normal excavation
         """
-        corrected_dem = dem_data.copy()
-        drainage_indices = self.get_drainage_indices(drainage_data)
+        corrected_dem = pad_array(dem_data, PAD_ELEVATION, in_place)
+        # Shift indices to the padded buffer
+        drainage_indices = self.get_drainage_indices(drainage_data) + 1
 
         new_elevations = []
         for index in drainage_indices:
@@ -37,38 +42,85 @@ class NormalExcavationMethod(FlowEnforcementStrategy):
         for i, (x, y) in enumerate(drainage_indices):
             corrected_dem[x, y] = new_elevations[i]
 
-        return corrected_dem
+        return unpad_array(corrected_dem)
+
+    def apply_footprint(self, elevations: np.ndarray, footprint: DrainageFootprint,
+                        resolution: float) -> None:
+        """
+        Applies the normalized excavation method to a drainage footprint in place.
+
+        Args:
+            elevations: Elevation of each footprint cell, modified in place
+            footprint: Drainage footprint
+            resolution: Raster resolution
+        """
+        # All new elevations come from the original neighbors
+        min_neighbors = first_min(elevations[footprint.neighbor_slots])
+        elevations[footprint.slots] = min_neighbors - self.gradient
 
 class NormalExcavationModifiedMethod(FlowEnforcementStrategy):
     """Implementation of the modified normalized excavation method."""
 
-    def apply(self, dem_data: np.ndarray, drainage_data: np.ndarray,
-              resolution: float) -> np.ndarray:
+    def apply(self, dem_data: np.ndarray, drainage_data: Union[np.ndarray, DrainageGraph],
+              resolution: float, in_place: bool = False) -> np.ndarray:
         """
         Applies the modified normalized excavation method processing by flow values.
 
         Args:
             dem_data: DEM data
-            drainage_data: Rasterized drainage data  
+            drainage_data: Rasterized drainage data or its DrainageGraph
             resolution: Raster resolution
+            in_place: Whether dem_data and a drainage raster may be modified
 
         Returns:
             Corrected DEM using modified normal excavation
         """
-        corrected_dem = dem_data.copy()
+        corrected_dem = pad_array(dem_data, PAD_ELEVATION, in_place)
 
-        # Obtener valores únicos de flujo acumulado
-        flow_values = drainage_data.ravel()
-        valid_flow_values = flow_values[flow_values >= FLOW_ACCUMULATION_THRESHOLD]
-        unique_values = np.unique(valid_flow_values)
+        # Group drainage cells by accumulated flow value once
+        flow_index = self.get_drainage_graph(drainage_data).get_flow_levels(padded=True)
 
         # Process flow values
-        for flow_value in tqdm(unique_values, desc=PROGRESS_MESSAGES['processing']):
-            indices = np.argwhere(drainage_data == flow_value)
-
+        for flow_value, indices in tqdm(flow_index, total=len(flow_index),
+                                        desc=PROGRESS_MESSAGES['processing']):
             for index in indices:
                 neighbors = get_neighbors(corrected_dem, index)
                 min_neighbor = min(neighbors[:, 0])
                 corrected_dem[index[0], index[1]] = min_neighbor - self.gradient
 
-        return corrected_dem
\ No newline at end of file
+        return unpad_array(corrected_dem)
+
+    def apply_footprint(self, elevations: np.ndarray, footprint: DrainageFootprint,
+                        resolution: float) -> None:
+        """
+        Applies the modified normalized excavation method to a drainage footprint in place.
+
+        Cells are updated by dependency layers of the drainage graph, which
+        read the same neighbor values as the loop by flow values.
+
+        Args:
+            elevations: Elevation of each footprint cell, modified in place
+            footprint: Drainage footprint
+            resolution: Raster resolution
+        """
+        with tqdm(total=len(footprint.graph), desc=PROGRESS_MESSAGES['processing']) as progress:
+            for layer in footprint.graph.get_dependency_layers():
+                min_neighbors = first_min(elevations[footprint.neighbor_slots[layer]])
+                elevations[footprint.slots[layer]] = min_neighbors - self.gradient
+                progress.update(layer.size)
+
+def first_min(values: np.ndarray) -> np.ndarray:
+    """
+    Row minimum with the NaN handling of the built-in min.
+
+    ``min`` keeps a NaN found first and skips NaN values found later, since
+    every comparison with NaN is false.
+
+    Args:
+        values: N x 8 neighbor values
+
+    Returns:
+        Minimum of each row
+    """
+    values = values.astype(np.float64)
+    return np.where(np.isnan(values[:, 0]), np.nan, np.fmin.reduce(values, axis=1))
@@ -0,0 +1,41 @@
+"""
+Compiled implementation of the gbofe method.
+"""
+import numpy as np
+from typing import Union
+from gbofe.algorithms.gbofe_method import GBOFEMethod
+from gbofe.utils.drainage_graph import DrainageGraph
+from gbofe.utils.geometric_utils import D8Stencil, pad_array, unpad_array
+from gbofe.config import PAD_ELEVATION
+
+class GBOFECompiledMethod(GBOFEMethod):
+    """Implementation of gbofe method running the level loop in a compiled kernel."""
+
+    def apply(self, dem_data: np.ndarray, drainage_data: Union[np.ndarray, DrainageGraph],
+              resolution: float, in_place: bool = False) -> np.ndarray:
+        """
+        Applies the gbofe method with a kernel working over raw arrays.
+
+        The kernel reproduces ``GBOFEMethod._process_cell`` cell by cell
+        without allocating per cell. Flow values of the neighbors are read
+        from the drainage graph adjacency, so no dense copy of the drainage
+        raster is made. It is compiled with Numba when available and runs as
+        plain Python otherwise.
+
+        Args:
+            dem_data: DEM data
+            drainage_data: Rasterized drainage data or its DrainageGraph
+            resolution: Raster resolution
+            in_place: Whether dem_data and a drainage raster may be modified
+
+        Returns:
+            Corrected DEM using gbofe
+        """
+        graph = self.get_drainage_graph(drainage_data)
+        corrected_dem = pad_array(dem_data, PAD_ELEVATION, in_place)
+        slots = graph.get_padded_cells()
+        neighbor_slots = slots[:, None] + D8Stencil(corrected_dem.shape).offsets
+
+        self._process_levels(corrected_dem.ravel(), slots, neighbor_slots, graph, resolution)
+
+        return unpad_array(corrected_dem)
@@ -0,0 +1,147 @@
+"""
+Kernel of the gbofe method over raw arrays.
+"""
+import numpy as np
+from gbofe.utils.compiled import jit
+from gbofe.config import DIAGONAL_MULTIPLIER
+
+# Branches taken by a cell, in the order of the branch counts
+GBOFE_BRANCHES = ('no_flow_neighbor', 'non_positive_slope', 'single_max_flow',
+                  'multiple_max_flow', 'unchanged')
+NO_FLOW_NEIGHBOR, NON_POSITIVE_SLOPE, SINGLE_MAX_FLOW, MULTIPLE_MAX_FLOW, UNCHANGED = range(5)
+
+@jit
+def gbofe_levels(dem_data, slots, neighbor_slots, flow_values, indptr, indices, directions,
+                 nodes, offsets, levels, start, stop, resolution, gradient, branches, level_stats):
+    """
+    Processes the levels in [start, stop) of a flow level index in place.
+
+    dem_data holds the elevations of the drainage cells and their neighbors,
+    either a flattened padded DEM or a compact footprint. slots gives the
+    position of every drainage graph node in dem_data and neighbor_slots
+    the positions of its D8 neighbors; flow_values is the current flow of
+    each node and nodes the graph position of every cell of the index.
+    branches counts the cells taking each branch of GBOFE_BRANCHES and
+    level_stats the processed and rewritten cells of each level.
+    """
+    diagonal = resolution * DIAGONAL_MULTIPLIER
+
+    # Scratch buffers shared by every cell
+    neighbors = np.empty(8, dtype=np.int64)
+    flows = np.empty(8, dtype=np.int64)
+    slopes = np.empty(8, dtype=np.float64)
+    kept = np.empty(8, dtype=np.int64)
+
+    for level in range(start, stop):
+        current_flow = levels[level]
+
+        for position in range(offsets[level], offsets[level + 1]):
+            node = nodes[position]
+            cell = slots[node]
+
+            # Only the processed cell is zeroed, so this matches a scan at level start
+            if flow_values[node] != current_flow:
+                continue
+            level_stats[level, 0] += 1
+
+            # Non-drainage neighbors have no flow
+            flows[:] = 0
+            max_neighbor_flow = 0
+            for edge in range(indptr[node], indptr[node + 1]):
+                flows[directions[edge]] = flow_values[indices[edge]]
+                if flow_values[indices[edge]] > max_neighbor_flow:
+                    max_neighbor_flow = flow_values[indices[edge]]
+
+            if max_neighbor_flow == 0:
+                flow_values[node] = 0
+                branches[NO_FLOW_NEIGHBOR] += 1
+                continue
+
+            # np.float64 rather than float, which keeps float32 under Numba
+            current_elevation = np.float64(dem_data[cell])
+            for k in range(8):
+                neighbors[k] = neighbor_slots[node, k]
+                distance = diagonal if k % 2 != 0 else resolution
+                slopes[k] = (current_elevation - np.float64(dem_data[neighbors[k]])) / distance
+
+            # Lowest flow value above the current one
+            has_superior = False
+            min_superior = 0
+            for k in range(8):
+                if flows[k] > current_flow and (not has_superior or flows[k] < min_superior):
+                    min_superior = flows[k]
+                    has_superior = True
+
+            # Keep neighbors with a different flow, dropping all but the lowest superior flow
+            n_kept = 0
+            for k in range(8):
+                if flows[k] == current_flow:
+                    continue
+                if has_superior and flows[k] > current_flow and flows[k] != min_superior:
+                    continue
+                kept[n_kept] = k
+                n_kept += 1
+
+            if n_kept == 0:
+                raise ValueError("zero-size array to reduction operation maximum which has no identity")
+
+            # Maximum flow and maximum slope (NaN propagates like np.max)
+            max_flow = flows[kept[0]]
+            max_slope = slopes[kept[0]]
+            for j in range(1, n_kept):
+                k = kept[j]
+                if flows[k] > max_flow:
+                    max_flow = flows[k]
+                if np.isnan(slopes[k]) or slopes[k] > max_slope:
+                    if not np.isnan(max_slope):
+                        max_slope = slopes[k]
+
+            n_max_flow = 0
+            n_max_slope = 0
+            single_max_flow = 0
+            has_max_slope = False
+            for j in range(n_kept):
+                k = kept[j]
+                if slopes[k] == max_slope:
+                    n_max_slope += 1
+                if flows[k] == max_flow:
+                    n_max_flow += 1
+                    single_max_flow = j
+                    if slopes[k] == max_slope:
+                        has_max_slope = True
+
+            if max_slope <= 0:
+                # No positive slope: equalize elevation
+                for j in range(n_kept):
+                    k = kept[j]
+                    if flows[k] == max_flow:
+                        dem_data[neighbors[k]] = current_elevation
+                        level_stats[level, 1] += 1
+                flow_values[node] = 0
+                branches[NON_POSITIVE_SLOPE] += 1
+                continue
+
+            if n_max_flow == 1:
+                # Case 1: Only one neighbor with maximum flow
+                k = kept[single_max_flow]
+                if slopes[k] != max_slope or n_max_slope > 1:
+                    factor = diagonal if single_max_flow % 2 != 0 else resolution
+                    dem_data[neighbors[k]] = current_elevation - (max_slope + gradient) * factor
+                    flow_values[node] = 0
+                    level_stats[level, 1] += 1
+                    branches[SINGLE_MAX_FLOW] += 1
+                else:
+                    branches[UNCHANGED] += 1
+            elif (not has_max_slope) or n_max_flow < n_max_slope:
+                # Case 2: Multiple neighbors with maximum flow
+                corrected_slope = max_slope + gradient
+                for j in range(n_kept):
+                    k = kept[j]
+                    if flows[k] == max_flow:
+                        factor = diagonal if j % 2 != 0 else resolution
+                        dem_data[neighbors[k]] = current_elevation - corrected_slope * factor
+                        level_stats[level, 1] += 1
+                flow_values[node] = 0
+                branches[MULTIPLE_MAX_FLOW] += 1
+            else:
+                branches[UNCHANGED] += 1
@@ -2,50 +2,117 @@
 Implementation of gbofe (Gradient-Based Optimized Flow Enforcement) method.
 """
 import numpy as np
+from typing import Union
 from tqdm import tqdm
 from gbofe.algorithms.base_strategy import FlowEnforcementStrategy
-from gbofe.utils.geometric_utils import get_neighbors, get_slopes, get_factor
-from gbofe.config import FLOW_ACCUMULATION_THRESHOLD, PROGRESS_MESSAGES
+from gbofe.algorithms.gbofe_kernel import GBOFE_BRANCHES, gbofe_levels
+from gbofe.utils.drainage_footprint import DrainageFootprint
+from gbofe.utils.drainage_graph import DrainageGraph
+from gbofe.utils.geometric_utils import get_neighbors, get_slopes, get_factor, pad_array, unpad_array
+from gbofe.utils.drainage_index import FlowLevelIndex
+from gbofe.config import LEVEL_BATCH_SIZE, PAD_ELEVATION, PAD_FLOW, PROGRESS_MESSAGES
 
 class GBOFEMethod(FlowEnforcementStrategy):
     """Implementation of gbofe method."""
 
-    def apply(self, dem_data: np.ndarray, drainage_data: np.ndarray,
-              resolution: float) -> np.ndarray:
+    def apply(self, dem_data: np.ndarray, drainage_data: Union[np.ndarray, DrainageGraph],
+              resolution: float, in_place: bool = False) -> np.ndarray:
         """
         Applies the gbofe method with gradient-based optimization.
 
+        The branch taken by every cell and the processed and rewritten
+        cells of every level are collected in ``counters``.
+
         Args:
             dem_data: DEM data
-            drainage_data: Rasterized drainage data
+            drainage_data: Rasterized drainage data or its DrainageGraph
             resolution: Raster resolution
+            in_place: Whether dem_data and a drainage raster may be modified
 
         Returns:
             Corrected DEM using gbofe
         """
-        corrected_dem = dem_data.copy()
-        drainage_copy = drainage_data.copy()
+        corrected_dem = pad_array(dem_data, PAD_ELEVATION, in_place)
+        drainage_copy = pad_array(self.get_drainage_raster(drainage_data), PAD_FLOW, in_place)
 
-        # Get unique accumulated flow values
-        flow_values = drainage_data.ravel()
-        valid_flow_values = flow_values[flow_values >= FLOW_ACCUMULATION_THRESHOLD]
-        unique_values = np.unique(valid_flow_values)
+        # Group drainage cells by accumulated flow value once
+        flow_index = FlowLevelIndex(drainage_copy)
+        self._reset_counters()
+        level_stats = np.zeros((len(flow_index), 2), dtype=np.int64)
 
         # Process each flow value
-        for flow_value in tqdm(unique_values, desc=PROGRESS_MESSAGES['processing']):
-            indices = np.argwhere(drainage_copy == flow_value)
+        for level, (flow_value, indices) in enumerate(tqdm(flow_index, total=len(flow_index),
+                                                           desc=PROGRESS_MESSAGES['processing'])):
+            indices = flow_index.select_active(drainage_copy, indices, flow_value)
+            level_stats[level, 0] = len(indices)
 
             for index in indices:
-                self._process_cell(
+                level_stats[level, 1] += self._process_cell(
                     corrected_dem, drainage_copy, index,
                     flow_value, resolution
                 )
 
-        return corrected_dem
+        self._record_levels(flow_index.levels, level_stats)
+        return unpad_array(corrected_dem)
+
+    def apply_footprint(self, elevations: np.ndarray, footprint: DrainageFootprint,
+                        resolution: float) -> None:
+        """
+        Applies the gbofe method to a drainage footprint in place.
+
+        Cells are processed by the compiled kernel, which reproduces
+        ``_process_cell`` over the footprint slots.
+
+        Args:
+            elevations: Elevation of each footprint cell, modified in place
+            footprint: Drainage footprint
+            resolution: Raster resolution
+        """
+        self._process_levels(elevations, footprint.slots, footprint.neighbor_slots,
+                             footprint.graph, resolution)
+
+    def _process_levels(self, dem_data: np.ndarray, slots: np.ndarray, neighbor_slots: np.ndarray,
+                        graph: DrainageGraph, resolution: float) -> None:
+        """Runs the gbofe kernel over all flow levels of a drainage graph in batches."""
+        flow_values = graph.values.copy()
+
+        # Group drainage cells by accumulated flow value once
+        flow_index = graph.get_flow_levels()
+        self._reset_counters()
+        branches = np.zeros(len(GBOFE_BRANCHES), dtype=np.int64)
+        level_stats = np.zeros((len(flow_index), 2), dtype=np.int64)
+
+        # Process flow values in batches of levels
+        with tqdm(total=len(flow_index), desc=PROGRESS_MESSAGES['processing']) as progress:
+            for start in range(0, len(flow_index), LEVEL_BATCH_SIZE):
+                stop = min(start + LEVEL_BATCH_SIZE, len(flow_index))
+                gbofe_levels(
+                    dem_data, slots, neighbor_slots, flow_values,
+                    graph.indptr, graph.indices, graph.directions,
+                    flow_index.order, flow_index.offsets, flow_index.levels,
+                    start, stop, float(resolution), float(self.gradient), branches, level_stats
+                )
+                progress.update(stop - start)
+
+        for branch, count in zip(GBOFE_BRANCHES, branches):
+            self.counters.increment(branch, count)
+        self._record_levels(flow_index.levels, level_stats)
+
+    def _reset_counters(self) -> None:
+        """Clears the counters, listing every branch so that each run reports the same keys."""
+        self.counters.reset()
+        for branch in GBOFE_BRANCHES:
+            self.counters.increment(branch, 0)
+
+    def _record_levels(self, flow_values: np.ndarray, level_stats: np.ndarray) -> None:
+        """Records the processed and rewritten cells of every flow level in the counters."""
+        self.counters.increment('cells_rewritten', level_stats[:, 1].sum())
+        self.counters.record_levels('level_size', flow_values, level_stats[:, 0])
+        self.counters.record_levels('level_rewrites', flow_values, level_stats[:, 1])
 
     def _process_cell(self, dem_data: np.ndarray, drainage_data: np.ndarray,
-                      index: np.ndarray, current_flow: int, resolution: float) -> None:
-        """Processes an individual cell using the gbofe algorithm."""
+                      index: np.ndarray, current_flow: int, resolution: float) -> int:
+        """Processes an individual cell using the gbofe algorithm, returning the cells rewritten."""
 
         # Get neighbor values
         elevation_neighbors = get_neighbors(dem_data, index)
@@ -55,7 +122,8 @@ class GBOFEMethod(FlowEnforcementStrategy):
 
         if np.max(flow_neighbors[:, 0]) == 0:
             drainage_data[index[0], index[1]] = 0
-            return
+            self.counters.increment('no_flow_neighbor')
+            return 0
 
         # Calculate slopes
         slopes = get_slopes(elevation_neighbors[:, 0], current_elevation, resolution)
@@ -96,19 +164,21 @@ class GBOFEMethod(FlowEnforcementStrategy):
                     int(combined_matrix[neighbor_idx, 2])
                 ] = current_elevation
             drainage_data[index[0], index[1]] = 0
-        else:
-            # With positive slope: apply correction
-            self._apply_gbofe_correction(
-                dem_data, drainage_data, combined_matrix,
-                max_flow_indices, max_slope, current_elevation,
-                index, resolution
-            )
+            self.counters.increment('non_positive_slope')
+            return len(max_flow_indices)
+
+        # With positive slope: apply correction
+        return self._apply_gbofe_correction(
+            dem_data, drainage_data, combined_matrix,
+            max_flow_indices, max_slope, current_elevation,
+            index, resolution
+        )
 
     def _apply_gbofe_correction(self, dem_data: np.ndarray, drainage_data: np.ndarray,
                                 combined_matrix: np.ndarray, max_flow_indices: np.ndarray,
                                 max_slope: float, current_elevation: float,
-                                current_index: np.ndarray, resolution: float) -> None:
-        """Applies the specific gbofe correction."""
+                                current_index: np.ndarray, resolution: float) -> int:
+        """Applies the specific gbofe correction, returning the cells rewritten."""
 
         max_slope_indices = np.argwhere(combined_matrix[:, 3] == max_slope)
 
@@ -123,6 +193,8 @@ class GBOFEMethod(FlowEnforcementStrategy):
                     int(combined_matrix[neighbor_idx, 2])
                 ] = current_elevation - corrected_slope * factor
                 drainage_data[current_index[0], current_index[1]] = 0
+                self.counters.increment('single_max_flow')
+                return 1
         else:
             # Case 2: Multiple neighbors with maximum flow
             max_flow_slopes = combined_matrix[max_flow_indices[:, 0], 3]
@@ -137,4 +209,9 @@ class GBOFEMethod(FlowEnforcementStrategy):
                         int(combined_matrix[neighbor_idx, 1]),
                         int(combined_matrix[neighbor_idx, 2])
                     ] = current_elevation - corrected_slope * factor
-                drainage_data[current_index[0], current_index[1]] = 0
\ No newline at end of file
+                drainage_data[current_index[0], current_index[1]] = 0
+                self.counters.increment('multiple_max_flow')
+                return len(max_flow_indices)
+
+        self.counters.increment('unchanged')
+        return 0
\ No newline at end of file
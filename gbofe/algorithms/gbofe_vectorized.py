@@ -0,0 +1,173 @@
+"""
+Layer-batched vectorized implementation of the gbofe method.
+"""
+import numpy as np
+from typing import Iterator, Union
+from tqdm import tqdm
+from gbofe.algorithms.gbofe_method import GBOFEMethod
+from gbofe.utils.drainage_graph import DrainageGraph, peel_layers
+from gbofe.utils.drainage_index import FlowLevelIndex
+from gbofe.utils.geometric_utils import D8Stencil, get_distances, pad_array, unpad_array
+from gbofe.config import DIAGONAL_MULTIPLIER, PAD_ELEVATION, PAD_FLOW, PROGRESS_MESSAGES
+
+# Offsets of the 5x5 window whose cells share a neighbor with the center cell
+_WINDOW_ROWS, _WINDOW_COLS = np.mgrid[-2:3, -2:3].reshape(2, -1)
+_CONFLICT_ROW_OFFSETS = _WINDOW_ROWS[(_WINDOW_ROWS != 0) | (_WINDOW_COLS != 0)]
+_CONFLICT_COL_OFFSETS = _WINDOW_COLS[(_WINDOW_ROWS != 0) | (_WINDOW_COLS != 0)]
+
+class GBOFEVectorizedMethod(GBOFEMethod):
+    """Implementation of gbofe method processing layers of independent cells as NumPy batches."""
+
+    def apply(self, dem_data: np.ndarray, drainage_data: Union[np.ndarray, DrainageGraph],
+              resolution: float, in_place: bool = False) -> np.ndarray:
+        """
+        Applies the gbofe method processing layers of independent cells as batches.
+
+        A cell reads and writes its D8 neighbors, so it only depends on the
+        cells processed before it, in a lower flow level or earlier in
+        row-major order within its level, that lie in its 5x5 window. Cells
+        are peeled in layers whose cells wait on no unprocessed cell, across
+        flow levels, and every layer is evaluated and written at once with
+        the same values the sequential loop of ``GBOFEMethod`` would read.
+
+        Args:
+            dem_data: DEM data
+            drainage_data: Rasterized drainage data or its DrainageGraph
+            resolution: Raster resolution
+            in_place: Whether dem_data and a drainage raster may be modified
+
+        Returns:
+            Corrected DEM using gbofe
+        """
+        corrected_dem = pad_array(dem_data, PAD_ELEVATION, in_place)
+        drainage_copy = pad_array(self.get_drainage_raster(drainage_data), PAD_FLOW, in_place)
+        stencil = D8Stencil(corrected_dem.shape)
+
+        # Cells in processing order: by flow level, then row-major
+        flow_index = FlowLevelIndex(drainage_copy)
+        self._reset_counters()
+        levels = np.repeat(np.arange(len(flow_index)), np.diff(flow_index.offsets))
+        flow_values = flow_index.levels[levels]
+        level_stats = np.zeros((len(flow_index), 2), dtype=np.int64)
+        level_stats[:, 0] = np.diff(flow_index.offsets)
+
+        with tqdm(total=flow_index.cells.size, desc=PROGRESS_MESSAGES['processing']) as progress:
+            for layer in self._get_layers(flow_index.cells, corrected_dem.shape[1]):
+                rewrites = self._process_batch(
+                    corrected_dem.ravel(), drainage_copy.ravel(), stencil,
+                    flow_index.cells[layer], flow_values[layer], resolution
+                )
+                np.add.at(level_stats[:, 1], levels[layer], rewrites)
+                progress.update(layer.size)
+
+        self._record_levels(flow_index.levels, level_stats)
+        return unpad_array(corrected_dem)
+
+    @staticmethod
+    def _get_layers(cells: np.ndarray, width: int) -> Iterator[np.ndarray]:
+        """
+        Yields the cells in layers of cells that can be processed at once.
+
+        A cell waits on every cell processed before it in its 5x5 window,
+        since both may read or write a shared neighbor. Cells are flat
+        indices of a padded raster in processing order; window offsets that
+        step past a row end land on border cells, which are never drainage
+        cells.
+
+        Yields:
+            Positions in ``cells`` of the cells of each layer
+        """
+        order = np.argsort(cells, kind='stable')
+        sorted_cells = cells[order]
+        sources, targets = [], []
+
+        for row_offset, col_offset in zip(_CONFLICT_ROW_OFFSETS, _CONFLICT_COL_OFFSETS):
+            query = sorted_cells + row_offset * width + col_offset
+            positions = np.minimum(np.searchsorted(sorted_cells, query), len(cells) - 1)
+            found = sorted_cells[positions] == query
+
+            # Keep the edges going to cells processed later
+            source, target = order[found], order[positions[found]]
+            later = target > source
+            sources.append(source[later])
+            targets.append(target[later])
+
+        if len(cells) == 0:
+            return iter(())
+        return peel_layers(len(cells), np.concatenate(sources), np.concatenate(targets))
+
+    def _process_batch(self, dem_data: np.ndarray, drainage_data: np.ndarray,
+                       stencil: D8Stencil, cells: np.ndarray, current_flow: np.ndarray,
+                       resolution: float) -> np.ndarray:
+        """Processes independent cells at once, returning the cells rewritten by each of them."""
+        rewrites = np.zeros(len(cells), dtype=np.int64)
+        if len(cells) == 0:
+            return rewrites
+
+        # Get neighbor values
+        neighbors = stencil.neighbor_cells(cells)
+        elevations = stencil.gather(dem_data, cells).astype(np.float64)
+        flows = stencil.gather(drainage_data, cells)
+        current_elevation = dem_data[cells].astype(np.float64)
+
+        no_flow = flows.max(axis=1) == 0
+        drainage_data[cells[no_flow]] = 0
+
+        active = ~no_flow
+        cells, neighbors = cells[active], neighbors[active]
+        elevations, flows = elevations[active], flows[active]
+        current_elevation = current_elevation[active]
+        current_flow = current_flow[active, None]
+
+        # Calculate slopes
+        slopes = (current_elevation[:, None] - elevations) / get_distances(resolution)
+
+        # Remove neighbors with the current flow and all but the lowest superior flow
+        kept = flows != current_flow
+        superior = kept & (flows > current_flow)
+        min_superior = np.where(superior, flows, np.iinfo(flows.dtype).max).min(axis=1)
+        kept &= ~(superior & (flows != min_superior[:, None]))
+
+        if not kept.any(axis=1).all():
+            raise ValueError("zero-size array to reduction operation maximum which has no identity")
+
+        # Find neighbors with maximum flow and maximum slope
+        max_flow = np.where(kept, flows, np.iinfo(flows.dtype).min).max(axis=1)
+        max_flow_mask = kept & (flows == max_flow[:, None])
+        max_slope = np.where(kept, slopes, -np.inf).max(axis=1)
+        max_slope_mask = kept & (slopes == max_slope[:, None])
+
+        n_max_flow = max_flow_mask.sum(axis=1)
+        n_max_slope = max_slope_mask.sum(axis=1)
+        has_max_slope = (max_flow_mask & max_slope_mask).any(axis=1)
+
+        equalize = max_slope <= 0
+        correct = ~equalize & (~has_max_slope | np.where(
+            n_max_flow == 1,
+            n_max_slope > 1,
+            n_max_flow < n_max_slope
+        ))
+
+        # No positive slope: equalize elevation
+        targets = max_flow_mask & equalize[:, None]
+        dem_data[neighbors[targets]] = np.broadcast_to(
+            current_elevation[:, None], targets.shape
+        )[targets]
+
+        # With positive slope: apply correction, factor follows the position among kept neighbors
+        targets = max_flow_mask & correct[:, None]
+        kept_positions = np.cumsum(kept, axis=1) - 1
+        factors = np.where(kept_positions % 2 != 0, resolution * DIAGONAL_MULTIPLIER, resolution)
+        corrected = current_elevation[:, None] - (max_slope + self.gradient)[:, None] * factors
+        dem_data[neighbors[targets]] = corrected[targets]
+
+        updated = equalize | correct
+        drainage_data[cells[updated]] = 0
+
+        self.counters.increment('no_flow_neighbor', no_flow.sum())
+        self.counters.increment('non_positive_slope', equalize.sum())
+        self.counters.increment('single_max_flow', (correct & (n_max_flow == 1)).sum())
+        self.counters.increment('multiple_max_flow', (correct & (n_max_flow > 1)).sum())
+        self.counters.increment('unchanged', (~updated).sum())
+        rewrites[np.flatnonzero(active)[updated]] = max_flow_mask[updated].sum(axis=1)
+        return rewrites
@@ -0,0 +1,422 @@
+"""
+Non-interactive batch runner for flow enforcement jobs.
+
+Jobs are read from a manifest with one job per JSON object, YAML mapping
+or CSV row, holding the dem, drainage, method, gradient and output of the
+job and optionally its recursive, hierarchy, engine and lean settings.
+Without a recursive setting, the methods of RECURSIVE_METHODS use the
+recursive drainage hierarchy as in the interactive run:
+
+    python -m gbofe.batch jobs.csv --workers 4 --report report.json
+
+Jobs sharing their inputs are prepared once, jobs whose output is newer
+than their inputs and was written with the same settings are skipped, and
+every job reports its status and time. With a memory budget, jobs run out
+of core on a memory-mapped copy of their DEM.
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import time
+from collections.abc import Mapping
+from typing import Any, Dict, List, Optional, Tuple
+from gbofe.main import FlowEnforcementFactory
+from gbofe.models.dem_processor import DEMProcessor, ProcessingResult, apply_to_copy
+from gbofe.models.geo_data import OutputOptions
+from gbofe.models.out_of_core import OutOfCoreProcessor
+from gbofe.models.parallel import silence_process
+from gbofe.utils.drainage_cache import DrainageCache
+from gbofe.utils.file_operations import create_output_directory, get_dataset_files
+from gbofe.utils.instrumentation import QuietSink, set_sinks, stage
+from gbofe.exceptions import DEMProcessingError, InvalidFileFormatError, InvalidParameterError
+from gbofe.config import (
+    BATCH_SETTINGS_SUFFIX, RECURSIVE_METHODS, EnforcementEngine, FlowEnforcementMethod, HierarchyMode
+)
+
+class BatchJob:
+    """One flow enforcement job of a batch manifest."""
+
+    def __init__(self, index: int, dem: str, drainage: str, method: FlowEnforcementMethod,
+                 gradient: float, output: str, recursive: Optional[bool] = None,
+                 hierarchy: HierarchyMode = HierarchyMode.RASTER,
+                 engine: EnforcementEngine = EnforcementEngine.REFERENCE,
+                 lean: bool = False) -> None:
+        self.index = index
+        self.dem = dem
+        self.drainage = drainage
+        self.method = method
+        self.gradient = gradient
+        self.output = output
+        # Recursive by default for the methods the interactive run makes recursive
+        self.recursive = method in RECURSIVE_METHODS if recursive is None else recursive
+        self.hierarchy = hierarchy
+        self.engine = engine
+        self.lean = lean
+
+    @classmethod
+    def from_record(cls, index: int, record: Dict[str, Any], base_dir: str) -> 'BatchJob':
+        """
+        Creates a job from a manifest record.
+
+        Args:
+            index: Position of the job in the manifest
+            record: Field values, as strings or typed values
+            base_dir: Directory relative paths are resolved against
+
+        Returns:
+            Batch job
+        """
+        if not isinstance(record, Mapping):
+            raise InvalidParameterError(f"Job {index} must be an object, not {type(record).__name__}")
+
+        missing = [field for field in ('dem', 'drainage', 'method', 'gradient', 'output')
+                   if record.get(field) in (None, '')]
+        if missing:
+            raise InvalidParameterError(f"Job {index} is missing {', '.join(missing)}")
+
+        try:
+            return cls(
+                index=index,
+                dem=os.path.join(base_dir, str(record['dem'])),
+                drainage=os.path.join(base_dir, str(record['drainage'])),
+                method=FlowEnforcementMethod[str(record['method']).upper()],
+                gradient=float(record['gradient']),
+                output=os.path.join(base_dir, str(record['output'])),
+                recursive=None if record.get('recursive') in (None, '') else _parse_bool(record['recursive']),
+                hierarchy=HierarchyMode[str(record.get('hierarchy') or 'RASTER').upper()],
+                engine=EnforcementEngine[str(record.get('engine') or 'REFERENCE').upper()],
+                lean=_parse_bool(record.get('lean', False))
+            )
+        except (KeyError, ValueError) as e:
+            raise InvalidParameterError(f"Invalid value in job {index}: {e}")
+
+    def to_record(self) -> Dict[str, Any]:
+        """Gets the manifest record of the job, with absolute paths."""
+        return {
+            'dem': os.path.abspath(self.dem),
+            'drainage': os.path.abspath(self.drainage),
+            'method': self.method.name,
+            'gradient': self.gradient,
+            'output': os.path.abspath(self.output),
+            'recursive': self.recursive,
+            'hierarchy': self.hierarchy.name,
+            'engine': self.engine.name,
+            'lean': self.lean
+        }
+
+    def get_settings(self) -> Tuple:
+        """Gets everything that determines the output of the job."""
+        return self.get_input_key() + (self.method, self.gradient, self.engine)
+
+    def get_input_key(self) -> Tuple:
+        """Gets the key of the prepared data the job shares with other jobs."""
+        return (os.path.abspath(self.dem), os.path.abspath(self.drainage),
+                self.recursive, self.hierarchy, self.lean)
+
+    def get_settings_path(self) -> str:
+        """Gets the path of the settings file written next to the output."""
+        return os.path.splitext(self.output)[0] + BATCH_SETTINGS_SUFFIX
+
+    def get_settings_record(self, options: Optional[OutputOptions] = None) -> Dict[str, Any]:
+        """Gets the job record with the output options, as saved next to the output."""
+        return dict(self.to_record(), output_options=(options or OutputOptions()).to_record())
+
+    def save_settings(self, options: Optional[OutputOptions] = None) -> None:
+        """Saves the settings the output was written with."""
+        with open(self.get_settings_path(), 'w') as settings_file:
+            json.dump(self.get_settings_record(options), settings_file, indent=2)
+
+    def is_up_to_date(self, options: Optional[OutputOptions] = None) -> bool:
+        """
+        Checks whether the output is newer than every input file and was written with the same settings.
+
+        Raises:
+            OSError: If an input file is missing
+        """
+        if not os.path.isfile(self.output):
+            return False
+        inputs = [self.dem, self.drainage] + get_dataset_files(self.drainage)
+        if os.path.getmtime(self.output) < max(os.path.getmtime(path) for path in inputs):
+            return False
+
+        try:
+            with open(self.get_settings_path()) as settings_file:
+                return json.load(settings_file) == self.get_settings_record(options)
+        except (OSError, ValueError):
+            return False
+
+def load_jobs(manifest_path: str) -> List[BatchJob]:
+    """
+    Loads the jobs of a JSON, YAML or CSV manifest.
+
+    JSON and YAML manifests hold a list of jobs or a mapping with a
+    ``jobs`` list. Relative paths are relative to the manifest.
+
+    Args:
+        manifest_path: Manifest file path
+
+    Returns:
+        Jobs in manifest order
+    """
+    extension = os.path.splitext(manifest_path)[1].lower()
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+
+    try:
+        with open(manifest_path, newline='') as manifest_file:
+            if extension == '.csv':
+                records = list(csv.DictReader(manifest_file))
+            elif extension == '.json':
+                records = json.load(manifest_file)
+            elif extension in ('.yaml', '.yml'):
+                try:
+                    import yaml
+                except ImportError:
+                    raise InvalidFileFormatError("YAML manifests need PyYAML (pip install pyyaml)")
+                try:
+                    records = yaml.safe_load(manifest_file)
+                except yaml.YAMLError as e:
+                    raise InvalidFileFormatError(f"Invalid YAML manifest {manifest_path}: {e}")
+            else:
+                raise InvalidFileFormatError(f"Unsupported manifest format: {manifest_path}")
+    except json.JSONDecodeError as e:
+        raise InvalidFileFormatError(f"Invalid JSON manifest {manifest_path}: {e}")
+    except (OSError, csv.Error, UnicodeDecodeError) as e:
+        raise DEMProcessingError(f"Error loading batch manifest: {e}")
+
+    if records is None:
+        raise InvalidFileFormatError(f"Empty batch manifest: {manifest_path}")
+    if isinstance(records, Mapping):
+        if 'jobs' not in records:
+            raise InvalidFileFormatError(f"Batch manifest {manifest_path} has no jobs list")
+        records = records['jobs']
+    if not isinstance(records, list):
+        raise InvalidFileFormatError(f"The jobs of {manifest_path} must be a list")
+
+    jobs = [BatchJob.from_record(index, record, base_dir) for index, record in enumerate(records)]
+    check_outputs(jobs)
+    return jobs
+
+def check_outputs(jobs: List[BatchJob]) -> None:
+    """
+    Checks that no two jobs write the same output or settings file.
+
+    Jobs of a batch run at the same time in different workers, so two
+    jobs on one output, or on outputs sharing their settings file like
+    ``dem.tif`` and ``dem.tiff``, would overwrite each other.
+
+    Raises:
+        InvalidParameterError: If two jobs share an output or settings file
+    """
+    paths: Dict[str, BatchJob] = {}
+    for job in jobs:
+        for path in (os.path.abspath(job.output), os.path.abspath(job.get_settings_path())):
+            if path in paths:
+                raise InvalidParameterError(f"Jobs {paths[path].index} and {job.index} both write {path}")
+            paths[path] = job
+
+def run_batch(jobs: List[BatchJob], workers: int = 1, force: bool = False,
+              cache_dir: Optional[str] = None,
+              options: Optional[OutputOptions] = None,
+              memory_budget: Optional[int] = None,
+              scratch_dir: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Runs the jobs of a batch in a bounded process pool.
+
+    Jobs with the same inputs form a group processed by one worker, which
+    prepares the data once. Jobs whose output is up to date are skipped
+    unless forced. With a memory budget, each job
+    runs on an OutOfCoreProcessor shared by its group instead.
+
+    Args:
+        jobs: Batch jobs
+        workers: Worker processes, 1 to run in this process
+        force: Whether to run jobs whose output is up to date
+        cache_dir: Directory of the drainage cache shared by the workers
+        options: Layout, compression and type of the outputs
+        memory_budget: Memory for the drainage footprint and raster blocks of out-of-core jobs
+            in bytes, None to run in memory
+        scratch_dir: Directory of the scratch files of out-of-core jobs
+
+    Returns:
+        Report of each job, in manifest order
+
+    Raises:
+        InvalidParameterError: If two jobs write the same output
+    """
+    check_outputs(jobs)
+    reports, groups = _plan_groups(jobs, force, options)
+    tasks = [(group, cache_dir, options, memory_budget, scratch_dir)
+             for group in sorted(groups.values(), key=len, reverse=True)]
+
+    if workers <= 1 or len(tasks) <= 1:
+        results = map(_run_group, tasks)
+        for group_reports in results:
+            _print_reports(group_reports)
+            reports.extend(group_reports)
+    else:
+        with multiprocessing.Pool(min(workers, len(tasks)), silence_process) as pool:
+            for group_reports in pool.imap_unordered(_run_group, tasks):
+                _print_reports(group_reports)
+                reports.extend(group_reports)
+
+    return sorted(reports, key=lambda report: report['job'])
+
+def _plan_groups(jobs: List[BatchJob], force: bool,
+                 options: Optional[OutputOptions] = None) -> Tuple[List[Dict[str, Any]], Dict[Tuple, List[BatchJob]]]:
+    """Groups the jobs to run by input, reporting up-to-date jobs as skipped."""
+    reports = []
+    groups: Dict[Tuple, List[BatchJob]] = {}
+
+    for job in jobs:
+        if not force:
+            try:
+                up_to_date = job.is_up_to_date(options)
+            except OSError as e:
+                reports.append(_create_report(job, 'failed', 0.0, f"missing input: {e}"))
+                continue
+            if up_to_date:
+                reports.append(_create_report(job, 'skipped', 0.0, "output up to date"))
+                continue
+        groups.setdefault(job.get_input_key(), []).append(job)
+
+    _print_reports(reports)
+    return reports, groups
+
+def _run_group(task: Tuple[List[BatchJob], Optional[str], Optional[OutputOptions],
+                           Optional[int], Optional[str]]) -> List[Dict[str, Any]]:
+    """Prepares the shared inputs of a group of jobs once and runs each job."""
+    jobs, cache_dir, options, memory_budget, scratch_dir = task
+    if memory_budget is not None:
+        return _run_out_of_core(jobs, cache_dir, options, memory_budget, scratch_dir)
+    first = jobs[0]
+    start = time.time()
+
+    try:
+        cache = DrainageCache(cache_dir) if cache_dir else None
+        processor = DEMProcessor.from_files(first.dem, first.drainage, load_data=False, cache=cache)
+        dem_data, drainage_data = processor.prepare_data(first.recursive, first.hierarchy, lean=first.lean)
+        resolution = processor.dem_raster.get_resolution()
+    except Exception as e:
+        return [_create_report(job, 'failed', 0.0, f"preparation failed: {e}") for job in jobs]
+
+    # Preparation time is shared by the jobs of the group
+    prepare_time = (time.time() - start) / len(jobs)
+    reports = []
+
+    for position, job in enumerate(jobs):
+        start = time.time()
+        try:
+            strategy = FlowEnforcementFactory.create(job.method, job.gradient, job.engine)
+            if position == len(jobs) - 1:
+                # The last job may consume the prepared data
+                with stage('enforce', dem_data.size):
+                    corrected_dem = strategy.apply(dem_data, drainage_data, resolution, in_place=True)
+            else:
+                corrected_dem = apply_to_copy(strategy, dem_data, drainage_data, resolution)
+
+            create_output_directory(job.output)
+            ProcessingResult(corrected_dem, processor.dem_raster).save(job.output, options)
+            job.save_settings(options)
+            reports.append(_create_report(job, 'done', prepare_time + time.time() - start))
+        except Exception as e:
+            reports.append(_create_report(job, 'failed', prepare_time + time.time() - start, str(e)))
+
+    return reports
+
+def _run_out_of_core(jobs: List[BatchJob], cache_dir: Optional[str], options: Optional[OutputOptions],
+                     memory_budget: int, scratch_dir: Optional[str]) -> List[Dict[str, Any]]:
+    """Runs each job of a group on its own scratch copy of the DEM, sharing the drainage graph."""
+    first = jobs[0]
+    try:
+        cache = DrainageCache(cache_dir) if cache_dir else None
+        processor = OutOfCoreProcessor.from_files(first.dem, first.drainage, cache=cache,
+                                                  memory_budget=memory_budget, scratch_dir=scratch_dir)
+    except Exception as e:
+        return [_create_report(job, 'failed', 0.0, f"preparation failed: {e}") for job in jobs]
+
+    reports = []
+    for job in jobs:
+        start = time.time()
+        try:
+            strategy = FlowEnforcementFactory.create(job.method, job.gradient, job.engine)
+            result = processor.process(strategy, recursive=job.recursive, hierarchy=job.hierarchy)
+            create_output_directory(job.output)
+            result.save(job.output, options)
+            job.save_settings(options)
+            reports.append(_create_report(job, 'done', time.time() - start))
+        except Exception as e:
+            reports.append(_create_report(job, 'failed', time.time() - start, str(e)))
+
+    return reports
+
+def _create_report(job: BatchJob, status: str, seconds: float, message: str = '') -> Dict[str, Any]:
+    """Creates the report of a job."""
+    return {
+        'job': job.index,
+        'output': job.output,
+        'method': job.method.name,
+        'gradient': job.gradient,
+        'status': status,
+        'seconds': round(seconds, 3),
+        'message': message
+    }
+
+def _print_reports(reports: List[Dict[str, Any]]) -> None:
+    """Prints one status line per job report."""
+    icons = {'done': '✅', 'skipped': '⏭️ ', 'failed': '❌'}
+    for report in reports:
+        line = f"{icons[report['status']]} Job {report['job']}: {report['output']} ({report['seconds']:.2f} s)"
+        print(f"{line} {report['message']}".rstrip(), flush=True)
+
+def _parse_bool(value: Any) -> bool:
+    """Parses a boolean manifest field."""
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ('1', 'true', 'yes', 'y'):
+        return True
+    if text in ('', '0', 'false', 'no', 'n'):
+        return False
+    raise ValueError(f"not a boolean: {value}")
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Command line entry point of the batch runner."""
+    parser = argparse.ArgumentParser(description="Batch DEM flow enforcement")
+    parser.add_argument('manifest', help="JSON, YAML or CSV job manifest")
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--force', action='store_true', help="Run jobs whose output is up to date")
+    parser.add_argument('--cache-dir', help="Directory of the drainage cache")
+    parser.add_argument('--memory-budget', type=int,
+                        help="Run the jobs out of core, with this memory for the drainage footprint "
+                             "and raster blocks in bytes")
+    parser.add_argument('--scratch-dir', help="Directory of the scratch files of out-of-core jobs")
+    parser.add_argument('--report', help="JSON file receiving the job reports")
+    parser.add_argument('--quiet', action='store_true', help="Do not print stage timings")
+    OutputOptions.add_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.quiet:
+        set_sinks([QuietSink()])
+
+    try:
+        start = time.time()
+        reports = run_batch(load_jobs(args.manifest), args.workers, args.force, args.cache_dir,
+                            OutputOptions.from_args(args), args.memory_budget, args.scratch_dir)
+    except DEMProcessingError as e:
+        print(f"❌ Error in processing: {e}")
+        raise SystemExit(1)
+
+    if args.report:
+        with open(args.report, 'w') as report_file:
+            json.dump(reports, report_file, indent=2)
+
+    counts = {status: sum(report['status'] == status for report in reports)
+              for status in ('done', 'skipped', 'failed')}
+    print(f"\n📋 {counts['done']} done, {counts['skipped']} skipped, {counts['failed']} failed "
+          f"in {time.time() - start:.2f} seconds")
+    if counts['failed']:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
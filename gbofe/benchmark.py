@@ -0,0 +1,372 @@
+"""
+Synthetic-terrain benchmark of the processing stages and methods.
+
+Synthetic DEMs (tilted planes, fractal noise and valleys) are generated
+with a matching drainage network of trunks and tributaries at several
+sizes and network densities. Every method runs the full pipeline on each
+dataset, and the wall time, CPU time, cells per second and peak memory of
+each stage are written to a results file. Two results files are compared
+to find regressions:
+
+    python -m gbofe.benchmark run results.json --sizes 1000 2000 --densities 2 8
+    python -m gbofe.benchmark compare baseline.json results.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import tempfile
+import time
+import numpy as np
+import geopandas as gpd
+import rasterio
+import shapely
+from rasterio.transform import from_origin
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from gbofe.main import FlowEnforcementFactory
+from gbofe.models.dem_processor import DEMProcessor
+from gbofe.models.parallel import silence_process
+from gbofe.utils.instrumentation import StageEvent, StageSink, set_sinks
+from gbofe.exceptions import DEMProcessingError
+from gbofe.config import (
+    BENCHMARK_CRS, BENCHMARK_DENSITIES, BENCHMARK_MIN_SECONDS, BENCHMARK_REGRESSION_THRESHOLD,
+    BENCHMARK_RESOLUTION, BENCHMARK_SIZES, READ_BLOCK_ROWS, RECURSIVE_METHODS, EnforcementEngine,
+    FlowEnforcementMethod
+)
+
+# Gradient or carving depth of each method
+BENCHMARK_GRADIENTS = {
+    FlowEnforcementMethod.R_CARVE: 1.0,
+    FlowEnforcementMethod.NORMAL_EXCAVATION: 1.0,
+    FlowEnforcementMethod.NORMAL_EXCAVATION_MODIFIED: 1.0,
+    FlowEnforcementMethod.GBOFE: 0.001
+}
+
+# Rows of the drainage network per trunk and meander of the trunks, in cells
+TRUNK_SPACING = 1000
+MEANDER_AMPLITUDE = 40.0
+MEANDER_WAVELENGTH = 600.0
+
+def get_trunk_offset(rows: np.ndarray) -> np.ndarray:
+    """Gets the column offset of the trunk meanders at each row."""
+    return MEANDER_AMPLITUDE * np.sin(2 * np.pi * rows / MEANDER_WAVELENGTH)
+
+def get_trunk_spacing(size: int) -> float:
+    """Gets the columns between two trunks of a dataset."""
+    return size / max(1, size // TRUNK_SPACING)
+
+def generate_plane(rows: np.ndarray, cols: np.ndarray, size: int, rng: np.random.Generator) -> np.ndarray:
+    """Tilted plane, lowering towards the last row and slightly towards the last column."""
+    return (1000.0 - 0.05 * rows[:, None] - 0.01 * cols[None, :]).astype(np.float32)
+
+def generate_fractal(rows: np.ndarray, cols: np.ndarray, size: int, rng: np.random.Generator,
+                     octaves: int = 6) -> np.ndarray:
+    """Tilted plane with fractal value noise, octaves of bilinear random grids halving in amplitude."""
+    elevations = generate_plane(rows, cols, size, rng)
+    amplitude = 20.0
+    for octave in range(octaves):
+        cells = 2 ** (octave + 2)
+        grid = rng.standard_normal((cells + 1, cells + 1)).astype(np.float32)
+        y, x = rows * (cells / size), cols * (cells / size)
+        y0 = np.minimum(y.astype(np.int64), cells - 1)
+        x0 = np.minimum(x.astype(np.int64), cells - 1)
+        fy, fx = (y - y0).astype(np.float32), (x - x0).astype(np.float32)
+        along_rows = grid[y0] * (1 - fy[:, None]) + grid[y0 + 1] * fy[:, None]
+        elevations += amplitude * (along_rows[:, x0] * (1 - fx) + along_rows[:, x0 + 1] * fx)
+        amplitude /= 2
+    return elevations
+
+def generate_valleys(rows: np.ndarray, cols: np.ndarray, size: int, rng: np.random.Generator) -> np.ndarray:
+    """Tilted plane with V-shaped valleys along the meandering trunks of the drainage network."""
+    spacing = get_trunk_spacing(size)
+    shifted = (cols[None, :] - get_trunk_offset(rows)[:, None]) % spacing
+    distance = np.abs(shifted - spacing / 2)
+    return generate_plane(rows, cols, size, rng) + (0.2 * distance).astype(np.float32)
+
+TERRAINS: Dict[str, Callable] = {
+    'plane': generate_plane,
+    'fractal': generate_fractal,
+    'valleys': generate_valleys
+}
+
+def generate_dem(path: str, terrain: str, size: int, seed: int = 0) -> None:
+    """
+    Writes a synthetic DEM of size x size cells, generated by blocks of rows.
+
+    Args:
+        path: Output GeoTIFF path
+        terrain: Terrain name, a key of TERRAINS
+        size: Rows and columns of the DEM
+        seed: Seed of the random terrains
+    """
+    rng = np.random.default_rng(seed)
+    generator = TERRAINS[terrain]
+    cols = np.arange(size, dtype=np.float64)
+    state = rng.bit_generator.state
+
+    with rasterio.open(
+            path, 'w', driver='GTiff', height=size, width=size, count=1, dtype='float32',
+            crs=BENCHMARK_CRS, transform=from_origin(0, size * BENCHMARK_RESOLUTION,
+                                                     BENCHMARK_RESOLUTION, BENCHMARK_RESOLUTION),
+            nodata=-9999, tiled=True, BIGTIFF='IF_SAFER'
+    ) as dst:
+        for block_start in range(0, size, READ_BLOCK_ROWS):
+            block_stop = min(block_start + READ_BLOCK_ROWS, size)
+            # Every block draws the same random grids, so blocks join seamlessly
+            rng.bit_generator.state = state
+            block = generator(np.arange(block_start, block_stop, dtype=np.float64), cols, size, rng)
+            dst.write(block, 1, window=((block_start, block_stop), (0, size)))
+
+def generate_drainage(path: str, size: int, density: float, seed: int = 0) -> int:
+    """
+    Writes a synthetic drainage network of meandering trunks and tributaries.
+
+    Trunks run from the first to the last row along the valley floors,
+    and every trunk gets ``density`` tributaries per 1000 rows, each
+    joining it from either side. Lines are digitized from upstream to
+    downstream.
+
+    Args:
+        path: Output shapefile path
+        size: Rows and columns of the DEM
+        density: Tributaries per trunk and 1000 rows
+        seed: Seed of the tributary positions
+
+    Returns:
+        Number of lines
+    """
+    rng = np.random.default_rng(seed)
+    spacing = get_trunk_spacing(size)
+    n_tributaries = int(round(density * size / 1000))
+
+    def to_points(rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+        x = (cols + 0.5) * BENCHMARK_RESOLUTION
+        y = (size - rows - 0.5) * BENCHMARK_RESOLUTION
+        return np.column_stack([x, y])
+
+    lines = []
+    rows = np.arange(0, size, 10, dtype=np.float64)
+    for trunk in range(int(round(size / spacing))):
+        center = (trunk + 0.5) * spacing
+        lines.append(shapely.LineString(to_points(rows, center + get_trunk_offset(rows))))
+
+        for _ in range(n_tributaries):
+            junction = rng.uniform(0.1 * size, size - 1)
+            length = rng.uniform(0.05, 0.2) * size
+            side = rng.choice([-1, 1])
+            tributary_rows = np.linspace(max(0.0, junction - length), junction, 20)
+            progress = (tributary_rows - tributary_rows[0]) / max(tributary_rows[-1] - tributary_rows[0], 1)
+            tributary_cols = (center + get_trunk_offset(tributary_rows) +
+                              side * 0.4 * spacing * (1 - progress))
+            lines.append(shapely.LineString(to_points(tributary_rows, tributary_cols)))
+
+    gpd.GeoDataFrame(geometry=lines, crs=BENCHMARK_CRS).to_file(path)
+    return len(lines)
+
+class _RecordingSink(StageSink):
+    """Sink keeping the completed stages of a benchmark case."""
+
+    def __init__(self) -> None:
+        self.events: List[StageEvent] = []
+
+    def emit(self, event: StageEvent) -> None:
+        if event.kind == 'stop':
+            self.events.append(event)
+
+def _run_case(task: Tuple) -> List[Dict[str, Any]]:
+    """Runs the pipeline of one method on one dataset in a fresh process."""
+    dem_path, drainage_path, output_path, method_name, engine_name = task
+    method = FlowEnforcementMethod[method_name]
+    recorder = _RecordingSink()
+    set_sinks([recorder])
+
+    processor = DEMProcessor.from_files(dem_path, drainage_path)
+    strategy = FlowEnforcementFactory.create(method, BENCHMARK_GRADIENTS[method],
+                                             EnforcementEngine[engine_name])
+    result = processor.process(strategy, recursive=method in RECURSIVE_METHODS)
+    result.save(output_path)
+    os.remove(output_path)
+
+    return [{
+        'stage': event.stage,
+        'cells': event.cells,
+        'wall_time': event.wall_time,
+        'cpu_time': event.cpu_time,
+        'cells_per_second': event.cells / event.wall_time if event.cells and event.wall_time else None,
+        'peak_rss': event.peak_rss
+    } for event in recorder.events]
+
+def _generate_dataset(task: Tuple) -> int:
+    """Generates the DEM and drainage network of one dataset."""
+    dem_path, drainage_path, terrain, size, density = task
+    generate_dem(dem_path, terrain, size)
+    return generate_drainage(drainage_path, size, density)
+
+def _run_isolated(function: Callable, task: Tuple) -> Any:
+    """Runs a function in a new process, so its peak memory is its own."""
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1, silence_process) as pool:
+        result = pool.apply(function, (task,))
+        pool.close()
+        pool.join()
+    return result
+
+def run_benchmark(results_path: str, terrains: List[str], sizes: List[int], densities: List[float],
+                  methods: List[FlowEnforcementMethod],
+                  engine: EnforcementEngine = EnforcementEngine.REFERENCE,
+                  work_dir: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Runs every method on every synthetic dataset and writes the results.
+
+    Each dataset is generated and each case run in its own process, so
+    the peak memory of a case is not raised by the ones before it.
+
+    Args:
+        results_path: JSON results file path
+        terrains: Terrain names
+        sizes: Rows and columns of the DEMs
+        densities: Tributaries per trunk and 1000 rows
+        methods: Flow enforcement methods
+        engine: Implementation of the methods
+        work_dir: Directory of the generated datasets, a temporary one by default
+
+    Returns:
+        One record per case and stage
+    """
+    unknown = [terrain for terrain in terrains if terrain not in TERRAINS]
+    if unknown:
+        raise DEMProcessingError(f"Unknown terrains: {', '.join(unknown)}")
+
+    data_dir = work_dir or tempfile.mkdtemp(prefix='gbofe-benchmark-')
+    os.makedirs(data_dir, exist_ok=True)
+    records = []
+
+    try:
+        for terrain in terrains:
+            for size in sizes:
+                for density in densities:
+                    name = f"{terrain}_{size}_{density:g}"
+                    dem_path = os.path.join(data_dir, f"{name}.tif")
+                    drainage_path = os.path.join(data_dir, f"{name}.shp")
+                    n_lines = _run_isolated(_generate_dataset,
+                                            (dem_path, drainage_path, terrain, size, density))
+
+                    for method in methods:
+                        print(f"📋 {name}: {method.name} ({n_lines} drainage lines)", flush=True)
+                        case = {'terrain': terrain, 'size': size, 'density': density,
+                                'method': method.name, 'engine': engine.name}
+                        output_path = os.path.join(data_dir, f"{name}_{method.name.lower()}.tif")
+                        for stage in _run_isolated(_run_case, (dem_path, drainage_path, output_path,
+                                                               method.name, engine.name)):
+                            records.append({**case, **stage})
+                            print(f"   ⏱️  {stage['stage']}: {stage['wall_time']:.2f} s", flush=True)
+    finally:
+        if work_dir is None:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    results = {
+        'metadata': {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'processors': os.cpu_count()
+        },
+        'results': records
+    }
+    with open(results_path, 'w') as results_file:
+        json.dump(results, results_file, indent=2)
+
+    return records
+
+def compare_results(baseline_path: str, results_path: str,
+                    threshold: float = BENCHMARK_REGRESSION_THRESHOLD,
+                    min_seconds: float = BENCHMARK_MIN_SECONDS) -> List[Dict[str, Any]]:
+    """
+    Compares the stage times of two results files.
+
+    Stages taking less than ``min_seconds`` in both runs are left out, as
+    their times are dominated by noise.
+
+    Args:
+        baseline_path: Baseline results file path
+        results_path: New results file path
+        threshold: Relative slowdown reported as a regression
+        min_seconds: Shortest stage time compared
+
+    Returns:
+        One comparison per stage found in both files, with a regression flag
+    """
+    def load(path: str) -> Dict[Tuple, Dict[str, Any]]:
+        with open(path) as results_file:
+            records = json.load(results_file)['results']
+        return {(record['terrain'], record['size'], record['density'], record['method'],
+                 record['engine'], record['stage']): record for record in records}
+
+    baseline, results = load(baseline_path), load(results_path)
+    comparisons = []
+    for key in sorted(baseline.keys() & results.keys(), key=str):
+        before, after = baseline[key]['wall_time'], results[key]['wall_time']
+        if max(before, after) < min_seconds:
+            continue
+        ratio = after / before if before > 0 else float('inf')
+        comparisons.append({
+            'case': '/'.join(str(part) for part in key),
+            'baseline': before,
+            'time': after,
+            'ratio': ratio,
+            'peak_rss_ratio': (results[key]['peak_rss'] / baseline[key]['peak_rss']
+                               if baseline[key]['peak_rss'] and results[key]['peak_rss'] else None),
+            'regression': ratio > 1 + threshold
+        })
+    return comparisons
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Command line entry point of the benchmark."""
+    parser = argparse.ArgumentParser(description="Synthetic-terrain benchmark of DEM flow enforcement")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help="Run the benchmark and write its results")
+    run.add_argument('results')
+    run.add_argument('--terrains', nargs='+', choices=list(TERRAINS), default=list(TERRAINS))
+    run.add_argument('--sizes', nargs='+', type=int, default=list(BENCHMARK_SIZES))
+    run.add_argument('--densities', nargs='+', type=float, default=list(BENCHMARK_DENSITIES))
+    run.add_argument('--methods', nargs='+', choices=[method.name for method in FlowEnforcementMethod],
+                     default=[method.name for method in FlowEnforcementMethod])
+    run.add_argument('--engine', choices=[engine.name for engine in EnforcementEngine],
+                     default=EnforcementEngine.REFERENCE.name)
+    run.add_argument('--work-dir', help="Directory keeping the generated datasets")
+
+    compare = commands.add_parser('compare', help="Compare two results files")
+    compare.add_argument('baseline')
+    compare.add_argument('results')
+    compare.add_argument('--threshold', type=float, default=BENCHMARK_REGRESSION_THRESHOLD,
+                         help="Relative slowdown reported as a regression")
+
+    args = parser.parse_args(argv)
+    try:
+        if args.command == 'run':
+            run_benchmark(args.results, args.terrains, args.sizes, args.densities,
+                          [FlowEnforcementMethod[method] for method in args.methods],
+                          EnforcementEngine[args.engine], args.work_dir)
+            print(f"📁 Results saved in: {args.results}")
+            return
+
+        comparisons = compare_results(args.baseline, args.results, args.threshold)
+    except DEMProcessingError as e:
+        print(f"❌ Error in processing: {e}")
+        raise SystemExit(1)
+
+    for comparison in comparisons:
+        icon = '❌' if comparison['regression'] else '✅'
+        print(f"{icon} {comparison['case']}: {comparison['baseline']:.2f} s -> "
+              f"{comparison['time']:.2f} s ({comparison['ratio']:.2f}x)")
+    regressions = sum(comparison['regression'] for comparison in comparisons)
+    print(f"\n📋 {len(comparisons)} stages compared, {regressions} regressions")
+    if regressions:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 """
 Configs and constants for DEM processing.
 """
+import os
 import numpy as np
 from enum import Enum
 
@@ -11,10 +12,115 @@ class FlowEnforcementMethod(Enum):
     NORMAL_EXCAVATION_MODIFIED = 3
     GBOFE = 4
 
+class EnforcementEngine(Enum):
+    """Available implementations of the flow enforcement methods."""
+    REFERENCE = 1
+    COMPILED = 2
+    VECTORIZED = 3
+
+class OutputFormat(Enum):
+    """Available layouts of the output raster, or of the changes to the source raster."""
+    GTIFF = 1
+    TILED = 2
+    COG = 3
+    DELTA = 4
+    PATCH = 5
+
+class HierarchyMode(Enum):
+    """Available sources of the recursive drainage hierarchy."""
+    RASTER = 1
+    TOPOLOGY = 2
+
+# Methods using the recursive drainage hierarchy unless told otherwise, as in the interactive run
+RECURSIVE_METHODS = (FlowEnforcementMethod.NORMAL_EXCAVATION_MODIFIED, FlowEnforcementMethod.GBOFE)
+
 # Geometric constants
 DIAGONAL_MULTIPLIER = np.sqrt(2)
 FLOW_ACCUMULATION_THRESHOLD = 1
 
+# D8 neighbor offsets: North, Northeast, East, Southeast, South, Southwest, West, Northwest
+D8_ROW_OFFSETS = np.array([-1, -1, 0, 1, 1, 1, 0, -1])
+D8_COL_OFFSETS = np.array([0, 1, 1, 1, 0, -1, -1, -1])
+
+# Distance under which reach endpoints are the same network node
+REACH_SNAP_TOLERANCE = 1e-3
+
+# Values read for cells outside the raster
+PAD_ELEVATION = np.inf
+PAD_FLOW = 0
+
+# Engine configurations
+LEVEL_BATCH_SIZE = 256
+
+# Drainage cells closer than the reach share neighbors and form one component
+COMPONENT_REACH = 2
+COMPONENT_HALO = 1
+
+# Cells read around the drainage in corridor mode
+CORRIDOR_HALO = 1
+
+# Cells around the basins of a shard; the outer ring is left unchanged to check seams
+SHARD_HALO = 2
+SHARD_MANIFEST_NAME = "manifest.json"
+
+# Drainage cache configurations, the version changes with the entry layout
+DRAINAGE_CACHE_MAX_BYTES = 2 * 1024 ** 3
+DRAINAGE_CACHE_VERSION = 1
+
+# Rows read at once into a preallocated buffer in lean mode
+READ_BLOCK_ROWS = 1024
+
+# Memory for the drainage footprint and raster blocks of the out-of-core processor, in bytes
+OUT_OF_CORE_MEMORY_BUDGET = 512 * 1024 ** 2
+
+# Job server configurations, datasets kept loaded between jobs up to the cache size
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8750
+SERVER_CACHE_MAX_BYTES = 4 * 1024 ** 3
+SERVER_POLL_INTERVAL = 0.5
+# Finished jobs whose status the server keeps, the oldest are forgotten first
+SERVER_JOB_RETENTION = 1000
+
+# Output raster configurations: tile size, compression, threads and overview resampling of tiled outputs
+OUTPUT_TILE_SIZE = 512
+OUTPUT_COMPRESSION = "DEFLATE"
+OUTPUT_THREADS = "ALL_CPUS"
+OUTPUT_OVERVIEW_RESAMPLING = "average"
+
+# Extensions of the files written by sweeps, deltas are compressed NumPy archives
+RASTER_SUFFIX = ".tif"
+DELTA_SUFFIX = ".delta"
+
+# Run report written next to the output file
+RUN_REPORT_SUFFIX = "_report.json"
+
+# Settings of a batch job written next to its output, compared to skip up-to-date jobs
+BATCH_SETTINGS_SUFFIX = "_job.json"
+
+# State of a run written next to the output file, read by incremental updates
+RUN_STATE_SUFFIX = "_state.npz"
+
+# Opt-in profiling of the enforce stage, enabled with GBOFE_PROFILE=cpu, memory or cpu,memory
+PROFILE_ENV = "GBOFE_PROFILE"
+PROFILE_DIR_ENV = "GBOFE_PROFILE_DIR"
+PROFILED_STAGES = ("enforce",)
+PROFILE_TOP_ENTRIES = 25
+
+# Synthetic-terrain benchmark configurations
+BENCHMARK_SIZES = (1000, 2000, 5000, 10000, 20000)
+BENCHMARK_DENSITIES = (2, 8)
+BENCHMARK_RESOLUTION = 10.0
+BENCHMARK_CRS = "EPSG:32633"
+BENCHMARK_REGRESSION_THRESHOLD = 0.1
+BENCHMARK_MIN_SECONDS = 0.05
+
+# Random cases of the equivalence harness and their largest number of rows and columns
+EQUIVALENCE_CASES = 200
+EQUIVALENCE_MAX_SIZE = 8
+
+# Digests of the outputs of the original implementation on the default equivalence cases
+EQUIVALENCE_GOLDEN = os.path.join(os.path.dirname(__file__), 'golden', 'equivalence.json')
+
 # File configurations
 SUPPORTED_RASTER_EXTENSIONS = [".tif", ".tiff"]
 SUPPORTED_VECTOR_EXTENSIONS = [".shp"]
@@ -27,11 +133,24 @@ METHOD_DESCRIPTIONS = {
     FlowEnforcementMethod.GBOFE: "Gradient-Based Optimized Flow Enforcement (gbofe)"
 }
 
+# Engine of the interactive run, asked to the user unless set in the environment
+ENGINE_ENV = "GBOFE_ENGINE"
+ENGINE_DESCRIPTIONS = {
+    EnforcementEngine.REFERENCE: "Reference implementation",
+    EnforcementEngine.COMPILED: "Compiled with Numba (GBOFE only, others use the reference)",
+    EnforcementEngine.VECTORIZED: "Vectorized with NumPy"
+}
+
 # Progress messages
 PROGRESS_MESSAGES = {
     'loading': 'Loading data',
     'rasterizing': 'Export to raster drainage shapefile',
     'processing': 'Processing DEM correction',
     'hierarchy': 'Creating drainage hierarchy',
+    'components': 'Processing drainage components',
+    'scratch': 'Copying DEM to scratch file',
+    'planning': 'Planning drainage shards',
+    'merging': 'Merging shard outputs',
+    'sweep': 'Running sweep combinations',
     'saving': 'Saving result'
 }
@@ -0,0 +1,48 @@
+"""
+Apply and revert tool of raster deltas.
+
+Runs saved with the DELTA output format write the changed cells of the
+corrected DEM, with their old and new values, instead of the full raster.
+A delta is applied to a copy of the source DEM, or reverted, by rewriting
+only the raster blocks holding changed cells:
+
+    python -m gbofe.delta apply dem_burn.delta dem.tif --output dem_burn.tif
+    python -m gbofe.delta revert dem_burn.delta dem_burn.tif
+"""
+import argparse
+import shutil
+from typing import List, Optional
+from gbofe.models.raster_delta import RasterDelta
+from gbofe.exceptions import DEMProcessingError
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Command line entry point of the delta tool."""
+    parser = argparse.ArgumentParser(description="Apply or revert a DEM delta")
+    commands = parser.add_subparsers(dest='command', required=True)
+    for command, help_text in (('apply', "Write the new values of a delta"),
+                               ('revert', "Write the old values of a delta back")):
+        step = commands.add_parser(command, help=help_text)
+        step.add_argument('delta')
+        step.add_argument('raster', help="Raster modified in place, or copied with --output")
+        step.add_argument('--output', help="Copy of the raster receiving the values")
+        step.add_argument('--force', action='store_true',
+                          help="Write the values even if the raster does not hold those they replace")
+
+    args = parser.parse_args(argv)
+    try:
+        delta = RasterDelta.load(args.delta)
+        raster_path = args.raster
+        if args.output:
+            shutil.copyfile(args.raster, args.output)
+            raster_path = args.output
+        blocks = delta.apply(raster_path, revert=args.command == 'revert', check=not args.force)
+    except (DEMProcessingError, OSError) as e:
+        print(f"❌ Error in processing: {e}")
+        raise SystemExit(1)
+
+    print(f"✅ {len(delta):,} cells {'reverted' if args.command == 'revert' else 'applied'} "
+          f"in {blocks:,} blocks")
+    print(f"📁 File saved in: {raster_path}")
+
+if __name__ == "__main__":
+    main()
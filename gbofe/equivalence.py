@@ -0,0 +1,472 @@
+"""
+Differential equivalence harness of the enforcement engines.
+
+The reference implementations are the oracles: every other engine, and
+the graph, in-place and footprint paths of every engine, must give the
+same corrected DEM and counters cell by cell. The reference outputs are
+themselves checked against golden digests frozen from the original
+implementation, so a change of the reference semantics is also reported.
+Small random cases with ties, plateaus, NaN NoData cells and drainage on
+the raster edges are generated from a seed, and a case on which an
+engine differs is shrunk to a minimal counterexample, which is printed
+and saved:
+
+    python -m gbofe.equivalence check --cases 500 --seed 0
+    python -m gbofe.equivalence freeze golden.json
+    python -m gbofe.equivalence check --golden golden.json
+
+The shipped golden file holds the digests of the corrected DEMs given by
+the original implementation on the default cases, surrounded by a border
+of infinite elevations and no drainage, as the engines treat the cells
+beyond the raster edges.
+"""
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import numpy as np
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from gbofe.main import FlowEnforcementFactory
+from gbofe.models.parallel import ComponentPool
+from gbofe.utils.drainage_footprint import DrainageFootprint
+from gbofe.utils.drainage_graph import DrainageGraph
+from gbofe.utils.geometric_utils import create_padded_array, get_drainage_dtype
+from gbofe.exceptions import DEMProcessingError
+from gbofe.config import (
+    D8_COL_OFFSETS, D8_ROW_OFFSETS, EQUIVALENCE_CASES, EQUIVALENCE_GOLDEN, EQUIVALENCE_MAX_SIZE,
+    PAD_ELEVATION, PAD_FLOW,
+    EnforcementEngine, FlowEnforcementMethod
+)
+
+# Gradients and resolutions drawn for the cases, including steep gradients creating ties
+CASE_GRADIENTS = (0.001, 0.5, 1.0, 2.0)
+CASE_RESOLUTIONS = (0.5, 1.0, 10.0, 30.0)
+
+class EquivalenceCase:
+    """DEM, drainage raster and parameters of one equivalence case."""
+
+    def __init__(self, seed: int, dem: np.ndarray, drainage: np.ndarray,
+                 gradient: float, resolution: float) -> None:
+        self.seed = seed
+        self.dem = dem
+        self.drainage = drainage
+        self.gradient = gradient
+        self.resolution = resolution
+
+    def replace(self, dem: Optional[np.ndarray] = None,
+                drainage: Optional[np.ndarray] = None) -> 'EquivalenceCase':
+        """Gets a copy of the case with another DEM or drainage raster."""
+        return EquivalenceCase(self.seed, self.dem if dem is None else dem,
+                               self.drainage if drainage is None else drainage,
+                               self.gradient, self.resolution)
+
+    def save(self, path: str) -> None:
+        """Saves the case as a NumPy archive."""
+        np.savez(path, dem=self.dem, drainage=self.drainage,
+                 gradient=self.gradient, resolution=self.resolution, seed=self.seed)
+
+    def describe(self) -> str:
+        """Gets a printable description of the case."""
+        with np.printoptions(precision=6, linewidth=120):
+            return (f"seed {self.seed}, gradient {self.gradient}, resolution {self.resolution}, "
+                    f"{self.dem.dtype} DEM\nDEM:\n{self.dem}\nDrainage:\n{self.drainage}")
+
+class Mismatch:
+    """Difference between the reference output and a variant on one case."""
+
+    def __init__(self, method: FlowEnforcementMethod, variant: str, case: EquivalenceCase,
+                 message: str, cells: List[Tuple[int, int, Any, Any]]) -> None:
+        self.method = method
+        self.variant = variant
+        self.case = case
+        self.message = message
+        self.cells = cells
+
+    def describe(self) -> str:
+        """Gets a printable description of the mismatch."""
+        lines = [f"{self.method.name} {self.variant}: {self.message}", self.case.describe()]
+        lines += [f"  cell ({row}, {col}): reference {expected}, {self.variant} {actual}"
+                  for row, col, expected, actual in self.cells]
+        return '\n'.join(lines)
+
+def generate_case(seed: int, max_size: int = EQUIVALENCE_MAX_SIZE) -> EquivalenceCase:
+    """
+    Generates a random equivalence case.
+
+    Elevations are drawn from a few levels so that equal slopes and
+    plateaus are common, some cells are NaN, and the drainage is made of
+    random D8 walks with increasing flow values, often starting on the
+    raster edges and sharing cells and values where walks meet.
+
+    Args:
+        seed: Seed of the case
+        max_size: Largest number of rows and columns
+
+    Returns:
+        Equivalence case
+    """
+    rng = np.random.default_rng(seed)
+    height, width = rng.integers(1, max_size + 1, size=2)
+
+    levels = rng.integers(2, 6)
+    dem = rng.integers(0, levels, size=(height, width)).astype(np.float64)
+    if rng.random() < 0.5:
+        # Tilted surface keeping ties along the rows
+        dem += np.arange(height)[:, None] * rng.choice([0.0, 0.5, 1.0])
+    dem[rng.random((height, width)) < rng.choice([0.0, 0.05, 0.2])] = np.nan
+    if rng.random() < 0.3:
+        dem = dem.astype(np.float32)
+
+    drainage = np.zeros((height, width), dtype=np.int32)
+    for _ in range(rng.integers(1, 4)):
+        _add_walk(drainage, rng)
+    if rng.random() < 0.2:
+        # Unstructured flow values, beyond what rasterized networks give
+        drainage = np.where(rng.random((height, width)) < 0.5,
+                            rng.integers(1, 5, size=(height, width)), 0).astype(np.int32)
+
+    return EquivalenceCase(seed, dem, drainage,
+                           float(rng.choice(CASE_GRADIENTS)), float(rng.choice(CASE_RESOLUTIONS)))
+
+def _add_walk(drainage: np.ndarray, rng: np.random.Generator) -> None:
+    """Adds a random D8 walk with non-decreasing flow values to a drainage raster."""
+    height, width = drainage.shape
+    if rng.random() < 0.5:
+        # Start on an edge
+        row, col = (rng.integers(height), rng.choice([0, width - 1])) if rng.random() < 0.5 \
+            else (rng.choice([0, height - 1]), rng.integers(width))
+    else:
+        row, col = rng.integers(height), rng.integers(width)
+
+    value = int(rng.integers(1, 3))
+    for _ in range(rng.integers(1, height * width + 1)):
+        drainage[row, col] = max(drainage[row, col], value)
+        # Equal values on consecutive cells are ties of the flow
+        value += int(rng.random() < 0.7)
+        direction = rng.integers(8)
+        row = min(max(row + D8_ROW_OFFSETS[direction], 0), height - 1)
+        col = min(max(col + D8_COL_OFFSETS[direction], 0), width - 1)
+
+def get_variants(method: FlowEnforcementMethod,
+                 workers: int = 1) -> Dict[str, Callable[[EquivalenceCase], Tuple[np.ndarray, Dict]]]:
+    """
+    Gets the variants of a method compared with the reference output.
+
+    Every engine runs on the drainage raster, on its DrainageGraph, in
+    place on padded buffers and on the drainage footprint; engines falling
+    back to the reference implementation are listed once. With more than
+    one worker the components are also processed by a ComponentPool.
+
+    Args:
+        method: Flow enforcement method
+        workers: Worker processes of the pool variant, 1 for no pool variant
+
+    Returns:
+        Function running each variant on a case, by variant name
+    """
+    variants = {}
+    seen = set()
+    for engine in EnforcementEngine:
+        strategy_class = type(FlowEnforcementFactory.create(method, 1.0, engine))
+        if strategy_class in seen:
+            continue
+        seen.add(strategy_class)
+
+        paths = [('raster', _run_raster), ('graph', _run_graph),
+                 ('in-place', _run_in_place), ('footprint', _run_footprint)]
+        if workers > 1:
+            paths.append(('pool', lambda strategy, case: ComponentPool(workers).apply(
+                strategy, case.dem.copy(), case.drainage.copy(), case.resolution)))
+        for path, run in paths:
+            if engine == EnforcementEngine.REFERENCE and path == 'raster':
+                continue
+            variants[f"{engine.name}/{path}"] = _bind(method, engine, run)
+    return variants
+
+def run_reference(method: FlowEnforcementMethod, case: EquivalenceCase) -> Tuple[np.ndarray, Dict]:
+    """Runs the reference implementation of a method on a case, giving its DEM and counters."""
+    return _bind(method, EnforcementEngine.REFERENCE, _run_raster)(case)
+
+def _bind(method: FlowEnforcementMethod, engine: EnforcementEngine,
+          run: Callable) -> Callable[[EquivalenceCase], Tuple[np.ndarray, Dict]]:
+    """Binds a run path to a method and engine, silencing the progress bars."""
+    def run_case(case: EquivalenceCase) -> Tuple[np.ndarray, Dict]:
+        strategy = FlowEnforcementFactory.create(method, case.gradient, engine)
+        with contextlib.redirect_stderr(io.StringIO()):
+            corrected_dem = run(strategy, case)
+        return np.asarray(corrected_dem), strategy.counters.to_dict()
+    return run_case
+
+def _run_raster(strategy, case: EquivalenceCase) -> np.ndarray:
+    return strategy.apply(case.dem.copy(), case.drainage.copy(), case.resolution)
+
+def _run_graph(strategy, case: EquivalenceCase) -> np.ndarray:
+    return strategy.apply(case.dem.copy(), DrainageGraph.from_raster(case.drainage), case.resolution)
+
+def _run_in_place(strategy, case: EquivalenceCase) -> np.ndarray:
+    # Buffers as prepared in lean mode
+    dem_data = create_padded_array(case.dem.shape, case.dem.dtype, PAD_ELEVATION)
+    dem_data[...] = case.dem
+    drainage_data = create_padded_array(case.drainage.shape, get_drainage_dtype(case.drainage), PAD_FLOW)
+    drainage_data[...] = case.drainage
+    return strategy.apply(dem_data, drainage_data, case.resolution, in_place=True)
+
+def _run_footprint(strategy, case: EquivalenceCase) -> np.ndarray:
+    footprint = DrainageFootprint(DrainageGraph.from_raster(case.drainage))
+    corrected_dem = case.dem.copy()
+    elevations = footprint.gather(corrected_dem, corrected_dem.shape[0])
+    strategy.apply_footprint(elevations, footprint, case.resolution)
+    footprint.scatter(corrected_dem, elevations, corrected_dem.shape[0])
+    return corrected_dem
+
+def compare_outputs(method: FlowEnforcementMethod, variant: str, run: Callable,
+                    case: EquivalenceCase) -> Optional[Mismatch]:
+    """
+    Compares a variant with the reference on a case.
+
+    Outputs must have the same type and the same value or NaN in every
+    cell, counters must be equal, and a variant must fail when and only
+    when the reference fails.
+
+    Args:
+        method: Flow enforcement method
+        variant: Variant name
+        run: Function running the variant
+        case: Equivalence case
+
+    Returns:
+        Mismatch, None when the outputs are equivalent
+    """
+    if variant.endswith('/footprint'):
+        # Footprints hold float64 elevations, as read from the out-of-core scratch file
+        case = case.replace(dem=case.dem.astype(np.float64))
+
+    outcomes = []
+    for runner in (lambda: run_reference(method, case), lambda: run(case)):
+        try:
+            outcomes.append(runner())
+        except Exception as e:
+            outcomes.append(e)
+    expected, actual = outcomes
+
+    if isinstance(expected, Exception) or isinstance(actual, Exception):
+        if isinstance(expected, Exception) and isinstance(actual, Exception):
+            return None
+        return Mismatch(method, variant, case, f"reference raised {expected!r}, variant raised {actual!r}"
+                        if isinstance(expected, Exception) else f"variant raised {actual!r}", [])
+
+    (expected_dem, expected_counters), (actual_dem, actual_counters) = expected, actual
+    if expected_dem.shape != actual_dem.shape or expected_dem.dtype != actual_dem.dtype:
+        return Mismatch(method, variant, case, f"reference gives {expected_dem.dtype} {expected_dem.shape}, "
+                                               f"variant gives {actual_dem.dtype} {actual_dem.shape}", [])
+
+    differs = ~((expected_dem == actual_dem) | (np.isnan(expected_dem) & np.isnan(actual_dem)))
+    if differs.any():
+        cells = [(int(row), int(col), expected_dem[row, col], actual_dem[row, col])
+                 for row, col in np.argwhere(differs)]
+        return Mismatch(method, variant, case, f"{len(cells)} cells differ", cells)
+    if variant.endswith('/pool'):
+        # A pool without components lists no counts at all
+        expected_counters, actual_counters = (
+            dict(counters, counts={name: count for name, count in counters['counts'].items() if count})
+            for counters in (expected_counters, actual_counters)
+        )
+    if expected_counters != actual_counters:
+        return Mismatch(method, variant, case,
+                        f"counters differ: reference {expected_counters}, variant {actual_counters}", [])
+    return None
+
+def shrink_case(case: EquivalenceCase, fails: Callable[[EquivalenceCase], bool]) -> EquivalenceCase:
+    """
+    Shrinks a failing case to a minimal one that still fails.
+
+    Edge rows and columns are removed, drainage cells cleared, flow values
+    lowered and elevations simplified, one step at a time, until no step
+    keeps the case failing.
+
+    Args:
+        case: Failing case
+        fails: Whether a case still fails
+
+    Returns:
+        Smallest failing case found
+    """
+    changed = True
+    while changed:
+        changed = False
+        for candidate in _shrink_steps(case):
+            if fails(candidate):
+                case = candidate
+                changed = True
+                break
+    return case
+
+def _shrink_steps(case: EquivalenceCase):
+    """Yields the cases one simplification smaller than a case."""
+    height, width = case.dem.shape
+    for rows, cols in ((slice(1, None), slice(None)), (slice(None, -1), slice(None)),
+                       (slice(None), slice(1, None)), (slice(None), slice(None, -1))):
+        dem = case.dem[rows, cols]
+        if dem.size:
+            yield case.replace(dem.copy(), case.drainage[rows, cols].copy())
+
+    for row, col in np.argwhere(case.drainage > 0):
+        drainage = case.drainage.copy()
+        drainage[row, col] = 0
+        yield case.replace(drainage=drainage)
+
+    for row, col in np.argwhere(case.drainage > 1):
+        drainage = case.drainage.copy()
+        drainage[row, col] -= 1
+        yield case.replace(drainage=drainage)
+
+    for row in range(height):
+        for col in range(width):
+            value = case.dem[row, col]
+            # NaN first becomes a number, numbers move towards zero
+            simpler = 0.0 if np.isnan(value) else np.trunc(value / 2)
+            if simpler != value:
+                dem = case.dem.copy()
+                dem[row, col] = simpler
+                yield case.replace(dem=dem)
+
+def check_equivalence(methods: List[FlowEnforcementMethod], cases: int, seed: int = 0,
+                      workers: int = 1, max_size: int = EQUIVALENCE_MAX_SIZE) -> List[Mismatch]:
+    """
+    Compares every variant of the methods with the reference on random cases.
+
+    The first mismatch of each variant is shrunk to a minimal
+    counterexample, and the variant is not checked on later cases.
+
+    Args:
+        methods: Methods to check
+        cases: Number of random cases
+        seed: Seed of the first case, the others follow
+        workers: Worker processes of the pool variant, 1 for no pool variant
+        max_size: Largest number of rows and columns of a case
+
+    Returns:
+        Minimal mismatch of each failing variant
+    """
+    mismatches = []
+    for method in methods:
+        variants = get_variants(method, workers)
+        for case_seed in range(seed, seed + cases):
+            case = generate_case(case_seed, max_size)
+            for variant, run in list(variants.items()):
+                if compare_outputs(method, variant, run, case) is None:
+                    continue
+                minimal = shrink_case(case, lambda candidate: compare_outputs(
+                    method, variant, run, candidate) is not None)
+                mismatches.append(compare_outputs(method, variant, run, minimal))
+                del variants[variant]
+    return mismatches
+
+def get_reference_digests(methods: List[FlowEnforcementMethod], cases: int, seed: int = 0,
+                          max_size: int = EQUIVALENCE_MAX_SIZE) -> Dict[str, str]:
+    """
+    Gets a digest of the reference output of every method on every case.
+
+    Args:
+        methods: Methods to digest
+        cases: Number of random cases
+        seed: Seed of the first case
+        max_size: Largest number of rows and columns of a case
+
+    Returns:
+        SHA-256 digest of the type, shape and cells of the corrected DEM, or of the
+        error raised, by method and case seed
+    """
+    digests = {}
+    for method in methods:
+        for case_seed in range(seed, seed + cases):
+            digest = hashlib.sha256()
+            try:
+                corrected_dem, _ = run_reference(method, generate_case(case_seed, max_size))
+                digest.update(f"{corrected_dem.dtype}{corrected_dem.shape}".encode())
+                digest.update(np.ascontiguousarray(corrected_dem).tobytes())
+            except Exception as e:
+                digest.update(type(e).__name__.encode())
+            digests[f"{method.name}/{case_seed}"] = digest.hexdigest()
+    return digests
+
+def check_golden(golden_path: str = EQUIVALENCE_GOLDEN) -> List[str]:
+    """
+    Checks that the reference outputs still match a golden file.
+
+    Args:
+        golden_path: Golden file written by freeze, the shipped one by default
+
+    Returns:
+        Keys of the cases whose reference output changed
+    """
+    try:
+        with open(golden_path) as golden_file:
+            golden = json.load(golden_file)
+    except (OSError, ValueError) as e:
+        raise DEMProcessingError(f"Error loading golden file: {e}")
+
+    methods = sorted({FlowEnforcementMethod[key.split('/')[0]] for key in golden['digests']},
+                     key=lambda method: method.value)
+    digests = get_reference_digests(methods, golden['cases'], golden['seed'], golden['max_size'])
+    return [key for key, digest in golden['digests'].items() if digests.get(key) != digest]
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Command line entry point of the equivalence harness."""
+    parser = argparse.ArgumentParser(description="Differential equivalence of the enforcement engines")
+    commands = parser.add_subparsers(dest='command', required=True)
+    method_names = [method.name for method in FlowEnforcementMethod]
+
+    check = commands.add_parser('check', help="Compare every engine with the reference")
+    check.add_argument('--methods', nargs='+', choices=method_names, default=method_names)
+    check.add_argument('--cases', type=int, default=EQUIVALENCE_CASES)
+    check.add_argument('--seed', type=int, default=0)
+    check.add_argument('--max-size', type=int, default=EQUIVALENCE_MAX_SIZE)
+    check.add_argument('--workers', type=int, default=1, help="Also check a pool of this many workers")
+    check.add_argument('--golden', default=EQUIVALENCE_GOLDEN, help="Golden file the reference outputs must match")
+    check.add_argument('--no-golden', action='store_true', help="Only compare the engines with the reference")
+    check.add_argument('--output-dir', help="Directory receiving the counterexamples")
+
+    freeze = commands.add_parser('freeze', help="Record the reference outputs in a golden file")
+    freeze.add_argument('golden')
+    freeze.add_argument('--methods', nargs='+', choices=method_names, default=method_names)
+    freeze.add_argument('--cases', type=int, default=EQUIVALENCE_CASES)
+    freeze.add_argument('--seed', type=int, default=0)
+    freeze.add_argument('--max-size', type=int, default=EQUIVALENCE_MAX_SIZE)
+
+    args = parser.parse_args(argv)
+    methods = [FlowEnforcementMethod[method] for method in args.methods]
+    try:
+        if args.command == 'freeze':
+            golden = {'cases': args.cases, 'seed': args.seed, 'max_size': args.max_size,
+                      'digests': get_reference_digests(methods, args.cases, args.seed, args.max_size)}
+            with open(args.golden, 'w') as golden_file:
+                json.dump(golden, golden_file, indent=2)
+            print(f"📁 Golden file saved in: {args.golden}")
+            return
+
+        changed = [] if args.no_golden else check_golden(args.golden)
+        mismatches = check_equivalence(methods, args.cases, args.seed, args.workers, args.max_size)
+    except DEMProcessingError as e:
+        print(f"❌ Error in processing: {e}")
+        raise SystemExit(1)
+
+    for key in changed:
+        print(f"❌ Reference output changed: {key}")
+    for mismatch in mismatches:
+        print(f"\n❌ {mismatch.describe()}")
+        if args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
+            path = os.path.join(args.output_dir, f"{mismatch.method.name}-{mismatch.variant.replace('/', '-')}.npz")
+            mismatch.case.save(path)
+            print(f"📁 Counterexample saved in: {path}")
+
+    print(f"\n📋 {len(methods)} methods, {args.cases} cases: "
+          f"{len(mismatches)} mismatching variants, {len(changed)} changed reference outputs")
+    if mismatches or changed:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
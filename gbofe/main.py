@@ -1,29 +1,55 @@
 """
 Main entry point for DEM processing.
 """
+import os
 import time
+from typing import Optional
 from gbofe.models.dem_processor import DEMProcessor
 from gbofe.algorithms.carve_method import RCarveMethod
+from gbofe.algorithms.carve_vectorized import RCarveVectorizedMethod
 from gbofe.algorithms.excavation_methods import NormalExcavationMethod, NormalExcavationModifiedMethod
+from gbofe.algorithms.excavation_vectorized import (
+    NormalExcavationVectorizedMethod, NormalExcavationModifiedVectorizedMethod
+)
 from gbofe.algorithms.gbofe_method import GBOFEMethod
-from gbofe.utils.ui_helpers import get_user_input
-from gbofe.config import FlowEnforcementMethod
+from gbofe.algorithms.gbofe_compiled import GBOFECompiledMethod
+from gbofe.algorithms.gbofe_vectorized import GBOFEVectorizedMethod
+from gbofe.utils.instrumentation import ConsoleSink, JsonReportSink, close_sinks, set_sinks
+from gbofe.utils.ui_helpers import get_engine, get_user_input
+from gbofe.config import FlowEnforcementMethod, EnforcementEngine, RUN_REPORT_SUFFIX
 from gbofe.exceptions import DEMProcessingError
 
 class FlowEnforcementFactory:
     """Factory to create flow enforcement strategies."""
 
     @staticmethod
-    def create(method: FlowEnforcementMethod, gradient: float):
-        """Creates the appropriate strategy based on the selected method."""
+    def create(method: FlowEnforcementMethod, gradient: float,
+               engine: EnforcementEngine = EnforcementEngine.REFERENCE):
+        """
+        Creates the appropriate strategy based on the selected method.
+
+        Methods without a dedicated implementation for the requested engine
+        fall back to the reference implementation.
+        """
         strategy_map = {
             FlowEnforcementMethod.R_CARVE: RCarveMethod,
             FlowEnforcementMethod.NORMAL_EXCAVATION: NormalExcavationMethod,
             FlowEnforcementMethod.NORMAL_EXCAVATION_MODIFIED: NormalExcavationModifiedMethod,
             FlowEnforcementMethod.GBOFE: GBOFEMethod
         }
+        engine_map = {
+            EnforcementEngine.COMPILED: {
+                FlowEnforcementMethod.GBOFE: GBOFECompiledMethod
+            },
+            EnforcementEngine.VECTORIZED: {
+                FlowEnforcementMethod.R_CARVE: RCarveVectorizedMethod,
+                FlowEnforcementMethod.NORMAL_EXCAVATION: NormalExcavationVectorizedMethod,
+                FlowEnforcementMethod.NORMAL_EXCAVATION_MODIFIED: NormalExcavationModifiedVectorizedMethod,
+                FlowEnforcementMethod.GBOFE: GBOFEVectorizedMethod
+            }
+        }
 
-        strategy_class = strategy_map.get(method)
+        strategy_class = engine_map.get(engine, {}).get(method, strategy_map.get(method))
         if strategy_class is None:
             raise ValueError(f"Method not supported: {method}")
 
@@ -31,26 +57,38 @@ class FlowEnforcementFactory:
 
 def main():
     """Main program function."""
+    report = None
     try:
         # Get user parameters
         print("=== DEM Flow Enforcement Processor ===\n")
 
         dem_path, drainage_path, gradient, output_path, method, recursive = get_user_input()
+        engine = get_engine()
 
-        print(f"\nStarting processing with method: {method.name}")
+        print(f"\nStarting processing with method: {method.name}, engine: {engine.name}")
         start_time = time.time()
 
-        # Create processor
-        processor = DEMProcessor.from_files(dem_path, drainage_path)
+        # Report stage timings on the console and next to the output
+        report_path = os.path.splitext(output_path)[0] + RUN_REPORT_SUFFIX
+        report = JsonReportSink(report_path, {
+            'dem': dem_path, 'drainage': drainage_path, 'output': output_path,
+            'method': method.name, 'gradient': gradient, 'recursive': recursive, 'engine': engine.name
+        })
+        set_sinks([ConsoleSink(), report])
+
+        # Create processor, the DEM is read once so it is not kept loaded
+        processor = DEMProcessor.from_files(dem_path, drainage_path, load_data=False)
 
         # Create strategy
-        strategy = FlowEnforcementFactory.create(method, gradient)
+        strategy = FlowEnforcementFactory.create(method, gradient, engine)
 
         # Process
         result = processor.process(strategy, recursive=recursive)
 
         # Save result
         result.save(output_path)
+        report.add_section('counters', result.counters)
+        report.add_section('status', 'completed')
 
         # Show execution time
         end_time = time.time()
@@ -62,10 +100,27 @@ def main():
 
     except DEMProcessingError as e:
         print(f"❌ Error in processing: {e}")
-    except KeyboardInterrupt:
+        _record_error(report, 'failed', e)
+    except KeyboardInterrupt as e:
         print("\n⚠️  Processing canceled by the user")
+        _record_error(report, 'canceled', e)
     except Exception as e:
         print(f"❌ Unexpected error: {e}")
+        _record_error(report, 'failed', e)
+    finally:
+        # The report is most useful when a run fails, so it is always written
+        try:
+            close_sinks()
+            if report is not None:
+                print(f"📋 Run report saved in: {report.report_path}")
+        except OSError as e:
+            print(f"❌ Error saving run report: {e}")
+
+def _record_error(report: Optional[JsonReportSink], status: str, error: BaseException) -> None:
+    """Records the status of a failed or canceled run and its error in the run report."""
+    if report is not None:
+        report.add_section('status', status)
+        report.add_section('error', {'type': type(error).__name__, 'message': str(error)})
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
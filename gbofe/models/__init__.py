@@ -1,7 +1,13 @@
 """
 Data models module for DEM processing.
 """
-from gbofe.models.geo_data import GeoDataRaster, GeoDataVector
+from gbofe.models.geo_data import GeoDataRaster, GeoDataVector, OutputOptions
 from gbofe.models.dem_processor import DEMProcessor
+from gbofe.models.raster_delta import RasterDelta
+from gbofe.models.parallel import ComponentPool, SharedArrays
+from gbofe.models.out_of_core import OutOfCoreProcessor
 
-__all__ = ['GeoDataRaster', 'GeoDataVector', 'DEMProcessor']
\ No newline at end of file
+__all__ = [
+    'GeoDataRaster', 'GeoDataVector', 'OutputOptions', 'DEMProcessor', 'ComponentPool', 'SharedArrays',
+    'OutOfCoreProcessor', 'RasterDelta'
+]
\ No newline at end of file
@@ -1,76 +1,230 @@
 """
 Main processor for DEM correction.
 """
+import os
+import shutil
 import numpy as np
-from typing import Tuple, Optional
-from gbofe.models.geo_data import GeoDataRaster, GeoDataVector
+from typing import Dict, Tuple, Optional
+from gbofe.models.geo_data import GeoDataRaster, GeoDataVector, OutputOptions
+from gbofe.models.parallel import ComponentPool
+from gbofe.models.raster_delta import RasterDelta, check_patchable
 from gbofe.algorithms.base_strategy import FlowEnforcementStrategy
-from gbofe.utils.geometric_utils import rasterize_drainage
-from gbofe.exceptions import DEMProcessingError
-from gbofe.config import PROGRESS_MESSAGES
+from gbofe.utils.drainage_cache import DrainageCache
+from gbofe.utils.drainage_graph import DrainageGraph
+from gbofe.utils.instrumentation import stage
+from gbofe.utils.geometric_utils import (
+    build_drainage_graph, create_padded_array, get_drainage_dtype
+)
+from gbofe.exceptions import DEMProcessingError, InvalidParameterError
+from gbofe.config import (
+    CORRIDOR_HALO, HierarchyMode, OutputFormat, PAD_ELEVATION, PAD_FLOW, PROGRESS_MESSAGES
+)
 
 class DEMProcessor:
     """Main processor for DEM flow correction."""
 
-    def __init__(self, dem_raster: GeoDataRaster, drainage_vector: GeoDataVector):
+    def __init__(self, dem_raster: GeoDataRaster, drainage_vector: GeoDataVector,
+                 cache: Optional[DrainageCache] = None):
         self.dem_raster = dem_raster
         self.drainage_vector = drainage_vector
+        self.cache = cache
         self._processed_data: Optional[np.ndarray] = None
+        self._drainage_graphs: Dict[Tuple[bool, HierarchyMode], DrainageGraph] = {}
+        # Rasters loaded by from_files belong to the processor, shared rasters are never released
+        self._owns_raster = False
 
     @classmethod
-    def from_files(cls, dem_path: str, drainage_path: str) -> 'DEMProcessor':
-        """Creates a processor from files."""
+    def from_files(cls, dem_path: str, drainage_path: str, load_data: bool = True,
+                   cache: Optional[DrainageCache] = None) -> 'DEMProcessor':
+        """
+        Creates a processor from files, reading the DEM by windows when load_data is False.
+
+        The processor owns the loaded DEM, which lean mode releases once it
+        is read into the working buffer.
+        """
         print(PROGRESS_MESSAGES['loading'])
-        dem_raster = GeoDataRaster(dem_path)
-        drainage_vector = GeoDataVector(drainage_path)
-        return cls(dem_raster, drainage_vector)
+        with stage('load') as event:
+            dem_raster = GeoDataRaster(dem_path, load_data=load_data)
+            drainage_vector = GeoDataVector(drainage_path)
+            event.cells = dem_raster.height * dem_raster.width
+        processor = cls(dem_raster, drainage_vector, cache=cache)
+        processor._owns_raster = True
+        return processor
+
+    def get_drainage_graph(self, recursive: bool = False,
+                           hierarchy: HierarchyMode = HierarchyMode.RASTER) -> DrainageGraph:
+        """Gets the drainage graph, built once for each hierarchy setting or loaded from the cache."""
+        key = (recursive, hierarchy)
+        if key not in self._drainage_graphs:
+            def build() -> DrainageGraph:
+                return build_drainage_graph(
+                    self.dem_raster, self.drainage_vector, recursive=recursive, hierarchy=hierarchy
+                )
+
+            if self.cache is None:
+                self._drainage_graphs[key] = build()
+            else:
+                self._drainage_graphs[key] = self.cache.get_or_build(
+                    self.dem_raster, self.drainage_vector, recursive, hierarchy, build
+                )
+        return self._drainage_graphs[key]
+
+    def prepare_data(self, recursive: bool = False,
+                     hierarchy: HierarchyMode = HierarchyMode.RASTER,
+                     window: Optional[Tuple[int, int, int, int]] = None,
+                     lean: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """Prepares data for processing, limited to a window when given."""
+        if lean:
+            return self._prepare_lean_data(recursive, hierarchy, window)
 
-    def prepare_data(self, recursive: bool = False) -> Tuple[np.ndarray, np.ndarray]:
-        """Prepares data for processing."""
         # Convert the drainage to a raster
-        drainage_raster = rasterize_drainage(
-            self.dem_raster,
-            self.drainage_vector,
-            recursive=recursive
-        )
-
-        # Create copies to modify
-        dem_data = np.copy(self.dem_raster.data.astype(np.float64))
+        drainage_raster = self.get_drainage_graph(recursive, hierarchy).to_raster(window=window)
+
+        # Create copies to modify, with NoData values replaced by NaN
+        dem_data = self.dem_raster.read_elevations(window)
         drainage_data = np.copy(drainage_raster.astype(np.int32))
 
-        # Replace NoData values with NaN
-        if self.dem_raster.nodata is not None:
-            dem_data = np.where(
-                dem_data == self.dem_raster.nodata,
-                np.nan,
-                dem_data
-            )
+        return dem_data, drainage_data
+
+    def _prepare_lean_data(self, recursive: bool, hierarchy: HierarchyMode,
+                           window: Optional[Tuple[int, int, int, int]]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Prepares data read straight into padded buffers owned by the strategy.
+
+        The DEM keeps its source float type and the drainage raster takes
+        the smallest integer type holding the hierarchy. A DEM loaded by
+        from_files is released once read, so it does not stay resident
+        next to the working buffer.
+        """
+        if window is None:
+            window = (0, self.dem_raster.height, 0, self.dem_raster.width)
+        shape = (window[1] - window[0], window[3] - window[2])
+        graph = self.get_drainage_graph(recursive, hierarchy)
+
+        dem_data = create_padded_array(shape, self.dem_raster.get_elevation_dtype(), PAD_ELEVATION)
+        self.dem_raster.read_elevations_into(dem_data, window)
+        if self._owns_raster:
+            self.dem_raster.release_data()
+
+        drainage_data = create_padded_array(shape, get_drainage_dtype(graph.values), PAD_FLOW)
+        graph.to_raster(window=window, out=drainage_data)
 
         return dem_data, drainage_data
 
-    def process(self, strategy: FlowEnforcementStrategy, recursive: bool = False) -> 'ProcessingResult':
-        """Processes the DEM using the specified strategy."""
+    def process(self, strategy: FlowEnforcementStrategy, recursive: bool = False,
+                hierarchy: HierarchyMode = HierarchyMode.RASTER,
+                workers: int = 1, corridor: bool = False,
+                window: Optional[Tuple[int, int, int, int]] = None,
+                lean: bool = False) -> 'ProcessingResult':
+        """
+        Processes the DEM using the specified strategy.
+
+        With more than one worker, independent drainage components are
+        processed in parallel by a ComponentPool. In corridor mode only the
+        window around the drainage network is read and corrected, since
+        strategies never change cells farther than one cell from it. An
+        explicit window is processed on its own, which is exact when it
+        holds complete drainage components, as the basins of a shard do.
+        In lean mode the DEM keeps its source type and the strategy corrects
+        the buffers it was given in place.
+        """
         try:
-            dem_data, drainage_data = self.prepare_data(recursive)
+            if corridor:
+                window = self.get_drainage_graph(recursive, hierarchy).get_window(CORRIDOR_HALO)
+            dem_data, drainage_data = self.prepare_data(recursive, hierarchy, window, lean)
 
-            corrected_dem = strategy.apply(
-                dem_data=dem_data,
-                drainage_data=drainage_data,
-                resolution=self.dem_raster.get_resolution()
-            )
+            with stage('enforce', dem_data.size):
+                if workers > 1:
+                    corrected_dem = ComponentPool(workers).apply(
+                        strategy, dem_data, drainage_data, self.dem_raster.get_resolution(), in_place=lean
+                    )
+                else:
+                    corrected_dem = strategy.apply(
+                        dem_data=dem_data,
+                        drainage_data=drainage_data,
+                        resolution=self.dem_raster.get_resolution(),
+                        in_place=lean
+                    )
 
-            return ProcessingResult(corrected_dem, self.dem_raster)
+            return ProcessingResult(corrected_dem, self.dem_raster, window, strategy.counters.to_dict())
 
         except Exception as e:
             raise DEMProcessingError(f"Error during processing: {e}")
 
+def apply_to_copy(strategy: FlowEnforcementStrategy, dem_data: np.ndarray,
+                  drainage_data: np.ndarray, resolution: float) -> np.ndarray:
+    """
+    Applies a strategy to a private copy of prepared data.
+
+    The copies are padded buffers owned by the strategy, so the prepared
+    data can be shared by several runs and is copied once per run.
+
+    Args:
+        strategy: Flow enforcement strategy
+        dem_data: Prepared DEM data, left unchanged
+        drainage_data: Prepared drainage raster, left unchanged
+        resolution: Raster resolution
+
+    Returns:
+        Corrected DEM
+    """
+    dem_copy = create_padded_array(dem_data.shape, dem_data.dtype, PAD_ELEVATION)
+    dem_copy[...] = dem_data
+    drainage_copy = create_padded_array(drainage_data.shape, drainage_data.dtype, PAD_FLOW)
+    drainage_copy[...] = drainage_data
+    with stage('enforce', dem_data.size):
+        return strategy.apply(dem_copy, drainage_copy, resolution, in_place=True)
+
 class ProcessingResult:
-    """Result of DEM processing."""
+    """Result of DEM processing, with the counters collected by the strategy."""
 
-    def __init__(self, corrected_data: np.ndarray, original_raster: GeoDataRaster):
+    def __init__(self, corrected_data: np.ndarray, original_raster: GeoDataRaster,
+                 window: Optional[Tuple[int, int, int, int]] = None,
+                 counters: Optional[Dict] = None):
         self.corrected_data = corrected_data
         self.original_raster = original_raster
+        self.window = window
+        self.counters = counters or {}
+
+    def save(self, output_path: str, options: Optional[OutputOptions] = None) -> None:
+        """
+        Saves the result to the specified path.
+
+        A window is patched into the original raster, and memory-mapped
+        data or data saved with output options is written block by block.
+        The DELTA format saves only the changed cells as a RasterDelta, and
+        PATCH copies the source raster and rewrites the blocks holding them,
+        in the source data type. PATCH rewrites the source raster itself
+        only when it is the output and the options allow it.
+
+        Args:
+            output_path: Output file path
+            options: Layout, compression and type of the output, a strip GeoTIFF by default
+        """
+        with stage('save', self.original_raster.height * self.original_raster.width):
+            if options is not None and options.output_format in (OutputFormat.DELTA, OutputFormat.PATCH):
+                self._save_changes(output_path, options)
+            elif self.window is not None:
+                self.original_raster.save_window(output_path, self.corrected_data, self.window, options)
+            elif isinstance(self.corrected_data, np.memmap):
+                self.original_raster.save_blocks(output_path, self.corrected_data, options)
+            else:
+                self.original_raster.save(output_path, self.corrected_data, options)
+
+    def _save_changes(self, output_path: str, options: OutputOptions) -> None:
+        """Saves the changed cells as a delta file or as blocks patched into a copy of the source raster."""
+        print(f"📋 {PROGRESS_MESSAGES['saving']}...")
+        if options.output_format == OutputFormat.DELTA:
+            RasterDelta.from_result(self.original_raster, self.corrected_data, self.window).save(output_path)
+            return
 
-    def save(self, output_path: str) -> None:
-        """Saves the result to the specified path."""
-        self.original_raster.save(output_path, self.corrected_data)
\ No newline at end of file
+        source_path = self.original_raster.file_path
+        in_place = os.path.exists(output_path) and os.path.samefile(source_path, output_path)
+        if in_place and not options.patch_source:
+            raise InvalidParameterError(f"The output {output_path} is the source DEM, "
+                                        f"which PATCH only rewrites in place with --patch-source")
+        delta = RasterDelta.from_result(self.original_raster, self.corrected_data, self.window)
+        check_patchable(source_path, delta.new_values)
+        if not in_place:
+            shutil.copyfile(source_path, output_path)
+        delta.apply(output_path, check=False)
@@ -1,25 +1,160 @@
 """
 Classes for handling geospatial data.
 """
+import argparse
+import copy
 import geopandas as gpd
 import rasterio
+import rasterio.shutil
 import numpy as np
-from typing import Optional, Any, Union
+import tempfile
+from contextlib import contextmanager, nullcontext
+from rasterio.enums import Resampling
+from rasterio.windows import Window
+from rasterio.windows import transform as window_transform
+from tqdm import tqdm
+from typing import Optional, Any, Dict, Iterator, List, Tuple, Union
 import os
 from gbofe.exceptions import InvalidFileFormatError, FileNoFoundError, DEMProcessingError
-from gbofe.config import PROGRESS_MESSAGES
+from gbofe.config import (
+    OUTPUT_COMPRESSION, OUTPUT_OVERVIEW_RESAMPLING, OUTPUT_THREADS, OUTPUT_TILE_SIZE,
+    PROGRESS_MESSAGES, READ_BLOCK_ROWS, OutputFormat
+)
+
+class OutputOptions:
+    """
+    Layout, compression and type of a saved raster.
+
+    GTIFF keeps the strip layout of the source profile. TILED writes a
+    tiled BigTIFF, and COG a Cloud-Optimized GeoTIFF converted from a
+    tiled file staged next to the output. Tiled outputs are written one
+    row of tiles at a time, so GDAL compresses the tiles of a row in
+    parallel with the configured threads. DELTA and PATCH save only the
+    changed cells and are handled by ProcessingResult; PATCH rewrites the
+    source DEM itself only when patch_source is set.
+    """
+
+    def __init__(self, output_format: OutputFormat = OutputFormat.GTIFF,
+                 compression: Optional[str] = None, predictor: Optional[int] = None,
+                 threads: Union[int, str] = OUTPUT_THREADS, overviews: bool = False,
+                 cast: bool = False, tile_size: int = OUTPUT_TILE_SIZE, patch_source: bool = False) -> None:
+        self.output_format = output_format
+        self.compression = compression
+        self.predictor = predictor
+        self.threads = threads
+        self.overviews = overviews
+        self.cast = cast
+        self.tile_size = tile_size
+        self.patch_source = patch_source
+
+    def to_record(self) -> Dict[str, Any]:
+        """Gets the options that change the saved file, as a JSON-serializable dictionary."""
+        return {
+            'output_format': self.output_format.name,
+            'compression': self.compression,
+            'predictor': self.predictor,
+            'overviews': self.overviews,
+            'cast': self.cast,
+            'tile_size': self.tile_size
+        }
+
+    @staticmethod
+    def add_arguments(parser: argparse.ArgumentParser) -> None:
+        """Adds the output options to a command line parser."""
+        parser.add_argument('--output-format', choices=[output_format.name for output_format in OutputFormat],
+                            default=OutputFormat.GTIFF.name,
+                            help="Layout of the output rasters, DELTA or PATCH to save the changed cells only")
+        parser.add_argument('--compression', help=f"Compression of the output rasters, "
+                                                  f"{OUTPUT_COMPRESSION} for tiled formats by default")
+        parser.add_argument('--predictor', type=int, choices=[1, 2, 3],
+                            help="TIFF predictor, 3 for float and 2 for integer outputs by default")
+        parser.add_argument('--output-threads', default=OUTPUT_THREADS, help="Compression threads")
+        parser.add_argument('--overviews', action='store_true', help="Build overviews of the output rasters")
+        parser.add_argument('--cast', action='store_true', help="Save in the data type of the source DEM")
+        parser.add_argument('--patch-source', action='store_true',
+                            help="Let PATCH rewrite the source DEM in place when it is the output")
+
+    @classmethod
+    def from_args(cls, args: argparse.Namespace) -> 'OutputOptions':
+        """Creates the output options from parsed command line arguments."""
+        return cls(OutputFormat[args.output_format], args.compression, args.predictor,
+                   args.output_threads, args.overviews, args.cast, patch_source=args.patch_source)
+
+    def get_compression(self) -> Optional[str]:
+        """Gets the compression, DEFLATE by default for tiled formats."""
+        if self.compression is None and self.output_format != OutputFormat.GTIFF:
+            return OUTPUT_COMPRESSION
+        return self.compression
+
+    def get_creation_options(self, dtype: np.dtype) -> Dict[str, Any]:
+        """
+        Gets the GTiff creation options of the file written by blocks.
+
+        Args:
+            dtype: Data type of the output
+
+        Returns:
+            Creation options to pass to rasterio.open
+        """
+        options: Dict[str, Any] = {}
+        compression = self.get_compression()
+        if compression is not None:
+            options['compress'] = compression
+            options['num_threads'] = str(self.threads)
+            if compression.upper() in ('DEFLATE', 'LZW', 'ZSTD'):
+                options['predictor'] = self.get_predictor(dtype)
+        if self.output_format != OutputFormat.GTIFF:
+            options.update(tiled=True, blockxsize=self.tile_size, blockysize=self.tile_size, bigtiff='IF_SAFER')
+        return options
+
+    def get_predictor(self, dtype: np.dtype) -> int:
+        """Gets the TIFF predictor, floating point for floats and horizontal for integers by default."""
+        if self.predictor is not None:
+            return self.predictor
+        return 3 if np.issubdtype(dtype, np.floating) else 2
+
+    def get_cog_options(self, dtype: np.dtype) -> Dict[str, Any]:
+        """Gets the creation options of the COG driver."""
+        predictor = {1: 'NO', 2: 'STANDARD', 3: 'FLOATING_POINT'}[self.get_predictor(dtype)]
+        return {
+            'compress': self.get_compression(),
+            'predictor': predictor,
+            'blocksize': self.tile_size,
+            'num_threads': str(self.threads),
+            'bigtiff': 'IF_SAFER',
+            'overviews': 'AUTO' if self.overviews else 'NONE',
+            'overview_resampling': OUTPUT_OVERVIEW_RESAMPLING.upper()
+        }
+
+    def get_overview_factors(self, height: int, width: int) -> List[int]:
+        """Gets the overview factors, halving the raster until it fits in one tile as the COG driver does."""
+        factors = [2]
+        while max(height, width) > factors[-1] * self.tile_size:
+            factors.append(factors[-1] * 2)
+        return factors
+
+    def get_windows(self, dst) -> Iterator[Window]:
+        """Gets the windows written at once: the blocks of a strip layout or full rows of tiles."""
+        if self.output_format == OutputFormat.GTIFF:
+            for _, block in dst.block_windows(1):
+                yield block
+            return
+        for row_start in range(0, dst.height, self.tile_size):
+            yield Window(0, row_start, dst.width, min(self.tile_size, dst.height - row_start))
 
 class GeoDataRaster:
     """Class for storing information about a raster file and its attributes."""
 
-    def __init__(self, file_path: str) -> None:
+    def __init__(self, file_path: str, load_data: bool = True) -> None:
         self.file_path = file_path
+        self.load_data = load_data
         self.data: Optional[np.ndarray] = None
         self.transform: Optional[Any] = None
         self.width: Optional[int] = None
         self.height: Optional[int] = None
         self.crs: Optional[Any] = None
         self.nodata: Optional[Union[int, float]] = None
+        self.dtype: Optional[np.dtype] = None
         self.bounds: Optional[Any] = None
 
         # Additional attributes for processing
@@ -38,26 +173,149 @@ class GeoDataRaster:
             raise InvalidFileFormatError(f"Unsupported file format: {self.file_path}")
 
     def _load_raster(self) -> None:
-        """Loads raster data."""
+        """Loads raster data, or only its metadata when data is read by windows."""
         try:
             with rasterio.open(self.file_path) as src:
-                self.data = src.read(1)
+                if self.load_data:
+                    self.data = src.read(1)
                 self.transform = src.transform
                 self.width = src.width
                 self.height = src.height
                 self.crs = src.crs
                 self.nodata = src.nodata
+                self.dtype = np.dtype(src.dtypes[0])
                 self.bounds = src.bounds
         except Exception as e:
             raise DEMProcessingError(f"Error loading raster: {e}")
 
+    def release_data(self) -> None:
+        """Drops the loaded data, later reads go to the file by windows."""
+        self.data = None
+        self.load_data = False
+
     def get_resolution(self) -> float:
         """Gets raster resolution (assuming square pixels)."""
         return abs(self.transform.a)
 
-    def save(self, output_path: str, data: Optional[np.ndarray] = None) -> None:
-        """Saves the raster to the specified path."""
+    @contextmanager
+    def open_source(self) -> Iterator[Optional[Any]]:
+        """
+        Opens the raster file once for a series of window reads.
+
+        Yields:
+            Open rasterio dataset, or None when the data is loaded in memory
+        """
+        if self.data is not None:
+            yield None
+            return
+        try:
+            source = rasterio.open(self.file_path)
+        except Exception as e:
+            raise DEMProcessingError(f"Error reading raster window: {e}")
+        with source:
+            yield source
+
+    def read(self, window: Optional[Tuple[int, int, int, int]] = None,
+             source: Optional[Any] = None) -> np.ndarray:
+        """
+        Reads the raster data or a window of it.
+
+        Args:
+            window: Tuple (row_start, row_stop, col_start, col_stop), the full raster by default
+            source: Dataset given by open_source, the file is opened for this read by default
+
+        Returns:
+            Raster data of the window
+        """
+        if window is None:
+            window = (0, self.height, 0, self.width)
+        row_start, row_stop, col_start, col_stop = window
+
+        if self.data is not None:
+            return self.data[row_start:row_stop, col_start:col_stop]
+
+        try:
+            with nullcontext(source) if source is not None else rasterio.open(self.file_path) as src:
+                return src.read(1, window=self._get_window(window))
+        except Exception as e:
+            raise DEMProcessingError(f"Error reading raster window: {e}")
+
+    def read_elevations(self, window: Optional[Tuple[int, int, int, int]] = None,
+                        source: Optional[Any] = None) -> np.ndarray:
+        """Reads a window as float64 elevations with NoData values replaced by NaN."""
+        elevations = self.read(window, source).astype(np.float64)
+        if self.nodata is not None:
+            elevations[elevations == self.nodata] = np.nan
+        return elevations
+
+    def get_elevation_dtype(self) -> np.dtype:
+        """Gets the smallest float type holding the elevations, the source type when it is a float."""
+        with rasterio.open(self.file_path) as src:
+            dtype = np.dtype(src.dtypes[0])
+        return dtype if np.issubdtype(dtype, np.floating) else np.dtype(np.float32)
+
+    def read_elevations_into(self, out: np.ndarray,
+                             window: Optional[Tuple[int, int, int, int]] = None) -> np.ndarray:
+        """
+        Reads a window as elevations into an existing array.
+
+        Rows are read in blocks, cast to the type of out and cleaned of
+        NoData values in place, so no full-size temporary is created.
+
+        Args:
+            out: Array of the window shape, in a float type
+            window: Tuple (row_start, row_stop, col_start, col_stop), the full raster by default
+
+        Returns:
+            The out array
+        """
+        if window is None:
+            window = (0, self.height, 0, self.width)
+        row_start, row_stop, col_start, col_stop = window
+
+        with self.open_source() as source:
+            for block_start in range(row_start, row_stop, READ_BLOCK_ROWS):
+                block_stop = min(block_start + READ_BLOCK_ROWS, row_stop)
+                block = out[block_start - row_start:block_stop - row_start]
+                block[...] = self.read((block_start, block_stop, col_start, col_stop), source)
+                if self.nodata is not None:
+                    block[block == self.nodata] = np.nan
+
+        return out
+
+    def copy_to_scratch(self, block_rows: int, scratch_dir: Optional[str] = None) -> np.memmap:
+        """
+        Copies the elevations to a scratch file by blocks of rows.
+
+        The file is deleted when the returned array is released.
+
+        Args:
+            block_rows: Rows read at once
+            scratch_dir: Directory of the scratch file, the system default by default
+
+        Returns:
+            Memory-mapped float64 elevations with NoData values replaced by NaN
+        """
+        with tempfile.TemporaryFile(dir=scratch_dir) as scratch_file:
+            scratch = np.memmap(scratch_file, dtype=np.float64, mode='w+',
+                                shape=(self.height, self.width))
+
+        with self.open_source() as source, \
+                tqdm(total=self.height, desc=PROGRESS_MESSAGES['scratch']) as progress:
+            for row_start in range(0, self.height, block_rows):
+                row_stop = min(row_start + block_rows, self.height)
+                scratch[row_start:row_stop] = self.read_elevations((row_start, row_stop, 0, self.width), source)
+                progress.update(row_stop - row_start)
+
+        return scratch
+
+    def save(self, output_path: str, data: Optional[np.ndarray] = None,
+             options: Optional[OutputOptions] = None) -> None:
+        """Saves the raster to the specified path, by blocks when output options are given."""
         data_to_save = data if data is not None else self.data
+        if options is not None:
+            self.save_blocks(output_path, data_to_save, options)
+            return
         print(f"📋 {PROGRESS_MESSAGES['saving']}...")
 
         try:
@@ -76,6 +334,180 @@ class GeoDataRaster:
         except Exception as e:
             raise DEMProcessingError(f"Error saving raster: {e}")
 
+    def save_window(self, output_path: str, data: np.ndarray,
+                    window: Tuple[int, int, int, int],
+                    options: Optional[OutputOptions] = None) -> None:
+        """
+        Saves the raster with a window replaced by the given data.
+
+        The output is written block by block, copying the elevations of
+        the original raster and patching in the window, so the full raster
+        is never held in memory. The original raster is opened once for all
+        blocks.
+
+        Args:
+            output_path: Output file path
+            data: Data of the window
+            window: Tuple (row_start, row_stop, col_start, col_stop)
+            options: Layout, compression and type of the output
+        """
+        row_start, row_stop, col_start, col_stop = window
+
+        def read_block(block_rows: Tuple[int, int], block_cols: Tuple[int, int]) -> np.ndarray:
+            values = self.read_elevations(block_rows + block_cols, source).astype(data.dtype)
+
+            # Patch the part of the block covered by the window
+            top, bottom = max(block_rows[0], row_start), min(block_rows[1], row_stop)
+            left, right = max(block_cols[0], col_start), min(block_cols[1], col_stop)
+            if top < bottom and left < right:
+                values[top - block_rows[0]:bottom - block_rows[0],
+                       left - block_cols[0]:right - block_cols[0]] = data[
+                    top - row_start:bottom - row_start, left - col_start:right - col_start
+                ]
+            return values
+
+        with self.open_source() as source:
+            self._write_blocks(output_path, data.dtype, read_block, options)
+
+    def save_blocks(self, output_path: str, data: np.ndarray,
+                    options: Optional[OutputOptions] = None) -> None:
+        """
+        Saves the raster block by block.
+
+        Only one block of data is read at a time, so data may be a
+        memory-mapped array larger than memory.
+
+        Args:
+            output_path: Output file path
+            data: Data to save
+            options: Layout, compression and type of the output
+        """
+        self._write_blocks(output_path, data.dtype, lambda block_rows, block_cols: data[
+            block_rows[0]:block_rows[1], block_cols[0]:block_cols[1]
+        ], options)
+
+    def save_tile(self, output_path: str, data: np.ndarray,
+                  window: Tuple[int, int, int, int]) -> None:
+        """
+        Saves the data of a window as a raster georeferenced at the window.
+
+        Args:
+            output_path: Output file path
+            data: Data of the window
+            window: Tuple (row_start, row_stop, col_start, col_stop)
+        """
+        row_start, row_stop, col_start, col_stop = window
+
+        try:
+            with rasterio.open(
+                    output_path, "w",
+                    driver="GTiff",
+                    height=row_stop - row_start,
+                    width=col_stop - col_start,
+                    count=1,
+                    dtype=data.dtype,
+                    crs=self.crs,
+                    transform=window_transform(self._get_window(window), self.transform),
+                    nodata=self.nodata,
+            ) as dst:
+                dst.write(data, 1)
+        except Exception as e:
+            raise DEMProcessingError(f"Error saving raster tile: {e}")
+
+    def read_tile(self, tile_path: str, window: Tuple[int, int, int, int]) -> np.ndarray:
+        """
+        Reads a raster saved with save_tile, checking it is aligned with the window.
+
+        Args:
+            tile_path: Tile file path
+            window: Tuple (row_start, row_stop, col_start, col_stop) the tile must cover
+
+        Returns:
+            Data of the tile
+        """
+        row_start, row_stop, col_start, col_stop = window
+
+        try:
+            with rasterio.open(tile_path) as src:
+                expected_transform = window_transform(self._get_window(window), self.transform)
+                if (src.height, src.width) != (row_stop - row_start, col_stop - col_start) \
+                        or not src.transform.almost_equals(expected_transform):
+                    raise DEMProcessingError(f"Tile {tile_path} is not aligned with window {window}")
+                return src.read(1)
+        except DEMProcessingError:
+            raise
+        except Exception as e:
+            raise DEMProcessingError(f"Error reading raster tile: {e}")
+
+    @staticmethod
+    def _get_window(window: Tuple[int, int, int, int]) -> Window:
+        """Converts a (row_start, row_stop, col_start, col_stop) tuple to a rasterio window."""
+        row_start, row_stop, col_start, col_stop = window
+        return Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+
+    def _write_blocks(self, output_path: str, dtype: np.dtype, read_block,
+                      options: Optional[OutputOptions] = None) -> None:
+        """
+        Writes the raster by windows, reading the data of each window from read_block.
+
+        Without options the profile of save is used. A COG is first written
+        as a tiled file next to the output and then converted, since the
+        COG driver cannot be written by windows.
+        """
+        print(f"📋 {PROGRESS_MESSAGES['saving']}...")
+        options = options or OutputOptions()
+        output_dtype = self.dtype if options.cast and self.dtype is not None else np.dtype(dtype)
+        staged = options.output_format == OutputFormat.COG
+        write_path = output_path + '.staging.tif' if staged else output_path
+
+        try:
+            with rasterio.open(
+                    write_path, "w",
+                    driver="GTiff",
+                    height=self.height,
+                    width=self.width,
+                    count=1,
+                    dtype=output_dtype,
+                    crs=self.crs,
+                    transform=self.transform,
+                    nodata=self.nodata,
+                    **options.get_creation_options(output_dtype)
+            ) as dst:
+                for block in options.get_windows(dst):
+                    block_rows = (block.row_off, block.row_off + block.height)
+                    block_cols = (block.col_off, block.col_off + block.width)
+                    values = np.asarray(read_block(block_rows, block_cols))
+                    dst.write(cast_block(values, output_dtype, self.nodata), 1, window=block)
+
+                if options.overviews and not staged:
+                    dst.build_overviews(options.get_overview_factors(dst.height, dst.width),
+                                        Resampling[OUTPUT_OVERVIEW_RESAMPLING])
+                    dst.update_tags(ns='rio_overview', resampling=OUTPUT_OVERVIEW_RESAMPLING)
+
+            if staged:
+                rasterio.shutil.copy(write_path, output_path, driver='COG',
+                                     **options.get_cog_options(output_dtype))
+        except Exception as e:
+            raise DEMProcessingError(f"Error saving raster: {e}")
+        finally:
+            if staged and os.path.exists(write_path):
+                os.remove(write_path)
+
+def cast_block(values: np.ndarray, dtype: np.dtype, nodata: Optional[Union[int, float]]) -> np.ndarray:
+    """
+    Casts a block of elevations to the output type.
+
+    When the type changes, NaN cells get the NoData value back, and
+    integer types get rounded values clipped to their range.
+    """
+    if values.dtype == dtype:
+        return values
+    if nodata is not None:
+        values = np.where(np.isnan(values), nodata, values)
+    if np.issubdtype(dtype, np.integer):
+        limits = np.iinfo(dtype)
+        values = np.clip(np.rint(values), limits.min, limits.max)
+    return values.astype(dtype)
 
 class GeoDataVector:
     """Class for storing information about a vector file and its attributes."""
@@ -102,6 +534,12 @@ class GeoDataVector:
         except Exception as e:
             raise DEMProcessingError(f"Error loading vector: {e}")
 
+    def copy(self) -> 'GeoDataVector':
+        """Copies the vector, so reprojecting or sorting the copy leaves this one unchanged."""
+        duplicate = copy.copy(self)
+        duplicate.geo = self.geo.copy() if self.geo is not None else None
+        return duplicate
+
     @property
     def crs(self) -> Any:
         """Gets the vector coordinate system."""
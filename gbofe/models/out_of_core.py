@@ -0,0 +1,120 @@
+"""
+Out-of-core processor for DEMs larger than memory.
+"""
+from typing import Optional
+from gbofe.models.dem_processor import DEMProcessor, ProcessingResult
+from gbofe.models.geo_data import GeoDataRaster, GeoDataVector
+from gbofe.algorithms.base_strategy import FlowEnforcementStrategy
+from gbofe.utils.drainage_cache import DrainageCache
+from gbofe.utils.drainage_footprint import DrainageFootprint
+from gbofe.utils.instrumentation import stage
+from gbofe.exceptions import DEMProcessingError
+from gbofe.config import HierarchyMode, OUT_OF_CORE_MEMORY_BUDGET, PROGRESS_MESSAGES
+
+class OutOfCoreProcessor(DEMProcessor):
+    """
+    DEM processor keeping the DEM in a memory-mapped scratch file.
+
+    The DEM is copied to the scratch file by blocks of rows, and the
+    strategy runs on the drainage footprint only: the drainage cells and
+    their neighbors, gathered from the scratch file, corrected in flow level
+    order and scattered back. The whole drainage network is processed in a
+    single pass, so dependencies between blocks follow the same order as in
+    memory. Memory grows with the drainage cells and the block size, not
+    with the DEM size. The memory budget covers both: the footprint is
+    built first, and the blocks are sized from what it leaves.
+    """
+
+    def __init__(self, dem_raster: GeoDataRaster, drainage_vector: GeoDataVector,
+                 memory_budget: int = OUT_OF_CORE_MEMORY_BUDGET,
+                 scratch_dir: Optional[str] = None, cache: Optional[DrainageCache] = None):
+        super().__init__(dem_raster, drainage_vector, cache=cache)
+        self.memory_budget = memory_budget
+        self.scratch_dir = scratch_dir
+
+    @classmethod
+    def from_files(cls, dem_path: str, drainage_path: str, load_data: bool = False,
+                   cache: Optional[DrainageCache] = None,
+                   memory_budget: int = OUT_OF_CORE_MEMORY_BUDGET,
+                   scratch_dir: Optional[str] = None) -> 'OutOfCoreProcessor':
+        """
+        Creates a processor from files, reading the DEM by windows.
+
+        Args:
+            dem_path: DEM file path
+            drainage_path: Drainage vector file path
+            load_data: Whether to load the DEM into memory
+            cache: Drainage cache
+            memory_budget: Memory for the drainage footprint and raster blocks, in bytes
+            scratch_dir: Directory of the scratch file, the system default by default
+
+        Returns:
+            Out-of-core processor
+        """
+        print(PROGRESS_MESSAGES['loading'])
+        with stage('load') as event:
+            dem_raster = GeoDataRaster(dem_path, load_data=load_data)
+            drainage_vector = GeoDataVector(drainage_path)
+            event.cells = dem_raster.height * dem_raster.width
+        return cls(dem_raster, drainage_vector, memory_budget, scratch_dir, cache)
+
+    @staticmethod
+    def get_footprint_bytes(footprint: DrainageFootprint) -> int:
+        """Gets an estimate of the memory held by a drainage footprint while it is corrected."""
+        # The gathered float64 elevations, and the flow level index built by
+        # the strategy, four arrays at most over the drainage cells
+        return footprint.nbytes + 8 * len(footprint) + 32 * len(footprint.graph)
+
+    def get_block_rows(self, footprint: Optional[DrainageFootprint] = None) -> int:
+        """
+        Gets the rows of a block that fit in the memory budget.
+
+        Args:
+            footprint: Drainage footprint held with the blocks, none by default
+
+        Returns:
+            Rows of a block
+
+        Raises:
+            DEMProcessingError: If the budget does not hold the footprint and a row
+        """
+        # A float64 block plus the raster block it is read from
+        row_bytes = 16 * self.dem_raster.width
+        budget = self.memory_budget
+        if footprint is not None:
+            budget -= self.get_footprint_bytes(footprint)
+        if budget < row_bytes:
+            raise DEMProcessingError(f"Memory budget of {self.memory_budget} bytes cannot hold the drainage "
+                                     f"footprint and a block of rows, {self.memory_budget - budget + row_bytes} "
+                                     f"bytes at least")
+        return budget // row_bytes
+
+    def process(self, strategy: FlowEnforcementStrategy, recursive: bool = False,
+                hierarchy: HierarchyMode = HierarchyMode.RASTER) -> ProcessingResult:
+        """
+        Processes the DEM using the specified strategy without loading it.
+
+        Args:
+            strategy: Flow enforcement strategy
+            recursive: Whether to use recursive drainage hierarchy
+            hierarchy: How the drainage hierarchy is derived
+
+        Returns:
+            Result holding the memory-mapped corrected DEM
+        """
+        try:
+            footprint = DrainageFootprint(self.get_drainage_graph(recursive, hierarchy))
+
+            block_rows = self.get_block_rows(footprint)
+            scratch = self.dem_raster.copy_to_scratch(block_rows, self.scratch_dir)
+
+            elevations = footprint.gather(scratch, block_rows)
+            with stage('enforce', elevations.size):
+                strategy.apply_footprint(elevations, footprint, self.dem_raster.get_resolution())
+            footprint.scatter(scratch, elevations, block_rows)
+            scratch.flush()
+
+            return ProcessingResult(scratch, self.dem_raster, counters=strategy.counters.to_dict())
+
+        except Exception as e:
+            raise DEMProcessingError(f"Error during processing: {e}")
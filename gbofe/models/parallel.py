@@ -0,0 +1,205 @@
+"""
+Parallel processing of independent drainage components.
+"""
+import os
+import sys
+import numpy as np
+import multiprocessing
+from multiprocessing import shared_memory
+from typing import Any, Dict, List, Optional, TextIO, Tuple
+from tqdm import tqdm
+from gbofe.algorithms.base_strategy import FlowEnforcementStrategy
+from gbofe.utils.counters import AlgorithmCounters
+from gbofe.utils.drainage_components import DrainageComponents
+from gbofe.utils.drainage_graph import DrainageGraph
+from gbofe.utils.geometric_utils import create_padded_array
+from gbofe.config import D8_COL_OFFSETS, D8_ROW_OFFSETS, PAD_ELEVATION, PAD_FLOW, PROGRESS_MESSAGES
+
+# Shared arrays attached by every worker process
+_worker_arrays: Dict[str, Any] = {}
+
+# Null device replacing the output streams of a silenced worker process, opened once
+_devnull: Optional[TextIO] = None
+
+def silence_process(stdout: bool = True) -> None:
+    """
+    Silences the standard error, and optionally the standard output, of a worker process.
+
+    Used as the initializer of process pools whose progress is reported
+    by the parent process. Both streams share one null device handle.
+    """
+    global _devnull
+    if _devnull is None:
+        _devnull = open(os.devnull, 'w')
+    if stdout:
+        sys.stdout = _devnull
+    sys.stderr = _devnull
+
+class SharedArrays:
+    """
+    Arrays copied to shared memory once and attached by worker processes.
+
+    ``specs`` is sent to the workers, which call attach_shared_arrays to
+    read the arrays without pickling them. Views returned by get must be
+    released before closing.
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray]) -> None:
+        self._memories: Dict[str, shared_memory.SharedMemory] = {}
+        self.specs: Dict[str, Tuple[str, Tuple[int, ...], str]] = {}
+
+        try:
+            for key, array in arrays.items():
+                memory = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                self._memories[key] = memory
+                np.ndarray(array.shape, array.dtype, buffer=memory.buf)[...] = array
+                self.specs[key] = (memory.name, array.shape, array.dtype.str)
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self) -> 'SharedArrays':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def get(self, key: str) -> np.ndarray:
+        """Gets a view of a shared array in this process."""
+        _, shape, dtype = self.specs[key]
+        return np.ndarray(shape, np.dtype(dtype), buffer=self._memories[key].buf)
+
+    def close(self) -> None:
+        """Releases the shared memory."""
+        for memory in self._memories.values():
+            memory.close()
+            memory.unlink()
+        self._memories.clear()
+
+def attach_shared_arrays(specs: Dict[str, Tuple[str, Tuple[int, ...], str]]) -> Dict[str, np.ndarray]:
+    """
+    Attaches a worker process to arrays shared by SharedArrays.
+
+    Args:
+        specs: The specs of the SharedArrays
+
+    Returns:
+        Arrays by key, also kept in the worker globals with their memory
+    """
+    for key, (name, shape, dtype) in specs.items():
+        memory = shared_memory.SharedMemory(name=name)
+        _worker_arrays[key + '_memory'] = memory
+        _worker_arrays[key] = np.ndarray(shape, np.dtype(dtype), buffer=memory.buf)
+    return {key: _worker_arrays[key] for key in specs}
+
+def detach_shared_arrays(specs: Dict[str, Tuple[str, Tuple[int, ...], str]]) -> None:
+    """
+    Detaches a long-lived worker process from arrays attached by attach_shared_arrays.
+
+    Views of the arrays must be released before detaching.
+    """
+    for key in specs:
+        _worker_arrays.pop(key, None)
+        memory = _worker_arrays.pop(key + '_memory', None)
+        if memory is not None:
+            memory.close()
+
+class ComponentPool:
+    """
+    Applies a strategy to the drainage components of a DEM in worker processes.
+
+    The DEM lives in one shared buffer, so workers read their window and
+    write their result in place instead of pickling rasters. Each
+    component only reads and changes its drainage cells and their D8
+    neighbors, which never overlap between components, so the results are
+    merged by writing those cells only into the buffer the others read.
+    The counters of every component are merged into those of the strategy.
+    """
+
+    def __init__(self, workers: int) -> None:
+        self.workers = workers
+
+    def apply(self, strategy: FlowEnforcementStrategy, dem_data: np.ndarray,
+              drainage_data: np.ndarray, resolution: float, in_place: bool = False) -> np.ndarray:
+        """
+        Applies the strategy to every drainage component.
+
+        Args:
+            strategy: Flow enforcement strategy
+            dem_data: DEM data
+            drainage_data: Rasterized drainage data
+            resolution: Raster resolution
+            in_place: Whether to write the corrected DEM into dem_data instead of a new array
+
+        Returns:
+            Corrected DEM
+        """
+        graph = DrainageGraph.from_raster(drainage_data)
+        components = DrainageComponents(graph)
+        tasks = self._create_tasks(strategy, graph, components, drainage_data.dtype, resolution)
+        strategy.counters.reset()
+
+        with SharedArrays({'dem': dem_data}) as shared:
+            with multiprocessing.Pool(
+                    min(self.workers, max(len(tasks), 1)), _attach_arrays, (shared.specs,)
+            ) as pool, tqdm(total=len(graph), desc=PROGRESS_MESSAGES['components']) as progress:
+                for n_cells, counters in pool.imap_unordered(_process_component, tasks):
+                    strategy.counters.merge(counters)
+                    progress.update(n_cells)
+
+            corrected_dem = dem_data if in_place else np.empty_like(dem_data)
+            corrected_dem[...] = shared.get('dem')
+            return corrected_dem
+
+    @staticmethod
+    def _create_tasks(strategy: FlowEnforcementStrategy, graph: DrainageGraph,
+                      components: DrainageComponents, dtype: np.dtype,
+                      resolution: float) -> List[Tuple]:
+        """Creates one task per component, the largest first."""
+        height, width = graph.shape
+        tasks = []
+
+        for component in np.argsort(-components.sizes, kind='stable'):
+            members = components.get_members(component)
+            row_start, row_stop, col_start, col_stop = components.get_window(component)
+            rows, cols = graph.rows[members], graph.cols[members]
+
+            # Cells the component may change: its drainage cells and their neighbors
+            footprint_rows = np.concatenate([rows, (rows[:, None] + D8_ROW_OFFSETS).ravel()])
+            footprint_cols = np.concatenate([cols, (cols[:, None] + D8_COL_OFFSETS).ravel()])
+            inside = ((footprint_rows >= 0) & (footprint_rows < height) &
+                      (footprint_cols >= 0) & (footprint_cols < width))
+            window_width = col_stop - col_start
+            footprint = np.unique((footprint_rows[inside] - row_start) * window_width
+                                  + footprint_cols[inside] - col_start)
+
+            tasks.append((
+                strategy, resolution, (row_start, row_stop, col_start, col_stop),
+                (rows - row_start) * window_width + cols - col_start,
+                graph.values[members].astype(dtype), footprint
+            ))
+
+        return tasks
+
+def _attach_arrays(specs: Dict[str, Tuple[str, Tuple[int, ...], str]]) -> None:
+    """Attaches a worker process to the shared DEM buffer."""
+    silence_process(stdout=False)
+    attach_shared_arrays(specs)
+
+def _process_component(task: Tuple) -> Tuple[int, AlgorithmCounters]:
+    """Applies the strategy to the window of one component and writes its footprint."""
+    strategy, resolution, window, cells, values, footprint = task
+    row_start, row_stop, col_start, col_stop = window
+
+    # Buffers owned by the strategy, padded without a copy
+    source = _worker_arrays['dem'][row_start:row_stop, col_start:col_stop]
+    dem_data = create_padded_array(source.shape, source.dtype, PAD_ELEVATION)
+    dem_data[...] = source
+    drainage_data = create_padded_array(source.shape, values.dtype, PAD_FLOW)
+    drainage_data[np.divmod(cells, source.shape[1])] = values
+
+    corrected_dem = strategy.apply(dem_data, drainage_data, resolution, in_place=True)
+
+    rows, cols = np.divmod(footprint, dem_data.shape[1])
+    _worker_arrays['dem'][row_start + rows, col_start + cols] = corrected_dem[rows, cols]
+    return len(cells), strategy.counters
@@ -0,0 +1,218 @@
+"""
+Sparse deltas of corrected rasters and in-place patching of raster blocks.
+"""
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio.windows import Window
+from typing import Optional, Tuple, Union
+from gbofe.models.geo_data import GeoDataRaster, cast_block
+from gbofe.exceptions import DEMProcessingError
+from gbofe.config import READ_BLOCK_ROWS
+
+class RasterDelta:
+    """
+    Changed cells of a raster, with their old and new values.
+
+    Cells are flat indices in row-major order. Old values are the raw values
+    of the source raster, so reverting a delta restores it exactly, and new
+    values are the corrected float64 elevations, NaN on NoData cells.
+    """
+
+    def __init__(self, shape: Tuple[int, int], transform: Affine, crs: str,
+                 nodata: Optional[Union[int, float]], cells: np.ndarray,
+                 old_values: np.ndarray, new_values: np.ndarray) -> None:
+        self.shape = shape
+        self.transform = transform
+        self.crs = crs
+        self.nodata = nodata
+        self.cells = cells
+        self.old_values = old_values
+        self.new_values = new_values
+
+    def __len__(self) -> int:
+        return int(self.cells.size)
+
+    @classmethod
+    def from_result(cls, raster: GeoDataRaster, corrected_data: np.ndarray,
+                    window: Optional[Tuple[int, int, int, int]] = None,
+                    block_rows: int = READ_BLOCK_ROWS) -> 'RasterDelta':
+        """
+        Creates the delta between a raster and its corrected data.
+
+        The raster is read one block of rows at a time, so corrected data may
+        be memory-mapped.
+
+        Args:
+            raster: Source GeoDataRaster
+            corrected_data: Corrected elevations of the window
+            window: Tuple (row_start, row_stop, col_start, col_stop), the full raster by default
+
+        Returns:
+            Delta of the cells whose value changed
+        """
+        if window is None:
+            window = (0, raster.height, 0, raster.width)
+        row_start, row_stop, col_start, col_stop = window
+        cells, old_values, new_values = [], [], []
+
+        with raster.open_source() as source:
+            for block_start in range(row_start, row_stop, block_rows):
+                block_stop = min(block_start + block_rows, row_stop)
+                raw = raster.read((block_start, block_stop, col_start, col_stop), source)
+                old = raw.astype(np.float64)
+                if raster.nodata is not None:
+                    old[raw == raster.nodata] = np.nan
+                new = np.asarray(corrected_data[block_start - row_start:block_stop - row_start],
+                                 dtype=np.float64)
+
+                changed = ~((old == new) | (np.isnan(old) & np.isnan(new)))
+                rows, cols = np.nonzero(changed)
+                cells.append((rows + block_start).astype(np.int64) * raster.width + cols + col_start)
+                old_values.append(raw[changed])
+                new_values.append(new[changed])
+
+        return cls((raster.height, raster.width), raster.transform, raster.crs.to_wkt() if raster.crs else '',
+                   raster.nodata, np.concatenate(cells), np.concatenate(old_values), np.concatenate(new_values))
+
+    def save(self, delta_path: str) -> None:
+        """Saves the delta as a compressed NumPy archive, at the path as given."""
+        try:
+            with open(delta_path, 'wb') as delta_file:
+                np.savez_compressed(
+                    delta_file, cells=self.cells, old_values=self.old_values, new_values=self.new_values,
+                    shape=np.array(self.shape), transform=np.array(tuple(self.transform)[:6]),
+                    crs=np.array(self.crs), nodata=np.array(np.nan if self.nodata is None else self.nodata),
+                    has_nodata=np.array(self.nodata is not None)
+                )
+        except OSError as e:
+            raise DEMProcessingError(f"Error saving raster delta: {e}")
+
+    @classmethod
+    def load(cls, delta_path: str) -> 'RasterDelta':
+        """Loads a delta saved with save."""
+        try:
+            with np.load(delta_path) as archive:
+                nodata = archive['nodata'].item() if archive['has_nodata'] else None
+                return cls(tuple(archive['shape']), Affine(*archive['transform']), str(archive['crs']),
+                           nodata, archive['cells'], archive['old_values'], archive['new_values'])
+        except (OSError, KeyError, ValueError) as e:
+            raise DEMProcessingError(f"Error loading raster delta: {e}")
+
+    def apply(self, raster_path: str, revert: bool = False, check: bool = True) -> int:
+        """
+        Writes the new values of the delta into a raster file, or the old ones to revert it.
+
+        Only the internal blocks holding changed cells are rewritten. New
+        values are cast to the type of the raster, and refused by an
+        integer raster when they are not whole numbers.
+
+        Args:
+            raster_path: Raster file, modified in place
+            revert: Whether to write the old values back
+            check: Whether the raster must hold the values the delta replaces
+
+        Returns:
+            Number of blocks rewritten
+        """
+        with rasterio.open(raster_path) as src:
+            if (src.height, src.width) != tuple(self.shape) or not src.transform.almost_equals(self.transform):
+                raise DEMProcessingError(f"Raster {raster_path} does not match the delta grid")
+            nodata = src.nodata if src.nodata is not None else self.nodata
+
+        values, expected = (self.old_values, self.new_values) if revert else (self.new_values, self.old_values)
+        check_patchable(raster_path, values)
+        return patch_blocks(raster_path, self.cells, values, nodata, expected if check else None)
+
+def check_patchable(raster_path: str, values: Optional[np.ndarray] = None) -> None:
+    """
+    Checks that the blocks of a raster file can be patched in place.
+
+    Patching would leave the overviews of a raster stale, and would break
+    the layout of a Cloud-Optimized GeoTIFF, so both are refused. Values
+    to write into an integer raster must be whole numbers in its range,
+    since rounding would silently drop corrections such as the fractions
+    of a unit applied by GBOFE.
+
+    Args:
+        raster_path: Raster file
+        values: Values to write, NaN for NoData, not checked by default
+
+    Raises:
+        DEMProcessingError: If the raster is a COG, has overviews or cannot hold the values
+    """
+    try:
+        with rasterio.open(raster_path) as src:
+            layout = src.tags(ns='IMAGE_STRUCTURE').get('LAYOUT', '')
+            overviews = src.overviews(1)
+            dtype = np.dtype(src.dtypes[0])
+            nodata = src.nodata
+    except Exception as e:
+        raise DEMProcessingError(f"Error opening raster {raster_path}: {e}")
+
+    if layout.upper() == 'COG':
+        raise DEMProcessingError(f"Raster {raster_path} is a Cloud-Optimized GeoTIFF, "
+                                 f"whose blocks cannot be patched in place")
+    if overviews:
+        raise DEMProcessingError(f"Raster {raster_path} has overviews, "
+                                 f"which patching its blocks would leave stale")
+
+    if values is not None and np.issubdtype(dtype, np.integer):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not np.array_equal(cast_block(values, dtype, nodata), values):
+            raise DEMProcessingError(f"Raster {raster_path} holds {dtype} elevations, which would round "
+                                     f"the corrected values away; save a DELTA or a float raster instead")
+
+def patch_blocks(raster_path: str, cells: np.ndarray, values: np.ndarray,
+                 nodata: Optional[Union[int, float]], expected: Optional[np.ndarray] = None) -> int:
+    """
+    Rewrites the internal blocks of a raster file holding the given cells.
+
+    Compressed blocks are rewritten at the end of the file, so a compressed
+    raster grows by the size of the blocks patched. Rasters with overviews
+    and COGs are refused, see check_patchable.
+
+    Args:
+        raster_path: Raster file, modified in place
+        cells: Flat indices of the cells to write
+        values: Value of each cell, cast to the type of the raster
+        nodata: NoData value written for NaN values
+        expected: Current value of each cell, checked before writing when given
+
+    Returns:
+        Number of blocks rewritten
+    """
+    check_patchable(raster_path)
+    try:
+        with rasterio.open(raster_path, 'r+') as dst:
+            block_height, block_width = dst.block_shapes[0]
+            blocks_per_row = -(-dst.width // block_width)
+            rows, cols = np.divmod(cells, dst.width)
+            block_ids = (rows // block_height) * blocks_per_row + cols // block_width
+            order = np.argsort(block_ids, kind='stable')
+            block_list, starts = np.unique(block_ids[order], return_index=True)
+
+            for block_id, positions in zip(block_list, np.split(order, starts[1:])):
+                block_row, block_col = divmod(int(block_id), blocks_per_row)
+                window = Window(block_col * block_width, block_row * block_height,
+                                min(block_width, dst.width - block_col * block_width),
+                                min(block_height, dst.height - block_row * block_height))
+                data = dst.read(1, window=window)
+                block_rows = rows[positions] - window.row_off
+                block_cols = cols[positions] - window.col_off
+
+                if expected is not None:
+                    current = data[block_rows, block_cols]
+                    wanted = cast_block(np.asarray(expected[positions]), data.dtype, nodata)
+                    if not np.array_equal(current, wanted, equal_nan=np.issubdtype(data.dtype, np.floating)):
+                        raise DEMProcessingError(f"Raster {raster_path} does not hold the values replaced "
+                                                 f"by the delta in block {block_row}, {block_col}")
+
+                data[block_rows, block_cols] = cast_block(np.asarray(values[positions]), data.dtype, nodata)
+                dst.write(data, 1, window=window)
+            return len(block_list)
+    except DEMProcessingError:
+        raise
+    except Exception as e:
+        raise DEMProcessingError(f"Error patching raster: {e}")
@@ -0,0 +1,448 @@
+"""
+Resident job server keeping libraries and datasets loaded between jobs.
+
+The server listens on localhost, queues enforcement jobs and runs a
+bounded number of them at once, reusing the DEMs and drainage networks
+already loaded by earlier jobs. Jobs are prepared and saved by threads of
+the server and enforced by worker processes, and each job writes its own
+run report next to its output. The client submits the jobs of a batch
+manifest and can wait for their outputs:
+
+    python -m gbofe.server serve --concurrency 2 --cache-dir drainage_cache/
+    python -m gbofe.server submit jobs.csv --wait
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from gbofe.batch import BatchJob, load_jobs
+from gbofe.main import FlowEnforcementFactory
+from gbofe.models.dem_processor import DEMProcessor, ProcessingResult, apply_to_copy
+from gbofe.models.geo_data import GeoDataRaster, GeoDataVector, OutputOptions
+from gbofe.models.parallel import SharedArrays, attach_shared_arrays, detach_shared_arrays, silence_process
+from gbofe.utils.drainage_cache import DrainageCache
+from gbofe.utils.drainage_graph import DrainageGraph
+from gbofe.algorithms.base_strategy import FlowEnforcementStrategy
+from gbofe.utils.counters import AlgorithmCounters
+from gbofe.utils.instrumentation import JsonReportSink, QuietSink, get_sinks, set_sinks, stage, thread_sinks
+from gbofe.utils.file_operations import create_output_directory, get_dataset_files
+from gbofe.exceptions import DEMProcessingError, InvalidParameterError
+from gbofe.config import (
+    HierarchyMode, RUN_REPORT_SUFFIX, SERVER_CACHE_MAX_BYTES, SERVER_HOST, SERVER_JOB_RETENTION,
+    SERVER_POLL_INTERVAL, SERVER_PORT
+)
+
+class DatasetCache:
+    """
+    Least recently used cache of loaded rasters, vectors and drainage graphs.
+
+    Entries are keyed by path and modification time, so a dataset changed
+    on disk is loaded again. Rasters and graphs count their array sizes and
+    vectors the size of their files; once the total grows above
+    ``max_bytes`` the least recently used entries are dropped. The cache
+    serves the drainage graphs of a DEMProcessor, falling back to an
+    on-disk drainage cache when one is given.
+    """
+
+    def __init__(self, max_bytes: int = SERVER_CACHE_MAX_BYTES,
+                 drainage_cache: Optional[DrainageCache] = None) -> None:
+        self.max_bytes = max_bytes
+        self.drainage_cache = drainage_cache
+        self.hits = 0
+        self.misses = 0
+        self._entries: 'OrderedDict[Tuple, Tuple[Any, int]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_raster(self, path: str) -> GeoDataRaster:
+        """Gets a loaded raster, loading it on a miss."""
+        def load() -> Tuple[GeoDataRaster, int]:
+            raster = GeoDataRaster(path)
+            return raster, raster.data.nbytes
+
+        return self._get(('raster',) + self._get_stamp([path]), load)
+
+    def get_vector(self, path: str) -> GeoDataVector:
+        """
+        Gets a loaded vector, loading it on a miss.
+
+        The vector is shared by every job on it. Building a drainage graph
+        reprojects and sorts the vector in place, so jobs work on a copy.
+        """
+        files = get_dataset_files(path)
+
+        def load() -> Tuple[GeoDataVector, int]:
+            return GeoDataVector(path), sum(os.path.getsize(file) for file in files)
+
+        return self._get(('vector',) + self._get_stamp(files), load)
+
+    def get_or_build(self, raster: GeoDataRaster, vector: GeoDataVector, recursive: bool,
+                     hierarchy: HierarchyMode, build: Callable[[], DrainageGraph]) -> DrainageGraph:
+        """Gets a drainage graph, building it or loading it from the drainage cache on a miss."""
+        def load() -> Tuple[DrainageGraph, int]:
+            if self.drainage_cache is None:
+                graph = build()
+            else:
+                graph = self.drainage_cache.get_or_build(raster, vector, recursive, hierarchy, build)
+            return graph, graph.cells.nbytes + graph.values.nbytes
+
+        key = (('graph',) + self._get_stamp([raster.file_path]) +
+               self._get_stamp(get_dataset_files(vector.file_path)) + (recursive, hierarchy))
+        return self._get(key, load)
+
+    def get_stats(self) -> Dict[str, int]:
+        """Gets the entries, size, hits and misses of the cache."""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': sum(size for _, size in self._entries.values()),
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+    def _get(self, key: Tuple, load) -> Any:
+        """Gets an entry, loading it and evicting old entries on a miss."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+
+        # Loaded without the lock, so jobs on other datasets are not blocked
+        value, size = load()
+
+        with self._lock:
+            self._entries[key] = value, size
+            self._entries.move_to_end(key)
+
+            total = sum(size for _, size in self._entries.values())
+            while total > self.max_bytes and len(self._entries) > 1:
+                _, (_, size) = self._entries.popitem(last=False)
+                total -= size
+            return value
+
+    @staticmethod
+    def _get_stamp(files: List[str]) -> Tuple[str, int]:
+        """Gets the path and latest modification time of a dataset."""
+        return os.path.abspath(files[0]), max(os.stat(file).st_mtime_ns for file in files)
+
+class JobServer:
+    """
+    Queue of enforcement jobs run by a bounded pool of threads.
+
+    Each thread loads and prepares the data of its job on the cached
+    datasets and saves the output, while the enforcement itself runs in a
+    pool of as many worker processes, so concurrent jobs are not serialized
+    by the interpreter lock. Workers read the prepared data from shared
+    memory and write the corrected DEM back into it. Only the status of the last ``job_retention``
+    finished jobs is kept.
+    """
+
+    def __init__(self, concurrency: int = 1, cache_max_bytes: int = SERVER_CACHE_MAX_BYTES,
+                 cache_dir: Optional[str] = None, options: Optional[OutputOptions] = None,
+                 job_retention: int = SERVER_JOB_RETENTION) -> None:
+        drainage_cache = DrainageCache(cache_dir) if cache_dir else None
+        self.datasets = DatasetCache(cache_max_bytes, drainage_cache)
+        self.jobs: Dict[int, Dict[str, Any]] = {}
+        self.options = options
+        self.job_retention = job_retention
+        self._executor = ThreadPoolExecutor(max(1, concurrency))
+        # Spawned, since forking a process running threads may copy held locks
+        self._enforcers = ProcessPoolExecutor(max(1, concurrency), multiprocessing.get_context('spawn'),
+                                              initializer=_init_enforcer)
+        self._job_ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def submit(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Queues a job.
+
+        A job writing the output of a queued or running job is rejected,
+        so two jobs never write the same file at once.
+
+        Args:
+            record: Job fields as in a batch manifest, with absolute paths
+
+        Returns:
+            Status of the queued job
+        """
+        with self._lock:
+            job = BatchJob.from_record(next(self._job_ids), record, os.getcwd())
+            FlowEnforcementFactory.create(job.method, job.gradient, job.engine)
+            output = os.path.abspath(job.output)
+            for other in self.jobs.values():
+                if other['status'] in ('queued', 'running') and os.path.abspath(other['output']) == output:
+                    raise InvalidParameterError(f"Job {other['id']} already writes {job.output}")
+            self.jobs[job.index] = {'id': job.index, 'output': job.output, 'status': 'queued',
+                                    'seconds': None, 'message': ''}
+
+        self._executor.submit(self._run, job)
+        return self.get(job.index)
+
+    def get(self, job_id: int) -> Dict[str, Any]:
+        """Gets the status of a job."""
+        with self._lock:
+            if job_id not in self.jobs:
+                raise InvalidParameterError(f"Unknown job {job_id}")
+            return dict(self.jobs[job_id])
+
+    def shutdown(self) -> None:
+        """Waits for the queued jobs and stops the pools."""
+        self._executor.shutdown(wait=True)
+        self._enforcers.shutdown(wait=True)
+
+    def _run(self, job: BatchJob) -> None:
+        """Runs a job on the cached datasets, records its status and writes its run report."""
+        self._update(job.index, status='running')
+        start = time.time()
+        report = JsonReportSink(os.path.splitext(job.output)[0] + RUN_REPORT_SUFFIX, job.to_record())
+
+        try:
+            create_output_directory(job.output)
+            # Stages of this job only, with the console output of the server
+            with thread_sinks(get_sinks() + [report]):
+                dem_raster = self.datasets.get_raster(job.dem)
+                drainage_vector = self.datasets.get_vector(job.drainage).copy()
+                processor = DEMProcessor(dem_raster, drainage_vector, cache=self.datasets)
+
+                strategy = FlowEnforcementFactory.create(job.method, job.gradient, job.engine)
+                dem_data, drainage_data = processor.prepare_data(job.recursive, job.hierarchy, lean=job.lean)
+                with stage('enforce', dem_data.size):
+                    # Only the names of the shared buffers cross the process boundary
+                    with SharedArrays({'dem': dem_data, 'drainage': drainage_data}) as shared:
+                        counters = self._enforcers.submit(
+                            _enforce, strategy, shared.specs, dem_raster.get_resolution()
+                        ).result()
+                        dem_data[...] = shared.get('dem')
+                del drainage_data
+
+                result = ProcessingResult(dem_data, dem_raster, counters=counters.to_dict())
+                result.save(job.output, self.options)
+
+            report.add_section('counters', result.counters)
+            report.add_section('status', 'completed')
+            self._update(job.index, status='done', seconds=round(time.time() - start, 3))
+            print(f"✅ Job {job.index}: {job.output} ({time.time() - start:.2f} s)", flush=True)
+        except Exception as e:
+            report.add_section('status', 'failed')
+            report.add_section('error', {'type': type(e).__name__, 'message': str(e)})
+            self._update(job.index, status='failed', seconds=round(time.time() - start, 3), message=str(e))
+            print(f"❌ Job {job.index}: {e}", flush=True)
+        finally:
+            try:
+                report.close()
+            except OSError as e:
+                print(f"❌ Job {job.index}: error saving run report: {e}", flush=True)
+
+    def _update(self, job_id: int, **fields: Any) -> None:
+        """Updates the status of a job, forgetting the oldest finished jobs past the retention count."""
+        with self._lock:
+            self.jobs[job_id].update(fields)
+            if fields.get('status') not in ('done', 'failed'):
+                return
+            finished = [other for other, job in self.jobs.items() if job['status'] in ('done', 'failed')]
+            for other in finished[:max(len(finished) - self.job_retention, 0)]:
+                del self.jobs[other]
+
+def _init_enforcer() -> None:
+    """Prepares an enforcement worker process."""
+    # Progress and stages are reported by the job threads of the server
+    silence_process(stdout=False)
+    set_sinks([QuietSink()])
+
+def _enforce(strategy: FlowEnforcementStrategy, specs: Dict[str, Tuple[str, Tuple[int, ...], str]],
+             resolution: float) -> AlgorithmCounters:
+    """
+    Applies a strategy in a worker process to shared prepared data.
+
+    The corrected DEM is written back into the shared DEM buffer, and only
+    the counters of the strategy are returned.
+    """
+    arrays = attach_shared_arrays(specs)
+    try:
+        arrays['dem'][...] = apply_to_copy(strategy, arrays['dem'], arrays['drainage'], resolution)
+    finally:
+        del arrays
+        detach_shared_arrays(specs)
+    return strategy.counters
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """JSON endpoints of the job server."""
+
+    def do_POST(self) -> None:
+        if self.path != '/jobs':
+            return self._send(404, {'error': f"Unknown path {self.path}"})
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            record = json.loads(self.rfile.read(length))
+            if not isinstance(record, dict):
+                raise InvalidParameterError("A job must be a JSON object")
+            self._send(200, self.server.job_server.submit(record))
+        except (ValueError, InvalidParameterError) as e:
+            self._send(400, {'error': str(e)})
+
+    def do_GET(self) -> None:
+        job_server = self.server.job_server
+        if self.path == '/status':
+            with job_server._lock:
+                statuses = [job['status'] for job in job_server.jobs.values()]
+            counts = {status: statuses.count(status) for status in ('queued', 'running', 'done', 'failed')}
+            return self._send(200, {'jobs': counts, 'cache': job_server.datasets.get_stats()})
+        if self.path.startswith('/jobs/'):
+            try:
+                return self._send(200, job_server.get(int(self.path[len('/jobs/'):])))
+            except (ValueError, InvalidParameterError) as e:
+                return self._send(404, {'error': str(e)})
+        self._send(404, {'error': f"Unknown path {self.path}"})
+
+    def _send(self, code: int, body: Dict[str, Any]) -> None:
+        content = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        # Jobs are logged by the server, not every request
+        pass
+
+def serve(host: str = SERVER_HOST, port: int = SERVER_PORT, concurrency: int = 1,
+          cache_max_bytes: int = SERVER_CACHE_MAX_BYTES, cache_dir: Optional[str] = None,
+          options: Optional[OutputOptions] = None, job_retention: int = SERVER_JOB_RETENTION) -> None:
+    """
+    Runs the job server until interrupted.
+
+    Args:
+        host: Address the server listens on
+        port: Port the server listens on
+        concurrency: Jobs run at once, the others wait in the queue
+        cache_max_bytes: Size of the loaded datasets kept between jobs
+        cache_dir: Directory of the drainage cache
+        options: Layout, compression and type of the job outputs
+        job_retention: Finished jobs whose status is kept
+    """
+    job_server = JobServer(concurrency, cache_max_bytes, cache_dir, options, job_retention)
+    http_server = ThreadingHTTPServer((host, port), _RequestHandler)
+    http_server.job_server = job_server
+
+    print(f"📋 Job server listening on http://{host}:{port} with {concurrency} workers", flush=True)
+    try:
+        http_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        http_server.server_close()
+        job_server.shutdown()
+
+def submit_jobs(jobs: List[BatchJob], url: str) -> List[Dict[str, Any]]:
+    """
+    Submits jobs to a running job server.
+
+    Args:
+        jobs: Jobs to submit
+        url: Base URL of the server
+
+    Returns:
+        Status of each queued job
+    """
+    return [_request(f"{url}/jobs", job.to_record()) for job in jobs]
+
+def wait_for_jobs(job_ids: List[int], url: str,
+                  poll_interval: float = SERVER_POLL_INTERVAL) -> List[Dict[str, Any]]:
+    """
+    Waits until jobs of a job server are done or failed.
+
+    Args:
+        job_ids: Ids of the jobs
+        url: Base URL of the server
+        poll_interval: Seconds between status requests
+
+    Returns:
+        Final status of each job, failed for the jobs the server no longer keeps
+    """
+    pending = {job_id: None for job_id in job_ids}
+    while any(status is None for status in pending.values()):
+        time.sleep(poll_interval)
+        for job_id, status in pending.items():
+            if status is None:
+                try:
+                    job = _request(f"{url}/jobs/{job_id}")
+                except InvalidParameterError as e:
+                    job = {'id': job_id, 'output': '', 'status': 'failed', 'seconds': 0.0, 'message': str(e)}
+                if job['status'] in ('done', 'failed'):
+                    pending[job_id] = job
+    return list(pending.values())
+
+def _request(url: str, body: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Sends a JSON request to the job server."""
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        message = json.load(e).get('error', str(e))
+        raise InvalidParameterError(message) if e.code == 404 else DEMProcessingError(message)
+    except urllib.error.URLError as e:
+        raise DEMProcessingError(f"Job server is not reachable at {url}: {e.reason}")
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Command line entry point of the job server and its client."""
+    parser = argparse.ArgumentParser(description="Resident DEM flow enforcement job server")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    server = commands.add_parser('serve', help="Run the job server")
+    server.add_argument('--host', default=SERVER_HOST)
+    server.add_argument('--port', type=int, default=SERVER_PORT)
+    server.add_argument('--concurrency', type=int, default=1)
+    server.add_argument('--cache-bytes', type=int, default=SERVER_CACHE_MAX_BYTES,
+                        help="Size of the loaded datasets kept between jobs")
+    server.add_argument('--cache-dir', help="Directory of the drainage cache")
+    server.add_argument('--job-retention', type=int, default=SERVER_JOB_RETENTION,
+                        help="Finished jobs whose status is kept")
+    server.add_argument('--quiet', action='store_true', help="Do not print stage timings")
+    OutputOptions.add_arguments(server)
+
+    client = commands.add_parser('submit', help="Submit the jobs of a batch manifest")
+    client.add_argument('manifest', help="JSON, YAML or CSV job manifest")
+    client.add_argument('--url', default=f"http://{SERVER_HOST}:{SERVER_PORT}")
+    client.add_argument('--wait', action='store_true', help="Wait for the jobs to finish")
+
+    args = parser.parse_args(argv)
+    if args.command == 'serve':
+        if args.quiet:
+            set_sinks([QuietSink()])
+        serve(args.host, args.port, args.concurrency, args.cache_bytes, args.cache_dir,
+              OutputOptions.from_args(args), args.job_retention)
+        return
+
+    try:
+        queued = submit_jobs(load_jobs(args.manifest), args.url)
+        for job in queued:
+            print(f"📋 Job {job['id']} queued: {job['output']}")
+        if not args.wait:
+            return
+
+        jobs = wait_for_jobs([job['id'] for job in queued], args.url)
+        for job in jobs:
+            icon = '✅' if job['status'] == 'done' else '❌'
+            print(f"{icon} Job {job['id']}: {job['output']} ({job['seconds']:.2f} s) {job['message']}".rstrip())
+    except DEMProcessingError as e:
+        print(f"❌ Error in processing: {e}")
+        raise SystemExit(1)
+
+    if any(job['status'] == 'failed' for job in jobs):
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+"""
+Basin-sharded processing of a DEM across several machines.
+
+A run has three steps that only share files on a common filesystem:
+plan_shards splits the drainage network into shards of independent basins
+and writes a manifest, process_shard corrects the basins of one shard, and
+merge_shards assembles the shard outputs into the final raster. Every step
+can be launched as a separate process:
+
+    python -m gbofe.sharding plan dem.tif drainage.shp shards/ --shards 4 --method GBOFE --gradient 0.001
+    python -m gbofe.sharding work shards/manifest.json 0
+    python -m gbofe.sharding merge shards/manifest.json dem_burn.tif
+"""
+import argparse
+import json
+import os
+import numpy as np
+from typing import Any, Dict, List, Optional, Tuple
+from tqdm import tqdm
+from gbofe.main import FlowEnforcementFactory
+from gbofe.models.dem_processor import DEMProcessor, ProcessingResult
+from gbofe.models.geo_data import GeoDataRaster, OutputOptions
+from gbofe.utils.drainage_components import DrainageComponents, find_overlapping_windows
+from gbofe.exceptions import DEMProcessingError, InvalidParameterError
+from gbofe.config import (
+    EnforcementEngine, FlowEnforcementMethod, HierarchyMode,
+    OUT_OF_CORE_MEMORY_BUDGET, PROGRESS_MESSAGES, RECURSIVE_METHODS, SHARD_HALO, SHARD_MANIFEST_NAME
+)
+
+def plan_shards(dem_path: str, drainage_path: str, output_dir: str, shards: int,
+                method: FlowEnforcementMethod, gradient: float, recursive: Optional[bool] = None,
+                hierarchy: HierarchyMode = HierarchyMode.RASTER,
+                engine: EnforcementEngine = EnforcementEngine.REFERENCE) -> str:
+    """
+    Splits the drainage network into shards of basins and writes their manifest.
+
+    Basins are groups of drainage components with disjoint windows, so
+    every basin is corrected on its own window with the same result as in
+    a full run. Basins are given to the shard with the fewest drainage
+    cells, the largest first.
+
+    Args:
+        dem_path: DEM file path
+        drainage_path: Drainage vector file path
+        output_dir: Directory of the manifest and the shard outputs
+        shards: Number of shards
+        method: Flow enforcement method
+        gradient: Gradient or carving depth
+        recursive: Whether to use recursive drainage hierarchy, by default for the methods of RECURSIVE_METHODS
+        hierarchy: How the drainage hierarchy is derived
+        engine: Implementation of the method
+
+    Returns:
+        Manifest file path
+    """
+    if shards < 1:
+        raise InvalidParameterError(f"Number of shards must be positive: {shards}")
+
+    # Fail before planning rather than in every shard
+    try:
+        FlowEnforcementFactory.create(method, gradient, engine)
+    except ValueError as e:
+        raise InvalidParameterError(f"Invalid enforcement settings: {e}")
+    if recursive is None:
+        recursive = method in RECURSIVE_METHODS
+
+    processor = DEMProcessor.from_files(dem_path, drainage_path, load_data=False)
+    graph = processor.get_drainage_graph(recursive, hierarchy)
+
+    print(f"📋 {PROGRESS_MESSAGES['planning']}...")
+    windows, sizes = DrainageComponents(graph).get_basins(SHARD_HALO)
+
+    loads = np.zeros(shards, dtype=np.int64)
+    basins: List[List[Dict[str, Any]]] = [[] for _ in range(shards)]
+    for basin in np.argsort(-sizes, kind='stable'):
+        shard = int(np.argmin(loads))
+        loads[shard] += sizes[basin]
+        basins[shard].append({
+            'window': [int(value) for value in windows[basin]],
+            'tile': f"shard_{shard:04d}_{len(basins[shard]):04d}.tif"
+        })
+
+    manifest = {
+        'dem': os.path.abspath(dem_path),
+        'drainage': os.path.abspath(drainage_path),
+        'shape': [processor.dem_raster.height, processor.dem_raster.width],
+        'method': method.name,
+        'gradient': gradient,
+        'engine': engine.name,
+        'recursive': recursive,
+        'hierarchy': hierarchy.name,
+        'shards': [
+            {'id': shard, 'cells': int(loads[shard]), 'basins': basins[shard]}
+            for shard in range(shards)
+        ]
+    }
+
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, SHARD_MANIFEST_NAME)
+    with open(manifest_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+
+    return manifest_path
+
+def load_manifest(manifest_path: str) -> Dict[str, Any]:
+    """Loads a shard manifest written by plan_shards."""
+    try:
+        with open(manifest_path) as manifest_file:
+            return json.load(manifest_file)
+    except Exception as e:
+        raise DEMProcessingError(f"Error loading shard manifest: {e}")
+
+def process_shard(manifest_path: str, shard: int) -> List[str]:
+    """
+    Corrects the basins of one shard and saves each of them as a tile.
+
+    Tiles are written under a temporary name and renamed when complete, so
+    the merge step never reads a partial tile.
+
+    Args:
+        manifest_path: Manifest file path
+        shard: Shard id
+
+    Returns:
+        Tile file paths
+    """
+    manifest = load_manifest(manifest_path)
+    if not 0 <= shard < len(manifest['shards']):
+        raise InvalidParameterError(f"Shard {shard} is not in the manifest")
+
+    output_dir = os.path.dirname(os.path.abspath(manifest_path))
+    recursive = manifest['recursive']
+    hierarchy = HierarchyMode[manifest['hierarchy']]
+
+    try:
+        strategy = FlowEnforcementFactory.create(
+            FlowEnforcementMethod[manifest['method']],
+            manifest['gradient'],
+            EnforcementEngine[manifest['engine']]
+        )
+    except (KeyError, ValueError) as e:
+        raise InvalidParameterError(f"Invalid enforcement settings in the manifest: {e}")
+
+    processor = DEMProcessor.from_files(manifest['dem'], manifest['drainage'], load_data=False)
+
+    tile_paths = []
+    for basin in manifest['shards'][shard]['basins']:
+        window = tuple(basin['window'])
+        result = processor.process(strategy, recursive=recursive, hierarchy=hierarchy, window=window)
+
+        tile_path = os.path.join(output_dir, basin['tile'])
+        processor.dem_raster.save_tile(tile_path + '.part', result.corrected_data, window)
+        os.replace(tile_path + '.part', tile_path)
+        tile_paths.append(tile_path)
+
+    return tile_paths
+
+def merge_shards(manifest_path: str, output_path: str,
+                 memory_budget: int = OUT_OF_CORE_MEMORY_BUDGET,
+                 options: Optional[OutputOptions] = None) -> None:
+    """
+    Assembles the shard tiles into the corrected DEM.
+
+    The DEM is copied to a scratch file and every tile is patched into its
+    window. Basin windows keep one ring of cells beyond the cells a strategy
+    may change, so a tile whose ring differs from the DEM comes from a
+    misaligned or foreign run and the merge fails.
+
+    Args:
+        manifest_path: Manifest file path
+        output_path: Output file path
+        memory_budget: Memory used for raster blocks, in bytes
+        options: Layout, compression and type of the output
+    """
+    manifest = load_manifest(manifest_path)
+    output_dir = os.path.dirname(os.path.abspath(manifest_path))
+    dem_raster = GeoDataRaster(manifest['dem'], load_data=False)
+
+    if [dem_raster.height, dem_raster.width] != manifest['shape']:
+        raise DEMProcessingError(f"DEM {manifest['dem']} does not match the shard manifest")
+
+    basins = [basin for shard in manifest['shards'] for basin in shard['basins']]
+    missing = [basin['tile'] for basin in basins
+               if not os.path.isfile(os.path.join(output_dir, basin['tile']))]
+    if missing:
+        raise DEMProcessingError(f"Missing shard outputs: {', '.join(missing)}")
+    _check_disjoint([tuple(basin['window']) for basin in basins])
+
+    block_rows = max(1, memory_budget // (16 * dem_raster.width))
+    corrected_dem = dem_raster.copy_to_scratch(block_rows)
+
+    for basin in tqdm(basins, desc=PROGRESS_MESSAGES['merging']):
+        row_start, row_stop, col_start, col_stop = window = tuple(basin['window'])
+        tile = dem_raster.read_tile(os.path.join(output_dir, basin['tile']), window)
+        original = np.asarray(corrected_dem[row_start:row_stop, col_start:col_stop])
+
+        if not np.array_equal(_get_seams(tile, window, dem_raster),
+                              _get_seams(original, window, dem_raster), equal_nan=True):
+            raise DEMProcessingError(f"Seams of {basin['tile']} do not match the DEM")
+
+        corrected_dem[row_start:row_stop, col_start:col_stop] = tile
+
+    corrected_dem.flush()
+    ProcessingResult(corrected_dem, dem_raster).save(output_path, options)
+
+def _check_disjoint(windows: List[Tuple[int, int, int, int]]) -> None:
+    """Checks that no two basin windows overlap."""
+    pairs = find_overlapping_windows(np.array(windows, dtype=np.int64))
+    if len(pairs):
+        first, second = pairs[0]
+        raise DEMProcessingError(f"Basin windows {windows[first]} and {windows[second]} overlap")
+
+def _get_seams(data: np.ndarray, window: Tuple[int, int, int, int],
+               dem_raster: GeoDataRaster) -> np.ndarray:
+    """Gets the border cells of a window, leaving out the sides on the raster edge."""
+    row_start, row_stop, col_start, col_stop = window
+    sides = [
+        data[0] if row_start > 0 else data[:0, 0],
+        data[-1] if row_stop < dem_raster.height else data[:0, 0],
+        data[:, 0] if col_start > 0 else data[:0, 0],
+        data[:, -1] if col_stop < dem_raster.width else data[:0, 0]
+    ]
+    return np.concatenate(sides)
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Command line entry point of the sharded run steps."""
+    parser = argparse.ArgumentParser(description="Basin-sharded DEM flow enforcement")
+    steps = parser.add_subparsers(dest='step', required=True)
+
+    plan = steps.add_parser('plan', help="Split the drainage network into shards")
+    plan.add_argument('dem')
+    plan.add_argument('drainage')
+    plan.add_argument('output_dir')
+    plan.add_argument('--shards', type=int, required=True)
+    plan.add_argument('--method', choices=[method.name for method in FlowEnforcementMethod],
+                      default=FlowEnforcementMethod.GBOFE.name)
+    plan.add_argument('--gradient', type=float, required=True)
+    plan.add_argument('--recursive', action=argparse.BooleanOptionalAction,
+                      help="Use the recursive drainage hierarchy, by default for GBOFE and "
+                           "NORMAL_EXCAVATION_MODIFIED only")
+    plan.add_argument('--hierarchy', choices=[mode.name for mode in HierarchyMode],
+                      default=HierarchyMode.RASTER.name)
+    plan.add_argument('--engine', choices=[engine.name for engine in EnforcementEngine],
+                      default=EnforcementEngine.REFERENCE.name)
+
+    work = steps.add_parser('work', help="Process one shard of a manifest")
+    work.add_argument('manifest')
+    work.add_argument('shard', type=int)
+
+    merge = steps.add_parser('merge', help="Assemble the shard outputs")
+    merge.add_argument('manifest')
+    merge.add_argument('output')
+    merge.add_argument('--memory-budget', type=int, default=OUT_OF_CORE_MEMORY_BUDGET,
+                       help="Memory used for raster blocks, in bytes")
+    OutputOptions.add_arguments(merge)
+
+    args = parser.parse_args(argv)
+    try:
+        if args.step == 'plan':
+            manifest_path = plan_shards(
+                args.dem, args.drainage, args.output_dir, args.shards,
+                FlowEnforcementMethod[args.method], args.gradient, args.recursive,
+                HierarchyMode[args.hierarchy], EnforcementEngine[args.engine]
+            )
+            print(f"📁 Manifest saved in: {manifest_path}")
+        elif args.step == 'work':
+            tile_paths = process_shard(args.manifest, args.shard)
+            print(f"✅ Shard {args.shard} completed: {len(tile_paths)} basins")
+        else:
+            merge_shards(args.manifest, args.output, args.memory_budget, OutputOptions.from_args(args))
+            print(f"📁 File saved in: {args.output}")
+    except (DEMProcessingError, ValueError) as e:
+        print(f"❌ Error in processing: {e}")
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
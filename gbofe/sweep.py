@@ -0,0 +1,200 @@
+"""
+Sweep of flow enforcement methods and gradients over one prepared dataset.
+
+The DEM and the drainage raster are prepared once and every (method,
+gradient) combination is applied to them, in worker processes reading the
+prepared arrays from shared memory, writing one corrected DEM each. As in
+the interactive run, the methods of RECURSIVE_METHODS use the recursive
+drainage hierarchy unless told otherwise, and the drainage is prepared
+once per hierarchy setting used by the combinations:
+
+    python -m gbofe.sweep dem.tif drainage.shp sweep/ --methods GBOFE --gradients 0.001 0.01 0.1
+"""
+import argparse
+import multiprocessing
+import os
+from typing import Dict, List, Optional, Tuple
+from tqdm import tqdm
+from gbofe.main import FlowEnforcementFactory
+from gbofe.models.dem_processor import DEMProcessor, ProcessingResult, apply_to_copy
+from gbofe.models.geo_data import GeoDataRaster, OutputOptions
+from gbofe.models.parallel import SharedArrays, attach_shared_arrays, silence_process
+from gbofe.utils.drainage_cache import DrainageCache
+from gbofe.utils.instrumentation import QuietSink, set_sinks
+from gbofe.exceptions import DEMProcessingError, InvalidParameterError
+from gbofe.config import (
+    DELTA_SUFFIX, RASTER_SUFFIX, RECURSIVE_METHODS, EnforcementEngine, FlowEnforcementMethod, HierarchyMode,
+    OutputFormat, PROGRESS_MESSAGES
+)
+
+# Prepared dataset attached by every worker process
+_worker_state: Dict[str, object] = {}
+
+def get_sweep_path(output_dir: str, method: FlowEnforcementMethod, gradient: float,
+                   options: Optional[OutputOptions] = None) -> str:
+    """Gets the output path of a sweep combination, a .delta file for DELTA outputs."""
+    is_delta = options is not None and options.output_format == OutputFormat.DELTA
+    suffix = DELTA_SUFFIX if is_delta else RASTER_SUFFIX
+    return os.path.join(output_dir, f"{method.name.lower()}_g{gradient:g}{suffix}")
+
+def run_sweep(processor: DEMProcessor, combinations: List[Tuple[FlowEnforcementMethod, float]],
+              output_dir: str, recursive: Optional[bool] = None,
+              hierarchy: HierarchyMode = HierarchyMode.RASTER,
+              engine: EnforcementEngine = EnforcementEngine.REFERENCE,
+              workers: int = 1, lean: bool = False,
+              options: Optional[OutputOptions] = None) -> List[str]:
+    """
+    Applies every (method, gradient) combination to one prepared dataset.
+
+    Each combination corrects its own copy of the prepared arrays, so a
+    sweep costs one preparation per hierarchy setting plus one enforcement
+    pass per combination. Repeated combinations run once.
+
+    Args:
+        processor: DEM processor of the dataset
+        combinations: (method, gradient) pairs
+        output_dir: Directory of the corrected DEMs
+        recursive: Whether to use recursive drainage hierarchy, by default for the methods of RECURSIVE_METHODS
+        hierarchy: How the drainage hierarchy is derived
+        engine: Implementation of the methods
+        workers: Worker processes, 1 to run in this process
+        lean: Whether the data is prepared in lean mode
+        options: Layout, compression and type of the corrected DEMs
+
+    Returns:
+        Output path of each distinct combination
+
+    Raises:
+        InvalidParameterError: If two combinations would write the same output
+    """
+    if not combinations:
+        raise InvalidParameterError("A sweep needs at least one combination")
+    # Repeated combinations run once
+    combinations = list(dict.fromkeys(combinations))
+    paths: Dict[str, Tuple[FlowEnforcementMethod, float]] = {}
+    for method, gradient in combinations:
+        try:
+            FlowEnforcementFactory.create(method, gradient, engine)
+        except ValueError as e:
+            raise InvalidParameterError(f"Invalid combination {method.name}:{gradient:g}: {e}")
+        path = get_sweep_path(output_dir, method, gradient, options)
+        if path in paths:
+            raise InvalidParameterError(
+                f"Gradients {paths[path][1]!r} and {gradient!r} of {method.name} both write {path}"
+            )
+        paths[path] = (method, gradient)
+
+    os.makedirs(output_dir, exist_ok=True)
+    groups: Dict[bool, List[Tuple[str, float, str, str]]] = {}
+    for path, (method, gradient) in paths.items():
+        method_recursive = method in RECURSIVE_METHODS if recursive is None else recursive
+        groups.setdefault(method_recursive, []).append((method.name, gradient, engine.name, path))
+
+    output_paths = []
+    for group_recursive, tasks in groups.items():
+        output_paths += _run_tasks(processor, tasks, group_recursive, hierarchy, workers, lean, options)
+    order = {path: position for position, path in enumerate(paths)}
+    return sorted(output_paths, key=order.get)
+
+def _run_tasks(processor: DEMProcessor, tasks: List[Tuple[str, float, str, str]], recursive: bool,
+               hierarchy: HierarchyMode, workers: int, lean: bool,
+               options: Optional[OutputOptions]) -> List[str]:
+    """Prepares the dataset with one hierarchy setting and applies its combinations to it."""
+    try:
+        dem_data, drainage_data = processor.prepare_data(recursive, hierarchy, lean=lean)
+        resolution = processor.dem_raster.get_resolution()
+    except Exception as e:
+        raise DEMProcessingError(f"Error preparing sweep data: {e}")
+
+    try:
+        if workers <= 1:
+            _worker_state.update(dem_raster=processor.dem_raster, resolution=resolution, options=options,
+                                 arrays={'dem': dem_data, 'drainage': drainage_data})
+            return [_run_combination(task) for task in tqdm(tasks, desc=PROGRESS_MESSAGES['sweep'])]
+
+        with SharedArrays({'dem': dem_data, 'drainage': drainage_data}) as shared:
+            with multiprocessing.Pool(
+                    min(workers, len(tasks)), _attach_dataset,
+                    (shared.specs, processor.dem_raster, resolution, options)
+            ) as pool:
+                return list(tqdm(pool.imap(_run_combination, tasks), total=len(tasks),
+                                 desc=PROGRESS_MESSAGES['sweep']))
+    except Exception as e:
+        raise DEMProcessingError(f"Error during sweep: {e}")
+    finally:
+        _worker_state.clear()
+
+def _attach_dataset(specs: Dict, dem_raster: GeoDataRaster, resolution: float,
+                    options: Optional[OutputOptions]) -> None:
+    """Attaches a worker process to the shared prepared dataset."""
+    # Progress is reported by the parent process
+    silence_process()
+    _worker_state.update(dem_raster=dem_raster, resolution=resolution, options=options,
+                         arrays=attach_shared_arrays(specs))
+
+def _run_combination(task: Tuple[str, float, str, str]) -> str:
+    """Applies one combination to a private copy of the prepared dataset and saves it."""
+    method, gradient, engine, output_path = task
+    strategy = FlowEnforcementFactory.create(
+        FlowEnforcementMethod[method], gradient, EnforcementEngine[engine]
+    )
+    corrected_dem = apply_to_copy(strategy, _worker_state['arrays']['dem'],
+                                  _worker_state['arrays']['drainage'], _worker_state['resolution'])
+    ProcessingResult(corrected_dem, _worker_state['dem_raster']).save(output_path, _worker_state['options'])
+    return output_path
+
+def _parse_combination(value: str) -> Tuple[FlowEnforcementMethod, float]:
+    """Parses a METHOD:GRADIENT command line combination."""
+    try:
+        method, gradient = value.split(':')
+        return FlowEnforcementMethod[method.upper()], float(gradient)
+    except (KeyError, ValueError):
+        raise argparse.ArgumentTypeError(f"Invalid combination {value}, expected METHOD:GRADIENT")
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Command line entry point of the sweep."""
+    parser = argparse.ArgumentParser(description="Sweep of flow enforcement methods and gradients")
+    parser.add_argument('dem')
+    parser.add_argument('drainage')
+    parser.add_argument('output_dir')
+    parser.add_argument('--methods', nargs='+', default=[],
+                        choices=[method.name for method in FlowEnforcementMethod],
+                        help="Methods combined with every gradient")
+    parser.add_argument('--gradients', nargs='+', type=float, default=[])
+    parser.add_argument('--combinations', nargs='+', type=_parse_combination, default=[],
+                        help="Extra METHOD:GRADIENT combinations")
+    parser.add_argument('--recursive', action=argparse.BooleanOptionalAction,
+                        help="Use the recursive drainage hierarchy, by default for GBOFE and "
+                             "NORMAL_EXCAVATION_MODIFIED only")
+    parser.add_argument('--hierarchy', choices=[mode.name for mode in HierarchyMode],
+                        default=HierarchyMode.RASTER.name)
+    parser.add_argument('--engine', choices=[engine.name for engine in EnforcementEngine],
+                        default=EnforcementEngine.REFERENCE.name)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--lean', action='store_true')
+    parser.add_argument('--cache-dir', help="Directory of the drainage cache")
+    parser.add_argument('--quiet', action='store_true', help="Do not print stage timings")
+    OutputOptions.add_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.quiet:
+        set_sinks([QuietSink()])
+
+    combinations = [(FlowEnforcementMethod[method], gradient)
+                    for method in args.methods for gradient in args.gradients]
+    combinations += args.combinations
+
+    try:
+        cache = DrainageCache(args.cache_dir) if args.cache_dir else None
+        processor = DEMProcessor.from_files(args.dem, args.drainage, load_data=False, cache=cache)
+        output_paths = run_sweep(
+            processor, combinations, args.output_dir, args.recursive,
+            HierarchyMode[args.hierarchy], EnforcementEngine[args.engine], args.workers, args.lean,
+            OutputOptions.from_args(args)
+        )
+        print(f"✅ Sweep completed: {len(output_paths)} files saved in {args.output_dir}")
+    except DEMProcessingError as e:
+        print(f"❌ Error in processing: {e}")
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,37 @@
 """
 Utility module for DEM processing.
 """
-from gbofe.utils.file_operations import validate_file_path, create_output_directory
-from gbofe.utils.geometric_utils import get_neighbors, get_slopes, get_factor, rasterize_drainage
-from gbofe.utils.ui_helpers import animated_loading, get_user_input, display_method_menu
+from gbofe.utils.file_operations import (
+    validate_file_path, create_output_directory, get_dataset_files, hash_files
+)
+from gbofe.utils.geometric_utils import (
+    D8Stencil, get_neighbors, get_slopes, get_factor, get_distances,
+    pad_array, unpad_array, create_padded_array, get_drainage_dtype,
+    rasterize_drainage, sample_drainage,
+    build_drainage_graph
+)
+from gbofe.utils.drainage_index import FlowLevelIndex
+from gbofe.utils.drainage_graph import DrainageGraph
+from gbofe.utils.drainage_components import DrainageComponents
+from gbofe.utils.drainage_footprint import DrainageFootprint
+from gbofe.utils.drainage_cache import DrainageCache
+from gbofe.utils.counters import AlgorithmCounters
+from gbofe.utils.network_topology import ReachGraph
+from gbofe.utils.instrumentation import (
+    StageEvent, StageSink, QuietSink, ConsoleSink, JsonReportSink,
+    stage, set_sinks, get_sinks, thread_sinks, close_sinks, get_peak_rss
+)
+from gbofe.utils.ui_helpers import get_user_input, get_engine, display_method_menu
 
 __all__ = [
-    'validate_file_path', 'create_output_directory',
-    'get_neighbors', 'get_slopes', 'get_factor', 'rasterize_drainage',
-    'animated_loading', 'get_user_input', 'display_method_menu'
+    'validate_file_path', 'create_output_directory', 'get_dataset_files', 'hash_files',
+    'D8Stencil', 'get_neighbors', 'get_slopes', 'get_factor', 'get_distances',
+    'pad_array', 'unpad_array', 'create_padded_array', 'get_drainage_dtype',
+    'rasterize_drainage', 'sample_drainage',
+    'build_drainage_graph',
+    'FlowLevelIndex', 'DrainageGraph', 'DrainageComponents', 'DrainageFootprint',
+    'DrainageCache', 'AlgorithmCounters', 'ReachGraph',
+    'StageEvent', 'StageSink', 'QuietSink', 'ConsoleSink', 'JsonReportSink',
+    'stage', 'set_sinks', 'get_sinks', 'thread_sinks', 'close_sinks', 'get_peak_rss',
+    'get_user_input', 'get_engine', 'display_method_menu'
 ]
\ No newline at end of file
@@ -0,0 +1,26 @@
+"""
+Optional just-in-time compilation support.
+"""
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    njit = None
+    NUMBA_AVAILABLE = False
+
+def jit(function):
+    """
+    Compiles a kernel with Numba when it is installed.
+
+    Without Numba the function is returned unchanged and runs as plain
+    Python, so kernels must only use constructs supported by both.
+
+    Args:
+        function: Kernel function
+
+    Returns:
+        Compiled kernel or the original function
+    """
+    if NUMBA_AVAILABLE:
+        return njit(cache=True, nogil=True)(function)
+    return function
@@ -0,0 +1,101 @@
+"""
+Counters and histograms collected by the flow enforcement strategies.
+"""
+import numpy as np
+from typing import Any, Dict, Union
+
+class AlgorithmCounters:
+    """
+    Named counters and power-of-two histograms of one strategy run.
+
+    Histogram bins are keyed by their lower bound: 0, 1, 2, 4, 8 and so on,
+    a value v falling in the bin of the largest power of two not above v.
+    Level histograms keep one value per flow level, keyed by flow value,
+    and are binned when reported, so runs over separate drainage
+    components merge into the levels of a single run.
+    """
+
+    def __init__(self) -> None:
+        self.counts: Dict[str, int] = {}
+        self.histograms: Dict[str, Dict[int, int]] = {}
+        self.levels: Dict[str, Dict[int, int]] = {}
+
+    def reset(self) -> None:
+        """Clears every counter and histogram."""
+        self.counts.clear()
+        self.histograms.clear()
+        self.levels.clear()
+
+    def increment(self, name: str, amount: int = 1) -> None:
+        """Adds an amount to a counter."""
+        self.counts[name] = self.counts.get(name, 0) + int(amount)
+
+    def record(self, name: str, values: Union[int, np.ndarray]) -> None:
+        """
+        Adds one or more values to a histogram.
+
+        Args:
+            name: Histogram name
+            values: Non-negative value or array of values
+        """
+        values = np.atleast_1d(np.asarray(values, dtype=np.int64))
+        if values.size == 0:
+            return
+        self._add_bins(self.histograms.setdefault(name, {}), self._get_bounds(values))
+
+    def record_levels(self, name: str, flow_values: np.ndarray, values: np.ndarray) -> None:
+        """
+        Adds one value per flow level to a level histogram.
+
+        Args:
+            name: Histogram name
+            flow_values: Flow value of each level
+            values: Non-negative value of each level
+        """
+        if len(flow_values) == 0:
+            return
+        levels = self.levels.setdefault(name, {})
+        for flow_value, value in zip(np.asarray(flow_values).tolist(), np.asarray(values).tolist()):
+            levels[flow_value] = levels.get(flow_value, 0) + int(value)
+
+    def merge(self, other: 'AlgorithmCounters') -> None:
+        """Adds the counters and histograms of another run, summing level histograms by flow value."""
+        for name, amount in other.counts.items():
+            self.increment(name, amount)
+        for name, bins in other.histograms.items():
+            histogram = self.histograms.setdefault(name, {})
+            for bound, count in bins.items():
+                histogram[bound] = histogram.get(bound, 0) + count
+        for name, values in other.levels.items():
+            levels = self.levels.setdefault(name, {})
+            for flow_value, value in values.items():
+                levels[flow_value] = levels.get(flow_value, 0) + value
+
+    def get_histograms(self) -> Dict[str, Dict[int, int]]:
+        """Gets the histograms, with the level histograms binned."""
+        histograms = {name: dict(bins) for name, bins in self.histograms.items()}
+        for name, levels in self.levels.items():
+            values = np.fromiter(levels.values(), dtype=np.int64, count=len(levels))
+            self._add_bins(histograms.setdefault(name, {}), self._get_bounds(values))
+        return histograms
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Gets the counters and histograms as a JSON-serializable dictionary."""
+        return {
+            'counts': dict(self.counts),
+            'histograms': {name: {str(bound): bins[bound] for bound in sorted(bins)}
+                           for name, bins in self.get_histograms().items()}
+        }
+
+    @staticmethod
+    def _get_bounds(values: np.ndarray) -> np.ndarray:
+        """Gets the lower bound of the bin of each value."""
+        # values = mantissa * 2 ** exponent with the mantissa in [0.5, 1)
+        _, exponents = np.frexp(values)
+        return np.where(values > 0, np.left_shift(1, np.maximum(exponents, 1) - 1), 0)
+
+    @staticmethod
+    def _add_bins(histogram: Dict[int, int], bounds: np.ndarray) -> None:
+        """Counts bin bounds into a histogram."""
+        for bound, count in zip(*np.unique(bounds, return_counts=True)):
+            histogram[int(bound)] = histogram.get(int(bound), 0) + int(count)
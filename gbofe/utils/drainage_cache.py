@@ -0,0 +1,152 @@
+"""
+Persistent on-disk cache of rasterized drainage networks.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import numpy as np
+from typing import Callable, List, Optional, Tuple
+from gbofe.config import DRAINAGE_CACHE_MAX_BYTES, DRAINAGE_CACHE_VERSION, HierarchyMode
+from gbofe.utils.drainage_graph import DrainageGraph
+from gbofe.utils.file_operations import get_dataset_files, hash_files
+
+class DrainageCache:
+    """
+    Cache of drainage graphs shared by runs on the same grid and drainage.
+
+    Entries are keyed by the contents of the drainage files, the raster
+    grid (transform, shape and CRS) and the hierarchy settings, and hold the
+    drainage cells and values as .npy files loaded by memory mapping. An
+    entry is written in a temporary directory and renamed into place, so
+    concurrent runs never read a partial entry. Once the cache grows above
+    ``max_bytes`` the least recently used entries are evicted; a run still
+    reading an evicted entry keeps its memory mapping.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = DRAINAGE_CACHE_MAX_BYTES) -> None:
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get_key(self, raster, vector, recursive: bool, hierarchy: HierarchyMode) -> str:
+        """
+        Gets the cache key of a drainage rasterization.
+
+        Args:
+            raster: Base GeoDataRaster object
+            vector: Drainage GeoDataVector object
+            recursive: Whether the drainage hierarchy is created
+            hierarchy: How the drainage hierarchy is derived
+
+        Returns:
+            Hexadecimal key
+        """
+        files_hash = hash_files(get_dataset_files(vector.file_path))
+        settings = '|'.join([
+            str(DRAINAGE_CACHE_VERSION), files_hash, str(tuple(raster.transform)),
+            str((raster.height, raster.width)), str(raster.crs),
+            str(recursive), hierarchy.name if recursive else ''
+        ])
+        return hashlib.sha256(settings.encode()).hexdigest()
+
+    def get_or_build(self, raster, vector, recursive: bool, hierarchy: HierarchyMode,
+                     build: Callable[[], DrainageGraph]) -> DrainageGraph:
+        """
+        Gets a drainage graph from the cache, building and storing it on a miss.
+
+        Args:
+            raster: Base GeoDataRaster object
+            vector: Drainage GeoDataVector object
+            recursive: Whether the drainage hierarchy is created
+            hierarchy: How the drainage hierarchy is derived
+            build: Builds the drainage graph on a miss
+
+        Returns:
+            Drainage graph, memory-mapped on a hit
+        """
+        key = self.get_key(raster, vector, recursive, hierarchy)
+        shape = (raster.height, raster.width)
+
+        graph = self.load(key, shape)
+        if graph is None:
+            graph = build()
+            self.store(key, graph)
+        return graph
+
+    def load(self, key: str, shape: Tuple[int, int]) -> Optional[DrainageGraph]:
+        """Loads the graph of an entry by memory mapping, None on a miss."""
+        entry = os.path.join(self.cache_dir, key)
+        try:
+            cells = np.load(os.path.join(entry, 'cells.npy'), mmap_mode='r')
+            values = np.load(os.path.join(entry, 'values.npy'), mmap_mode='r')
+            os.utime(entry)
+        except (OSError, ValueError):
+            # Missing, corrupt, or evicted while it was being opened
+            return None
+        return DrainageGraph(shape, cells, values)
+
+    def store(self, key: str, graph: DrainageGraph) -> None:
+        """Stores the graph of an entry and evicts old entries above the size limit."""
+        entry = os.path.join(self.cache_dir, key)
+        staging = tempfile.mkdtemp(prefix='.staging-', dir=self.cache_dir)
+        np.save(os.path.join(staging, 'cells.npy'), graph.cells)
+        np.save(os.path.join(staging, 'values.npy'), graph.values)
+
+        try:
+            os.rename(staging, entry)
+        except OSError:
+            # Keep an entry another run stored first, replace a corrupt or partial one
+            if self.load(key, graph.shape) is None:
+                self._discard(key)
+                try:
+                    os.rename(staging, entry)
+                except OSError:
+                    pass
+            shutil.rmtree(staging, ignore_errors=True)
+
+        self.evict(keep=key)
+
+    def evict(self, keep: Optional[str] = None) -> None:
+        """Removes the least recently used entries until the cache fits its size limit."""
+        entries = self._list_entries()
+        total = sum(size for _, _, size in entries)
+
+        for key, _, size in sorted(entries, key=lambda entry: entry[1]):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+
+            if self._discard(key):
+                total -= size
+
+    def _discard(self, key: str) -> bool:
+        """Removes an entry, returning whether it was removed by this call."""
+        # Rename first, so readers see either the whole entry or none of it
+        doomed = os.path.join(self.cache_dir, f".evicted-{key}-{os.getpid()}")
+        try:
+            os.rename(os.path.join(self.cache_dir, key), doomed)
+        except OSError:
+            return False
+        shutil.rmtree(doomed, ignore_errors=True)
+        return True
+
+    def clear(self) -> None:
+        """Removes every entry."""
+        for key, _, _ in self._list_entries():
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+
+    def _list_entries(self) -> List[Tuple[str, float, int]]:
+        """Lists the complete entries as (key, last use time, size in bytes)."""
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            if key.startswith('.'):
+                continue
+            entry = os.path.join(self.cache_dir, key)
+            try:
+                size = sum(os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry))
+                entries.append((key, os.path.getmtime(entry), size))
+            except OSError:
+                continue
+        return entries
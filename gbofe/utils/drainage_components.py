@@ -0,0 +1,198 @@
+"""
+Independent components of a drainage network raster.
+"""
+import numpy as np
+from typing import Optional, Tuple
+from gbofe.config import COMPONENT_HALO, COMPONENT_REACH
+from gbofe.utils.drainage_graph import DrainageGraph
+
+class DrainageComponents:
+    """
+    Groups of drainage cells that never interact during flow enforcement.
+
+    Two drainage cells belong to the same component when they are linked by
+    a chain of drainage cells at most ``reach`` cells apart. Strategies read
+    and write the D8 neighbors of each drainage cell, so with a reach of two
+    the cells touched by different components never overlap and every
+    component can be processed on its own window.
+    """
+
+    def __init__(self, graph: DrainageGraph, reach: int = COMPONENT_REACH) -> None:
+        self.graph = graph
+        self.reach = reach
+
+        _, self.labels = np.unique(self._find_roots(), return_inverse=True)
+        self.order = np.argsort(self.labels, kind='stable')
+        self.sizes = np.bincount(self.labels)
+        self.offsets = np.zeros(self.sizes.size + 1, dtype=np.int64)
+        np.cumsum(self.sizes, out=self.offsets[1:])
+
+    def __len__(self) -> int:
+        return int(self.sizes.size)
+
+    def _find_roots(self) -> np.ndarray:
+        """Finds a representative cell for every drainage cell with a vectorized union-find."""
+        height, width = self.graph.shape
+        rows, cols = self.graph.rows, self.graph.cols
+        sources, targets = [], []
+
+        # Half of the window is enough, links are symmetric
+        for row_offset in range(0, self.reach + 1):
+            for col_offset in range(-self.reach, self.reach + 1):
+                if row_offset == 0 and col_offset <= 0:
+                    continue
+                neighbor_rows = rows + row_offset
+                neighbor_cols = cols + col_offset
+                inside = ((neighbor_rows < height) &
+                          (neighbor_cols >= 0) & (neighbor_cols < width))
+                target = self.graph.find(neighbor_rows[inside] * width + neighbor_cols[inside])
+                sources.append(np.flatnonzero(inside)[target >= 0])
+                targets.append(target[target >= 0])
+
+        return link_roots(len(self.graph), np.concatenate(sources), np.concatenate(targets))
+
+    def get_members(self, component: int) -> np.ndarray:
+        """Gets the graph positions of the cells of a component."""
+        return self.order[self.offsets[component]:self.offsets[component + 1]]
+
+    def get_window(self, component: int, halo: int = COMPONENT_HALO) -> Tuple[int, int, int, int]:
+        """
+        Gets the bounding window of a component.
+
+        Args:
+            component: Component label
+            halo: Cells added around the component, clipped to the raster
+
+        Returns:
+            Tuple (row_start, row_stop, col_start, col_stop)
+        """
+        members = self.get_members(component)
+        rows, cols = np.divmod(self.graph.cells[members], self.graph.shape[1])
+        return (max(int(rows.min()) - halo, 0), min(int(rows.max()) + halo + 1, self.graph.shape[0]),
+                max(int(cols.min()) - halo, 0), min(int(cols.max()) + halo + 1, self.graph.shape[1]))
+
+    def get_windows(self, halo: int = COMPONENT_HALO) -> np.ndarray:
+        """
+        Gets the bounding windows of all components.
+
+        Args:
+            halo: Cells added around the components, clipped to the raster
+
+        Returns:
+            N x 4 windows (row_start, row_stop, col_start, col_stop), by component label
+        """
+        if len(self) == 0:
+            return np.zeros((0, 4), dtype=np.int64)
+
+        height, width = self.graph.shape
+        rows, cols = np.divmod(self.graph.cells[self.order], width)
+        starts = self.offsets[:-1]
+        return np.stack([
+            np.maximum(np.minimum.reduceat(rows, starts) - halo, 0),
+            np.minimum(np.maximum.reduceat(rows, starts) + halo + 1, height),
+            np.maximum(np.minimum.reduceat(cols, starts) - halo, 0),
+            np.minimum(np.maximum.reduceat(cols, starts) + halo + 1, width)
+        ], axis=1).astype(np.int64)
+
+    def get_basins(self, halo: int = COMPONENT_HALO) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Groups the components into basins with disjoint windows.
+
+        Components whose windows overlap are merged until no two windows
+        overlap, so every basin window holds complete components only and
+        can be processed on its own.
+
+        Args:
+            halo: Cells added around the components, clipped to the raster
+
+        Returns:
+            Tuple (windows, sizes): N x 4 basin windows and drainage cells of each basin
+        """
+        if len(self) == 0:
+            return np.zeros((0, 4), dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        height, width = self.graph.shape
+        windows = self.get_windows(halo)
+        sizes = self.sizes.astype(np.int64)
+
+        while True:
+            pairs = find_overlapping_windows(windows)
+            if len(pairs) == 0:
+                return windows, sizes
+
+            # Replace every group of connected windows by its bounding window, which may overlap new windows
+            _, labels = np.unique(link_roots(len(windows), pairs[:, 0], pairs[:, 1]), return_inverse=True)
+            grouped = np.zeros((labels.max() + 1, 4), dtype=np.int64)
+            grouped[:, [0, 2]] = max(height, width)
+            for column, reduce in enumerate((np.minimum, np.maximum, np.minimum, np.maximum)):
+                reduce.at(grouped[:, column], labels, windows[:, column])
+            windows = grouped
+            sizes = np.bincount(labels, weights=sizes).astype(np.int64)
+
+def link_roots(size: int, sources: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    """
+    Finds the root of every item linked by pairs with a vectorized union-find.
+
+    Args:
+        size: Number of items
+        sources: First item of every link
+        targets: Second item of every link
+
+    Returns:
+        Lowest item of the group of every item
+    """
+    roots = np.arange(size)
+
+    while True:
+        # Hook the larger root of every link under the smaller one
+        source_roots, target_roots = roots[sources], roots[targets]
+        linked = source_roots != target_roots
+        if not linked.any():
+            return roots
+        np.minimum.at(roots,
+                      np.maximum(source_roots, target_roots)[linked],
+                      np.minimum(source_roots, target_roots)[linked])
+
+        # Compress paths until every item points to its root
+        while True:
+            parents = roots[roots]
+            if np.array_equal(parents, roots):
+                break
+            roots = parents
+
+def find_overlapping_windows(windows: np.ndarray, others: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Finds the pairs of overlapping windows with a sweep over their rows.
+
+    Windows are visited by first row, and each one is only compared with
+    the windows still open at that row, so the cost grows with the number
+    of windows crossing a row rather than with all pairs.
+
+    Args:
+        windows: N x 4 windows (row_start, row_stop, col_start, col_stop)
+        others: Windows to pair with the windows instead of the windows themselves
+
+    Returns:
+        M x 2 indices of the overlapping pairs, (window, other) pairs with others
+    """
+    windows = np.asarray(windows, dtype=np.int64).reshape(-1, 4)
+    count = len(windows)
+    if others is not None:
+        windows = np.concatenate([windows, np.asarray(others, dtype=np.int64).reshape(-1, 4)])
+    pairs = []
+    active = np.zeros(0, dtype=np.int64)
+
+    for index in np.argsort(windows[:, 0], kind='stable'):
+        row_start, _, col_start, col_stop = windows[index]
+        active = active[windows[active, 1] > row_start]
+        hits = active[(windows[active, 2] < col_stop) & (col_start < windows[active, 3])]
+        if others is not None:
+            hits = hits[(hits < count) != (index < count)]
+        if hits.size:
+            pairs.append(np.stack([np.full(hits.size, index), hits], axis=1))
+        active = np.append(active, index)
+
+    pairs = np.concatenate(pairs) if pairs else np.zeros((0, 2), dtype=np.int64)
+    if others is not None:
+        pairs = np.sort(pairs, axis=1) - [0, count]
+    return pairs
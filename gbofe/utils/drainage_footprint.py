@@ -0,0 +1,87 @@
+"""
+Compact storage of the cells touched by flow enforcement.
+"""
+import numpy as np
+from gbofe.config import D8_COL_OFFSETS, D8_ROW_OFFSETS, PAD_ELEVATION
+from gbofe.utils.drainage_graph import DrainageGraph
+
+class DrainageFootprint:
+    """
+    Drainage cells and their D8 neighbors gathered into a compact array.
+
+    Strategies only read and write the drainage cells and their neighbors,
+    so elevations are kept for those cells alone, in row-major order of the
+    raster padded with pad_array. ``slots`` gives the position of every
+    drainage graph node and ``neighbor_slots`` the positions of its D8
+    neighbors. Neighbors outside the raster keep their own padding slot, as
+    in a padded buffer. Memory is proportional to the number of drainage
+    cells instead of the grid size.
+    """
+
+    def __init__(self, graph: DrainageGraph) -> None:
+        self.graph = graph
+        height, width = graph.shape
+
+        # Footprint cells as flat indices of the padded raster
+        padded_cells = graph.get_padded_cells()
+        neighbor_cells = padded_cells[:, None] + D8_ROW_OFFSETS * (width + 2) + D8_COL_OFFSETS
+        self.cells = np.union1d(padded_cells, neighbor_cells.ravel())
+        self.slots = np.searchsorted(self.cells, padded_cells)
+        self.neighbor_slots = np.searchsorted(self.cells, neighbor_cells)
+
+        # Raster coordinates of the footprint cells, -1 or the size on the padding
+        padded_rows, padded_cols = np.divmod(self.cells, width + 2)
+        self.rows = padded_rows - 1
+        self.cols = padded_cols - 1
+        self.inside = ((self.rows >= 0) & (self.rows < height) &
+                       (self.cols >= 0) & (self.cols < width))
+
+    def __len__(self) -> int:
+        return int(self.cells.size)
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the footprint arrays and its drainage graph."""
+        return self.graph.nbytes + sum(array.nbytes for array in (
+            self.cells, self.slots, self.neighbor_slots, self.rows, self.cols, self.inside))
+
+    def _iter_blocks(self, block_rows: int):
+        """Yields (row_start, row_stop, positions) for the row blocks holding footprint cells."""
+        positions = np.flatnonzero(self.inside)
+        rows = self.rows[positions]
+
+        for row_start in range(0, self.graph.shape[0], block_rows):
+            row_stop = min(row_start + block_rows, self.graph.shape[0])
+            first, last = np.searchsorted(rows, [row_start, row_stop])
+            if first < last:
+                yield row_start, row_stop, positions[first:last]
+
+    def gather(self, source: np.ndarray, block_rows: int) -> np.ndarray:
+        """
+        Reads the footprint elevations from a raster, one block of rows at a time.
+
+        Args:
+            source: Raster data, in memory or memory-mapped
+            block_rows: Rows read at once
+
+        Returns:
+            Elevation of each footprint cell, PAD_ELEVATION on the padding
+        """
+        elevations = np.full(len(self), PAD_ELEVATION, dtype=np.float64)
+        for row_start, row_stop, positions in self._iter_blocks(block_rows):
+            block = np.asarray(source[row_start:row_stop])
+            elevations[positions] = block[self.rows[positions] - row_start, self.cols[positions]]
+        return elevations
+
+    def scatter(self, target: np.ndarray, elevations: np.ndarray, block_rows: int) -> None:
+        """
+        Writes the footprint elevations into a raster, one block of rows at a time.
+
+        Args:
+            target: Raster data, in memory or memory-mapped
+            elevations: Elevation of each footprint cell
+            block_rows: Rows written at once
+        """
+        for row_start, row_stop, positions in self._iter_blocks(block_rows):
+            block = target[row_start:row_stop]
+            block[self.rows[positions] - row_start, self.cols[positions]] = elevations[positions]
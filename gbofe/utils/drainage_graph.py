@@ -0,0 +1,221 @@
+"""
+Sparse graph of the drainage cells of a raster.
+"""
+import numpy as np
+from typing import Iterator, Optional, Tuple
+from gbofe.config import D8_COL_OFFSETS, D8_ROW_OFFSETS, FLOW_ACCUMULATION_THRESHOLD
+from gbofe.utils.drainage_index import FlowLevelIndex
+
+class DrainageGraph:
+    """
+    Compact representation of a rasterized drainage network.
+
+    Stores the flat indices and flow values of the drainage cells, sorted in
+    row-major order, and the D8 adjacency between drainage cells in CSR form:
+    the neighbors of the cell at position ``i`` are
+    ``indices[indptr[i]:indptr[i + 1]]`` and ``directions`` holds the D8
+    direction (0-7, as in get_neighbors) of each of them. Memory is
+    proportional to the number of drainage cells instead of the grid size.
+    """
+
+    def __init__(self, shape: Tuple[int, int], cells: np.ndarray, values: np.ndarray) -> None:
+        self.shape = shape
+        self.cells = cells
+        self.values = values
+        self.indptr, self.indices, self.directions = self._build_adjacency()
+
+    @classmethod
+    def from_raster(cls, drainage_data: np.ndarray,
+                    min_threshold: int = FLOW_ACCUMULATION_THRESHOLD) -> 'DrainageGraph':
+        """Creates the graph from a drainage raster."""
+        flow_values = drainage_data.ravel()
+        cells = np.flatnonzero(flow_values >= min_threshold)
+        return cls(drainage_data.shape, cells, flow_values[cells])
+
+    def __len__(self) -> int:
+        return int(self.cells.size)
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the cell and adjacency arrays."""
+        return sum(array.nbytes for array in (self.cells, self.values, self.indptr,
+                                              self.indices, self.directions))
+
+    @property
+    def rows(self) -> np.ndarray:
+        """Row of each drainage cell."""
+        return self.cells // self.shape[1]
+
+    @property
+    def cols(self) -> np.ndarray:
+        """Column of each drainage cell."""
+        return self.cells % self.shape[1]
+
+    def find(self, flat_cells: np.ndarray) -> np.ndarray:
+        """
+        Gets the graph positions of flat cell indices.
+
+        Args:
+            flat_cells: Flat indices in the raster
+
+        Returns:
+            Position of each cell in the graph, -1 for non-drainage cells
+        """
+        if len(self.cells) == 0:
+            return np.full(np.shape(flat_cells), -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.cells, flat_cells), len(self.cells) - 1)
+        return np.where(self.cells[positions] == flat_cells, positions, -1)
+
+    def _build_adjacency(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Builds the CSR adjacency between D8-neighboring drainage cells."""
+        height, width = self.shape
+        rows, cols = self.rows, self.cols
+        sources, targets, directions = [], [], []
+
+        for direction, (row_offset, col_offset) in enumerate(zip(D8_ROW_OFFSETS, D8_COL_OFFSETS)):
+            neighbor_rows = rows + row_offset
+            neighbor_cols = cols + col_offset
+            inside = ((neighbor_rows >= 0) & (neighbor_rows < height) &
+                      (neighbor_cols >= 0) & (neighbor_cols < width))
+            source = np.flatnonzero(inside)
+            target = self.find(neighbor_rows[inside] * width + neighbor_cols[inside])
+            found = target >= 0
+            sources.append(source[found])
+            targets.append(target[found])
+            directions.append(np.full(found.sum(), direction, dtype=np.int8))
+
+        sources = np.concatenate(sources)
+        order = np.argsort(sources, kind='stable')
+        indptr = np.zeros(len(self.cells) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=len(self.cells)), out=indptr[1:])
+
+        return indptr, np.concatenate(targets)[order], np.concatenate(directions)[order]
+
+    def get_neighbors(self, position: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Gets the drainage neighbors of a cell.
+
+        Args:
+            position: Position of the cell in the graph
+
+        Returns:
+            Tuple (positions, directions) of the neighboring drainage cells
+        """
+        start, stop = self.indptr[position], self.indptr[position + 1]
+        return self.indices[start:stop], self.directions[start:stop]
+
+    def get_padded_cells(self) -> np.ndarray:
+        """Gets the flat indices of the drainage cells in a buffer padded with pad_array."""
+        return (self.rows + 1) * (self.shape[1] + 2) + self.cols + 1
+
+    def get_flow_levels(self, padded: bool = False) -> FlowLevelIndex:
+        """
+        Groups the drainage cells by flow value.
+
+        Args:
+            padded: Whether the index cells refer to a buffer padded with pad_array
+
+        Returns:
+            Flow level index whose ``order`` holds graph positions
+        """
+        if padded:
+            shape = (self.shape[0] + 2, self.shape[1] + 2)
+            return FlowLevelIndex.from_cells(shape, self.get_padded_cells(), self.values)
+        return FlowLevelIndex.from_cells(self.shape, self.cells, self.values)
+
+    def get_dependency_layers(self) -> Iterator[np.ndarray]:
+        """
+        Yields the drainage cells in layers of cells that can be processed at once.
+
+        Cells are processed by flow level and in row-major order within a
+        level, and each one waits on the adjacent drainage cells processed
+        before it. The cells of a layer are never adjacent and only depend on
+        cells of previous layers.
+
+        Yields:
+            Graph positions of the cells of each layer
+        """
+        # Processing rank of every cell: by flow level, then row-major
+        ranks = np.empty(len(self), dtype=np.int64)
+        ranks[self.get_flow_levels().order] = np.arange(len(self))
+
+        # Keep the edges going to neighbors processed later
+        sources = np.repeat(np.arange(len(self)), np.diff(self.indptr))
+        later = ranks[self.indices] > ranks[sources]
+        return peel_layers(len(self), sources[later], self.indices[later])
+
+    def get_window(self, halo: int = 0) -> Tuple[int, int, int, int]:
+        """
+        Gets the bounding window of the drainage cells.
+
+        Args:
+            halo: Cells added around the drainage cells, clipped to the raster
+
+        Returns:
+            Tuple (row_start, row_stop, col_start, col_stop), empty without drainage cells
+        """
+        if len(self.cells) == 0:
+            return 0, 0, 0, 0
+        rows, cols = self.rows, self.cols
+        return (max(int(rows.min()) - halo, 0), min(int(rows.max()) + halo + 1, self.shape[0]),
+                max(int(cols.min()) - halo, 0), min(int(cols.max()) + halo + 1, self.shape[1]))
+
+    def to_raster(self, values: Optional[np.ndarray] = None, dtype: np.dtype = np.int32,
+                  window: Optional[Tuple[int, int, int, int]] = None,
+                  out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Rebuilds a dense drainage raster.
+
+        Args:
+            values: Values of the drainage cells, the graph values by default
+            dtype: Raster data type, ignored when out is given
+            window: Tuple (row_start, row_stop, col_start, col_stop) to rebuild, the full raster by default
+            out: Zero-filled array of the window shape to write into
+
+        Returns:
+            Dense drainage raster
+        """
+        values = self.values if values is None else values
+        if window is None:
+            window = (0, self.shape[0], 0, self.shape[1])
+
+        row_start, row_stop, col_start, col_stop = window
+        rows, cols = self.rows, self.cols
+        inside = ((rows >= row_start) & (rows < row_stop) &
+                  (cols >= col_start) & (cols < col_stop))
+        raster = np.zeros((row_stop - row_start, col_stop - col_start), dtype=dtype) if out is None else out
+        raster[rows[inside] - row_start, cols[inside] - col_start] = values[inside]
+        return raster
+
+def peel_layers(count: int, sources: np.ndarray, targets: np.ndarray) -> Iterator[np.ndarray]:
+    """
+    Yields the nodes of a dependency graph in layers of nodes that can be processed at once.
+
+    Every node waits on the sources of the edges pointing to it, so a layer
+    holds the nodes whose sources all lie in previous layers.
+
+    Args:
+        count: Number of nodes
+        sources: Node each edge comes from, processed first
+        targets: Node each edge goes to, waiting on its source
+
+    Yields:
+        Nodes of each layer in ascending order
+    """
+    order = np.argsort(sources, kind='stable')
+    successors = targets[order]
+    successor_ptr = np.zeros(count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=count), out=successor_ptr[1:])
+    pending = np.bincount(targets, minlength=count)
+
+    layer = np.flatnonzero(pending == 0)
+    while layer.size:
+        yield layer
+
+        # Release the nodes waiting on this layer
+        counts = successor_ptr[layer + 1] - successor_ptr[layer]
+        edges = (np.repeat(successor_ptr[layer] - np.cumsum(counts) + counts, counts)
+                 + np.arange(counts.sum()))
+        released = successors[edges]
+        np.subtract.at(pending, released, 1)
+        layer = np.unique(released[pending[released] == 0])
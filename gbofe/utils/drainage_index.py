@@ -0,0 +1,90 @@
+"""
+Index of drainage cells grouped by flow value.
+"""
+import numpy as np
+from typing import Iterator, Tuple
+from gbofe.config import FLOW_ACCUMULATION_THRESHOLD
+
+class FlowLevelIndex:
+    """
+    Drainage cells sorted and grouped by flow value.
+
+    The index is built once with a stable sort over the non-zero drainage
+    cells, so the cells of every level keep the row-major order returned by
+    ``np.argwhere``. Strategies walk the levels in ascending order instead of
+    scanning the full raster for each flow value. ``order`` maps the sorted
+    cells back to their position in the input cell list.
+    """
+
+    def __init__(self, drainage_data: np.ndarray,
+                 min_threshold: int = FLOW_ACCUMULATION_THRESHOLD) -> None:
+        flow_values = drainage_data.ravel()
+        cells = np.flatnonzero(flow_values >= min_threshold)
+        self._build(drainage_data.shape, cells, flow_values[cells])
+
+    @classmethod
+    def from_cells(cls, shape: Tuple[int, int], cells: np.ndarray,
+                   values: np.ndarray) -> 'FlowLevelIndex':
+        """
+        Creates the index from drainage cells that are already extracted.
+
+        Args:
+            shape: Shape of the raster the flat indices refer to
+            cells: Flat indices of the drainage cells in row-major order
+            values: Flow value of each cell
+
+        Returns:
+            Flow level index
+        """
+        index = cls.__new__(cls)
+        index._build(shape, cells, values)
+        return index
+
+    def _build(self, shape: Tuple[int, int], cells: np.ndarray, values: np.ndarray) -> None:
+        """Sorts the cells by flow value and computes the level offsets."""
+        self.order = np.argsort(values, kind='stable')
+        self.shape = shape
+        self.cells = cells[self.order]
+        self.levels, starts = np.unique(values[self.order], return_index=True)
+        self.offsets = np.append(starts, self.cells.size)
+
+    def __len__(self) -> int:
+        return int(self.levels.size)
+
+    def __iter__(self) -> Iterator[Tuple[int, np.ndarray]]:
+        """Yields (flow_value, indices) for each level in ascending order."""
+        for position, flow_value in enumerate(self.levels):
+            yield flow_value, self.get_indices(position)
+
+    def get_order(self, position: int) -> np.ndarray:
+        """Gets the input positions of the cells in the level at the given position."""
+        return self.order[self.offsets[position]:self.offsets[position + 1]]
+
+    def get_cells(self, position: int) -> np.ndarray:
+        """Gets the flat indices of the cells in the level at the given position."""
+        return self.cells[self.offsets[position]:self.offsets[position + 1]]
+
+    def get_indices(self, position: int) -> np.ndarray:
+        """Gets the (row, column) indices of the cells in the level at the given position."""
+        rows, cols = np.divmod(self.get_cells(position), self.shape[1])
+        return np.column_stack((rows, cols))
+
+    @staticmethod
+    def select_active(drainage_data: np.ndarray, indices: np.ndarray,
+                      flow_value: int) -> np.ndarray:
+        """
+        Keeps the indices whose drainage value still equals the flow value.
+
+        Strategies zero drainage cells while they process them; filtering a
+        level against the current raster reproduces a fresh ``np.argwhere``
+        scan of that level without touching the rest of the grid.
+
+        Args:
+            drainage_data: Drainage data being modified by the strategy
+            indices: (row, column) indices of a level
+            flow_value: Flow value of the level
+
+        Returns:
+            Indices of the cells that are still active
+        """
+        return indices[drainage_data[indices[:, 0], indices[:, 1]] == flow_value]
@@ -1,6 +1,7 @@
 """
 File operations and validation.
 """
+import hashlib
 import os
 from typing import List
 from gbofe.exceptions import InvalidFileFormatError, FileNoFoundError
@@ -41,4 +42,44 @@ def create_output_directory(output_path: str) -> None:
     """
     directory = os.path.dirname(output_path)
     if directory and not os.path.exists(directory):
-        os.makedirs(directory)
\ No newline at end of file
+        os.makedirs(directory)
+
+def get_dataset_files(file_path: str) -> List[str]:
+    """
+    Gets the files of a dataset: the file itself and its sidecar files.
+
+    A shapefile is stored across files sharing its name (.shx, .dbf,
+    .prj, ...), all of them needed to read it.
+
+    Args:
+        file_path: Main file path
+
+    Returns:
+        Sorted paths of the existing dataset files
+    """
+    stem, _ = os.path.splitext(file_path)
+    directory = os.path.dirname(file_path) or '.'
+    prefix = os.path.basename(stem) + '.'
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.startswith(prefix) and '.' not in name[len(prefix):]
+    )
+
+def hash_files(file_paths: List[str], chunk_size: int = 1024 ** 2) -> str:
+    """
+    Hashes the contents of files.
+
+    Args:
+        file_paths: File paths, hashed in the given order
+        chunk_size: Bytes read at once
+
+    Returns:
+        Hexadecimal SHA-256 digest
+    """
+    digest = hashlib.sha256()
+    for file_path in file_paths:
+        digest.update(os.path.basename(file_path).encode())
+        with open(file_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(chunk_size), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
@@ -2,37 +2,172 @@
 Geometric utilities for DEM processing.
 """
 import numpy as np
-import rasterio
-from rasterio.features import rasterize
-import rasterio.enums
+import shapely
+from functools import lru_cache
 from tqdm import tqdm
-from typing import Tuple
-from gbofe.config import DIAGONAL_MULTIPLIER, PROGRESS_MESSAGES
-from gbofe.utils.ui_helpers import animated_loading
+from typing import Dict, Optional, Tuple, Union
+from gbofe.config import (
+    D8_COL_OFFSETS, D8_ROW_OFFSETS, DIAGONAL_MULTIPLIER, LEVEL_BATCH_SIZE,
+    PROGRESS_MESSAGES, HierarchyMode
+)
+from gbofe.utils.compiled import jit
+from gbofe.utils.drainage_graph import DrainageGraph
+from gbofe.utils.network_topology import ReachGraph
+from gbofe.utils.instrumentation import stage
+
+class D8Stencil:
+    """
+    D8 neighborhood over the flattened cells of a padded raster.
+
+    Flat offsets are computed once for the raster width, so the neighbors of
+    N cells are gathered with a single ``np.take``. Output buffers are kept
+    between calls and only grow, so repeated gathers do not allocate. The
+    arrays returned are views of those buffers and are overwritten by the
+    next call with the same dtype.
+    """
+
+    def __init__(self, shape: Tuple[int, int]) -> None:
+        self.shape = shape
+        self.offsets = D8_ROW_OFFSETS * shape[1] + D8_COL_OFFSETS
+        self._buffers: Dict[str, np.ndarray] = {}
+
+    def _get_buffer(self, size: int, dtype: np.dtype) -> np.ndarray:
+        """Gets an N x 8 buffer of the given dtype, growing it when needed."""
+        dtype = np.dtype(dtype)
+        buffer = self._buffers.get(dtype.str)
+        if buffer is None or buffer.shape[0] < size:
+            capacity = size if buffer is None else max(size, 2 * buffer.shape[0])
+            buffer = np.empty((capacity, 8), dtype=dtype)
+            self._buffers[dtype.str] = buffer
+        return buffer[:size]
+
+    def neighbor_cells(self, cells: np.ndarray) -> np.ndarray:
+        """
+        Gets the flat indices of the D8 neighbors of the given cells.
+
+        Args:
+            cells: Flat indices of N cells in the padded raster
+
+        Returns:
+            N x 8 array of neighbor flat indices
+        """
+        neighbors = self._get_buffer(len(cells), np.intp)
+        np.add(cells[:, None], self.offsets, out=neighbors)
+        return neighbors
+
+    def gather(self, values: np.ndarray, cells: np.ndarray) -> np.ndarray:
+        """
+        Gathers the D8 neighbor values of the given cells.
+
+        Args:
+            values: Flattened padded raster
+            cells: Flat indices of N cells in the padded raster
+
+        Returns:
+            N x 8 array of neighbor values
+        """
+        neighbors = self.neighbor_cells(cells)
+        out = self._get_buffer(len(cells), values.dtype)
+        np.take(values, neighbors, out=out, mode='clip')
+        return out
+
+def pad_array(matrix: np.ndarray, fill_value: Union[int, float],
+              in_place: bool = False) -> np.ndarray:
+    """
+    Copies a matrix into a buffer with a one cell border.
+
+    Edge cells of the padded buffer have all their D8 neighbors in bounds,
+    so neighborhood operations do not need edge checks. Cells outside the
+    raster read the fill value.
+
+    Args:
+        matrix: Data matrix
+        fill_value: Value of the border cells
+        in_place: Whether a matrix created with create_padded_array may be padded without a copy
+
+    Returns:
+        Padded copy of the matrix, or the buffer holding it when padded in place
+    """
+    if in_place and _is_padded_view(matrix, fill_value):
+        return matrix.base
+
+    padded = np.full((matrix.shape[0] + 2, matrix.shape[1] + 2), fill_value, dtype=matrix.dtype)
+    padded[1:-1, 1:-1] = matrix
+    return padded
+
+def unpad_array(padded: np.ndarray) -> np.ndarray:
+    """Gets the view of a padded buffer without its border."""
+    return padded[1:-1, 1:-1]
+
+def create_padded_array(shape: Tuple[int, int], dtype: np.dtype,
+                        fill_value: Union[int, float]) -> np.ndarray:
+    """
+    Allocates a padded buffer and gets its view without the border.
+
+    Data written into the view is padded in place by pad_array, so a raster
+    read into it is never copied to be padded.
+
+    Args:
+        shape: Shape of the unpadded data
+        dtype: Data type
+        fill_value: Value of the border cells
+
+    Returns:
+        View of the buffer without its border
+    """
+    return unpad_array(np.full((shape[0] + 2, shape[1] + 2), fill_value, dtype=dtype))
+
+def _is_padded_view(matrix: np.ndarray, fill_value: Union[int, float]) -> bool:
+    """Checks whether a matrix is the unpadded view of a buffer whose border holds the fill value."""
+    padded = matrix.base
+    if not isinstance(padded, np.ndarray) or padded.shape != (matrix.shape[0] + 2, matrix.shape[1] + 2):
+        return False
+
+    interior = unpad_array(padded)
+    if (interior.__array_interface__['data'] != matrix.__array_interface__['data']
+            or interior.strides != matrix.strides):
+        return False
+
+    border = np.concatenate([padded[0], padded[-1], padded[1:-1, 0], padded[1:-1, -1]])
+    return bool(np.all(border == fill_value))
+
+def get_drainage_dtype(values: np.ndarray) -> np.dtype:
+    """Gets the smallest unsigned integer type holding drainage values."""
+    return np.min_scalar_type(int(values.max()) if values.size else 0)
+
+@lru_cache(maxsize=None)
+def get_distances(resolution: float) -> np.ndarray:
+    """
+    Gets the distances to the D8 neighbors for a resolution.
+
+    Args:
+        resolution: Raster resolution
+
+    Returns:
+        Read-only array with cardinal = resolution and diagonal = resolution * sqrt(2)
+    """
+    distances = np.where(
+        np.arange(8) % 2 == 0,
+        resolution,
+        resolution * DIAGONAL_MULTIPLIER
+    )
+    distances.flags.writeable = False
+    return distances
 
 def get_neighbors(matrix: np.ndarray, position: Tuple[int, int]) -> np.ndarray:
     """
     Gets neighboring values based on D8 algorithm.
 
     Args:
-        matrix: Data matrix
+        matrix: Data matrix, padded with pad_array when position may be an edge cell
         position: Tuple (row, column) of position
 
     Returns:
         Array with neighbor values and their coordinates
     """
-    r, c = position
-    neighbors = np.array([
-        [matrix[r - 1, c], r - 1, c],  # North
-        [matrix[r - 1, c + 1], r - 1, c + 1],  # Northeast
-        [matrix[r, c + 1], r, c + 1],  # East
-        [matrix[r + 1, c + 1], r + 1, c + 1],  # Southeast
-        [matrix[r + 1, c], r + 1, c],  # South
-        [matrix[r + 1, c - 1], r + 1, c - 1],  # Southwest
-        [matrix[r, c - 1], r, c - 1],  # West
-        [matrix[r - 1, c - 1], r - 1, c - 1]  # Northwest
-    ])
-    return neighbors
+    rows = position[0] + D8_ROW_OFFSETS
+    cols = position[1] + D8_COL_OFFSETS
+    return np.column_stack((matrix[rows, cols], rows, cols))
 
 def get_slopes(elevation_neighbors: np.ndarray, elevation_cell: float,
                resolution: float) -> np.ndarray:
@@ -47,14 +182,7 @@ def get_slopes(elevation_neighbors: np.ndarray, elevation_cell: float,
     Returns:
         Array of slope values
     """
-    # Distances: cardinal = resolution, diagonal = resolution * sqrt(2)
-    distances = np.where(
-        np.array([0, 1, 2, 3, 4, 5, 6, 7]) % 2 == 0,
-        resolution,
-        resolution * DIAGONAL_MULTIPLIER
-    )
-
-    slope_values = (elevation_cell - elevation_neighbors) / distances
+    slope_values = (elevation_cell - elevation_neighbors) / get_distances(resolution)
     return slope_values.reshape(-1, 1)
 
 def get_factor(neighbor_index: int, resolution: float) -> float:
@@ -70,100 +198,292 @@ def get_factor(neighbor_index: int, resolution: float) -> float:
     """
     return resolution * (DIAGONAL_MULTIPLIER if neighbor_index % 2 != 0 else 1.0)
 
-def rasterize_drainage(raster, vector, recursive: bool = False) -> np.ndarray:
+def sample_drainage(raster, vector, recursive: bool = False,
+                    hierarchy: HierarchyMode = HierarchyMode.RASTER,
+                    reaches: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
     """
-    Generates a drainage raster from a drainage shapefile.
+    Samples the drainage lines and maps the samples to raster cells.
+
+    Points are generated every raster resolution along each line with
+    vectorized shapely operations and mapped to cells with the inverse
+    affine transform, like a point rasterization. When several samples fall
+    in the same cell only the last one is kept, as with a replace merge.
+    Lines are sampled by ascending length, also when only some reaches are
+    sampled, so a cell gets the same value as long as every reach crossing
+    it is sampled.
 
     Args:
         raster: Base GeoDataRaster object
         vector: Drainage GeoDataVector object
-        recursive: Whether to create drainage hierarchy
+        recursive: Whether samples take a hierarchy value instead of 1
+        hierarchy: Source of the hierarchy values, the sample index along its
+            line for RASTER or the flow path length in cells for TOPOLOGY
+        reaches: Positions in the vector of the reaches to sample, all by default
 
     Returns:
-        Numpy array with rasterized drainage
+        Tuple (cells, values) with the flat index and value of each burned cell
     """
-    animated_loading(PROGRESS_MESSAGES['rasterizing'])
-
     # Resolution assuming square pixels
     resolution = raster.get_resolution()
 
     # Reproject shapefile to base raster CRS if different
     if vector.crs != raster.crs:
-        vector.reproject(raster.crs)
+        with stage('reproject', len(vector.geo)):
+            vector.reproject(raster.crs)
 
     # Calculate longitud and order values from GeoDataFrame
     vector.geo["length"] = vector.geo.geometry.length
-    vector.geo = vector.geo.sort_values("length", ascending=True)
-
-    # Generate a list of points (with numeric value) for each polyline
-    shapes_list = []
-
-    for idx, row in vector.geo.iterrows():
-        geom = row.geometry
-
-        # Check if geometry is LineString or MultiLineString
-        if geom.geom_type == "LineString":
-            lines = [geom]
-        elif geom.geom_type == "MultiLineString":
-            lines = list(geom.geoms)
-        else:
-            continue
-
-        # Process each line component
-        for line in lines:
-            # Calcular número de puntos
-            n_points = max(int(line.length / resolution) + 1, 2)
-            distances = np.linspace(1, line.length, n_points)
-
-            if recursive:
-                for i, dist in enumerate(distances):
-                    point = line.interpolate(dist)
-                    shapes_list.append((point, int(i)))
-            else:
-                points = line.interpolate(distances)
-                for point in points:
-                    shapes_list.append((point, 1))
-
-    # Rasterize points using a base raster extent, resolution and transform
-    drainage_raster = rasterize(
-        shapes=shapes_list,
-        out_shape=(raster.height, raster.width),
-        transform=raster.transform,
-        fill=0,
-        dtype=rasterio.int32,
-        merge_alg=rasterio.enums.MergeAlg.replace
+    order = vector.geo["length"].reset_index(drop=True).sort_values(ascending=True).index.to_numpy()
+    vector.geo = vector.geo.iloc[order]
+
+    # Split LineString and MultiLineString geometries into line components
+    geometries = np.asarray(vector.geo.geometry.array)
+    if reaches is not None:
+        geometries = geometries[np.isin(order, reaches)]
+    type_ids = shapely.get_type_id(geometries)
+    lines = shapely.get_parts(geometries[(type_ids == 1) | (type_ids == 5)])
+
+    # Number of points per line and their index along it
+    lengths = shapely.length(lines)
+    n_points = np.maximum((lengths / resolution).astype(np.int64) + 1, 2)
+    line_ids = np.repeat(np.arange(len(lines)), n_points)
+    point_ids = np.arange(line_ids.size) - np.repeat(np.cumsum(n_points) - n_points, n_points)
+
+    # Same values as np.linspace(1, length, n_points) for every line
+    deltas = lengths - 1
+    divisions = n_points - 1
+    steps = deltas / divisions
+    distances = point_ids * steps[line_ids] + 1
+    zero_steps = (steps == 0)[line_ids]
+    distances[zero_steps] = (
+        point_ids[zero_steps] / divisions[line_ids[zero_steps]] * deltas[line_ids[zero_steps]] + 1
     )
+    distances[np.cumsum(n_points) - 1] = lengths
 
-    if recursive:
-        return _create_drainage_hierarchy(drainage_raster)
+    x, y = _interpolate_lines(lines, line_ids, distances)
+    if not recursive:
+        values = np.ones(point_ids.size, dtype=np.int64)
+    elif hierarchy == HierarchyMode.TOPOLOGY:
+        # Flow path length from the farthest headwater, counted in cells
+        path_lengths = ReachGraph(lines).get_path_lengths(line_ids, distances)
+        values = (path_lengths / resolution).astype(np.int64) + 1
     else:
-        return drainage_raster
-
-def _create_drainage_hierarchy(drainage_raster: np.ndarray) -> np.ndarray:
-    """Creates drainage hierarchy for recursive processing."""
-    raster_val = drainage_raster.copy()
-    raster_mod = drainage_raster.copy()
-    unique_values = np.unique(drainage_raster)
-
-    for value in tqdm(unique_values, desc=PROGRESS_MESSAGES['hierarchy']):
-        if value == 0:
-            continue
-
-        indices = np.argwhere(drainage_raster == value)
-
-        for index in indices:
-            neighbors_val = get_neighbors(raster_val, index)
-            neighbors_mod = get_neighbors(raster_mod, index)
-
-            if max(neighbors_val[:, 0]) > 0:
-                active_neighbors = neighbors_mod[neighbors_mod[:, 0] > 0]
-                if len(active_neighbors) <= 2:
-                    raster_mod[index[0], index[1]] = max(neighbors_mod[:, 0]) + 1
-                else:
-                    raster_mod[index[0], index[1]] = max(neighbors_mod[:, 0]) + 2
-                raster_val[index[0], index[1]] = 0
-            else:
-                raster_mod[index[0], index[1]] = min(neighbors_mod[:, 0]) + 1
-                raster_val[index[0], index[1]] = 0
+        values = point_ids
+
+    # Map points to cells as a point rasterization does
+    cols, rows = ~raster.transform * (x, y)
+    inside = ((rows >= 0) & (rows < raster.height) &
+              (cols >= 0) & (cols < raster.width))
+    cells = np.floor(rows[inside]).astype(np.int64) * raster.width + np.floor(cols[inside]).astype(np.int64)
+    values = values[inside]
+
+    # Keep the last sample of each cell
+    unique_cells, last = np.unique(cells[::-1], return_index=True)
+    values = values[::-1][last].astype(np.int32)
+
+    # Cells burned with the fill value hold no drainage
+    burned = values != 0
+    return unique_cells[burned], values[burned]
+
+def _segmented_cumsum(values: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """
+    Cumulative sums restarted at every segment of consecutive values.
+
+    Sums are accumulated sequentially inside each segment, so they match a
+    running total computed element by element. Segments are grouped by
+    power-of-two size and zero-padded into 2D blocks.
+    """
+    result = np.empty_like(values)
+    starts = np.cumsum(counts) - counts
+    buckets = np.ceil(np.log2(np.maximum(counts, 1))).astype(np.int64)
+
+    for bucket in np.unique(buckets[counts > 0]):
+        group = np.flatnonzero((buckets == bucket) & (counts > 0))
+        offsets = np.arange(counts[group].max())
+        valid = offsets < counts[group][:, None]
+        positions = starts[group][:, None] + offsets
+        block = np.where(valid, values[np.where(valid, positions, 0)], 0.0)
+        np.cumsum(block, axis=1, out=block)
+        result[positions[valid]] = block[valid]
+
+    return result
+
+def _interpolate_lines(lines: np.ndarray, line_ids: np.ndarray,
+                       distances: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Interpolates points at distances along lines.
+
+    Equivalent to ``shapely.line_interpolate_point`` for non-negative
+    distances, following the same arithmetic as GEOS (sequential segment
+    lengths, first segment whose end lies beyond the distance, fraction
+    along it), but locating the segments with a single sort instead of
+    walking each line from its start for every point.
+
+    Args:
+        lines: LineString geometries
+        line_ids: Line of each point
+        distances: Distance of each point along its line
+
+    Returns:
+        Tuple (x, y) of point coordinates, NaN for empty lines
+    """
+    coords, coord_lines = shapely.get_coordinates(lines, return_index=True)
+    n_coords = np.bincount(coord_lines, minlength=len(lines))
+    coord_starts = np.cumsum(n_coords) - n_coords
+    n_segments = np.maximum(n_coords - 1, 0)
+    segment_starts = np.cumsum(n_segments) - n_segments
+
+    # Segment lengths and cumulative length at the end of each segment
+    segment_lines = np.repeat(np.arange(len(lines)), n_segments)
+    segment_points = (coord_starts[segment_lines] + np.arange(segment_lines.size)
+                      - segment_starts[segment_lines])
+    dx = coords[segment_points + 1, 0] - coords[segment_points, 0]
+    dy = coords[segment_points + 1, 1] - coords[segment_points, 1]
+    segment_lengths = np.sqrt(dx * dx + dy * dy)
+    segment_ends = _segmented_cumsum(segment_lengths, n_segments)
+
+    # Count the segments of each line ending at or before each distance
+    keys_lines = np.concatenate([segment_lines, line_ids])
+    keys_values = np.concatenate([segment_ends, distances])
+    keys_kind = np.concatenate([np.zeros(segment_lines.size, dtype=np.int8),
+                                np.ones(line_ids.size, dtype=np.int8)])
+    order = np.lexsort((keys_kind, keys_values, keys_lines))
+    passed = np.cumsum(keys_kind[order] == 0)
+    is_point = keys_kind[order] == 1
+    segments = np.empty(line_ids.size, dtype=np.int64)
+    segments[order[is_point] - segment_lines.size] = passed[is_point]
+    segments -= segment_starts[line_ids]
+
+    # Points beyond the last segment take the last vertex
+    past_end = segments >= n_segments[line_ids]
+    segments = np.minimum(segments, np.maximum(n_segments[line_ids] - 1, 0))
+    global_segments = segment_starts[line_ids] + segments
+
+    x = np.full(line_ids.size, np.nan)
+    y = np.full(line_ids.size, np.nan)
+    within = ~past_end
+    along = global_segments[within]
+    previous = np.where(segments[within] > 0, segment_ends[np.maximum(along - 1, 0)], 0.0)
+    fractions = (distances[within] - previous) / segment_lengths[along]
+    p0 = coords[segment_points[along]]
+    p1 = coords[segment_points[along] + 1]
+    x[within] = np.where(fractions <= 0, p0[:, 0], np.where(
+        fractions >= 1, p1[:, 0], p0[:, 0] + fractions * (p1[:, 0] - p0[:, 0])))
+    y[within] = np.where(fractions <= 0, p0[:, 1], np.where(
+        fractions >= 1, p1[:, 1], p0[:, 1] + fractions * (p1[:, 1] - p0[:, 1])))
+
+    ends = past_end & (n_coords[line_ids] > 0)
+    last_points = coord_starts[line_ids[ends]] + n_coords[line_ids[ends]] - 1
+    x[ends] = coords[last_points, 0]
+    y[ends] = coords[last_points, 1]
+
+    return x, y
+
+def build_drainage_graph(raster, vector, recursive: bool = False,
+                         hierarchy: HierarchyMode = HierarchyMode.RASTER) -> DrainageGraph:
+    """
+    Rasterizes a drainage shapefile into a sparse drainage graph.
+
+    With the TOPOLOGY hierarchy the values already follow the reach graph
+    of the network, so the raster hierarchy pass is skipped.
+
+    Args:
+        raster: Base GeoDataRaster object
+        vector: Drainage GeoDataVector object
+        recursive: Whether to create drainage hierarchy
+        hierarchy: How the drainage hierarchy is derived
+
+    Returns:
+        Drainage graph holding the rasterized values
+    """
+    print(f"📋 {PROGRESS_MESSAGES['rasterizing']}...")
+    with stage('rasterize') as event:
+        cells, values = sample_drainage(raster, vector, recursive, hierarchy)
+        graph = DrainageGraph((raster.height, raster.width), cells, values)
+        event.cells = len(graph)
+
+    if recursive and hierarchy == HierarchyMode.RASTER:
+        with stage('hierarchy', len(graph)):
+            graph.values = create_drainage_hierarchy(graph)
+
+    return graph
+
+def rasterize_drainage(raster, vector, recursive: bool = False,
+                       hierarchy: HierarchyMode = HierarchyMode.RASTER,
+                       window: Optional[Tuple[int, int, int, int]] = None) -> np.ndarray:
+    """
+    Generates a drainage raster from a drainage shapefile.
+
+    The hierarchy is always built over the whole network, also when only a
+    window of the raster is returned.
+
+    Args:
+        raster: Base GeoDataRaster object
+        vector: Drainage GeoDataVector object
+        recursive: Whether to create drainage hierarchy
+        hierarchy: How the drainage hierarchy is derived
+        window: Tuple (row_start, row_stop, col_start, col_stop) to return, the full raster by default
 
-    return raster_mod
\ No newline at end of file
+    Returns:
+        Numpy array with rasterized drainage
+    """
+    return build_drainage_graph(raster, vector, recursive, hierarchy).to_raster(window=window)
+
+def create_drainage_hierarchy(graph: DrainageGraph) -> np.ndarray:
+    """
+    Creates drainage hierarchy for recursive processing.
+
+    Drainage cells are visited once, by ascending value and in row-major
+    order within a value. A cell with unvisited drainage neighbors ranks
+    above the highest of them, by one when it has at most two drainage
+    neighbors and by two otherwise. A cell whose drainage neighbors were
+    all visited ranks one above the lowest neighbor, which is a non-drainage
+    cell unless all eight neighbors drain. Unvisited cells rank by value.
+
+    Args:
+        graph: Drainage graph of the rasterized values
+
+    Returns:
+        Hierarchy value of each drainage cell
+    """
+    ranks = graph.values.astype(np.int64)
+    visited = np.zeros(len(graph), dtype=np.bool_)
+    flow_index = graph.get_flow_levels()
+
+    with tqdm(total=len(flow_index), desc=PROGRESS_MESSAGES['hierarchy']) as progress:
+        for start in range(0, len(flow_index), LEVEL_BATCH_SIZE):
+            stop = min(start + LEVEL_BATCH_SIZE, len(flow_index))
+            _hierarchy_levels(
+                ranks, visited, graph.indptr, graph.indices,
+                flow_index.order, flow_index.offsets, start, stop
+            )
+            progress.update(stop - start)
+
+    return ranks.astype(graph.values.dtype)
+
+@jit
+def _hierarchy_levels(ranks, visited, indptr, indices, nodes, offsets, start, stop):
+    """Ranks the drainage graph nodes of the levels in [start, stop) in place."""
+    for level in range(start, stop):
+        for position in range(offsets[level], offsets[level + 1]):
+            node = nodes[position]
+            pending = False
+            max_rank = 0
+            min_rank = 0
+            for edge in range(indptr[node], indptr[node + 1]):
+                neighbor = indices[edge]
+                if not visited[neighbor]:
+                    pending = True
+                if edge == indptr[node] or ranks[neighbor] > max_rank:
+                    max_rank = ranks[neighbor]
+                if edge == indptr[node] or ranks[neighbor] < min_rank:
+                    min_rank = ranks[neighbor]
+
+            n_neighbors = indptr[node + 1] - indptr[node]
+            if pending:
+                ranks[node] = max_rank + (1 if n_neighbors <= 2 else 2)
+            elif n_neighbors == 8:
+                ranks[node] = min_rank + 1
+            else:
+                ranks[node] = 1
+            visited[node] = True
@@ -0,0 +1,250 @@
+"""
+Stage timing and resource instrumentation.
+
+Processing stages (load, reproject, rasterize, hierarchy, enforce, save)
+run inside ``stage`` blocks, which emit a start and a stop event with the
+wall time, CPU time, peak resident memory and cell count of the stage to
+the active sinks. A thread can send its events to its own sinks with
+``thread_sinks``, so jobs run by concurrent threads keep separate reports;
+CPU time and peak memory are still those of the whole process.
+
+Setting GBOFE_PROFILE to cpu, memory or cpu,memory also profiles the
+enforce stage with cProfile and tracemalloc, writing the results to
+GBOFE_PROFILE_DIR (the working directory by default). Profiling is read
+once at import, so a run without it only pays one check per stage.
+"""
+import cProfile
+import itertools
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+from gbofe.config import PROFILE_DIR_ENV, PROFILE_ENV, PROFILE_TOP_ENTRIES, PROFILED_STAGES
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak memory is then not reported
+    resource = None
+
+class StageEvent:
+    """Start or stop event of a processing stage."""
+
+    def __init__(self, stage: str, kind: str, depth: int = 0, cells: Optional[int] = None) -> None:
+        self.stage = stage
+        self.kind = kind
+        self.depth = depth
+        self.cells = cells
+        self.timestamp = time.time()
+        self.wall_time: Optional[float] = None
+        self.cpu_time: Optional[float] = None
+        self.peak_rss: Optional[int] = None
+        self.profile: Optional[Dict[str, str]] = None
+        self.status = 'ok'
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Gets the event as a JSON-serializable dictionary."""
+        return dict(vars(self))
+
+class StageSink(ABC):
+    """Receiver of stage events."""
+
+    @abstractmethod
+    def emit(self, event: StageEvent) -> None:
+        """Handles a stage event."""
+        pass
+
+    def close(self) -> None:
+        """Finishes the output of the sink."""
+        pass
+
+class QuietSink(StageSink):
+    """Sink discarding every event."""
+
+    def emit(self, event: StageEvent) -> None:
+        pass
+
+class ConsoleSink(StageSink):
+    """Sink printing one line per completed stage."""
+
+    def emit(self, event: StageEvent) -> None:
+        if event.kind != 'stop':
+            return
+        details = [f"{event.wall_time:.2f} s", f"CPU {event.cpu_time:.2f} s"]
+        if event.peak_rss is not None:
+            details.append(f"peak RSS {event.peak_rss / 1024 ** 2:.0f} MiB")
+        if event.cells is not None:
+            details.append(f"{event.cells:,} cells")
+        status = '' if event.status == 'ok' else f" [{event.status}]"
+        print(f"{'  ' * event.depth}⏱️  {event.stage}: {', '.join(details)}{status}", flush=True)
+        for kind, path in (event.profile or {}).items():
+            print(f"{'  ' * event.depth}📁 {kind.upper()} profile saved in: {path}", flush=True)
+
+class JsonReportSink(StageSink):
+    """Sink collecting the completed stages into a JSON run report."""
+
+    def __init__(self, report_path: str, metadata: Optional[Dict[str, Any]] = None) -> None:
+        self.report_path = report_path
+        self.metadata = metadata or {}
+        self.started = time.time()
+        self.stages: List[Dict[str, Any]] = []
+        self.sections: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def emit(self, event: StageEvent) -> None:
+        if event.kind == 'stop':
+            with self._lock:
+                self.stages.append(event.to_dict())
+
+    def add_section(self, name: str, content: Any) -> None:
+        """Adds a JSON-serializable section to the report, such as the strategy counters."""
+        self.sections[name] = content
+
+    def close(self) -> None:
+        """Writes the run report."""
+        report = {
+            'metadata': self.metadata,
+            'started': self.started,
+            'wall_time': time.time() - self.started,
+            'peak_rss': get_peak_rss(),
+            'stages': self.stages,
+            **self.sections
+        }
+        with open(self.report_path, 'w') as report_file:
+            json.dump(report, report_file, indent=2, default=str)
+
+_sinks: List[StageSink] = [ConsoleSink()]
+_state = threading.local()
+
+# Profilers enabled for this process, one profiled stage at a time
+_profile_modes = frozenset(mode.strip() for mode in os.environ.get(PROFILE_ENV, '').lower().split(',')
+                           if mode.strip() in ('cpu', 'memory'))
+_profile_lock = threading.Lock()
+_profile_ids = itertools.count()
+
+def set_sinks(sinks: List[StageSink]) -> None:
+    """Sets the sinks receiving the stage events."""
+    _sinks[:] = sinks
+
+def get_sinks() -> List[StageSink]:
+    """Gets the sinks receiving the stage events."""
+    return list(_sinks)
+
+@contextmanager
+def thread_sinks(sinks: List[StageSink]) -> Iterator[None]:
+    """
+    Sends the stage events of the current thread to other sinks.
+
+    Args:
+        sinks: Sinks receiving the events of the thread inside the block
+    """
+    previous = getattr(_state, 'sinks', None)
+    _state.sinks = sinks
+    try:
+        yield
+    finally:
+        _state.sinks = previous
+
+def close_sinks() -> None:
+    """Closes the active sinks."""
+    for sink in _sinks:
+        sink.close()
+
+def get_peak_rss() -> Optional[int]:
+    """Gets the peak resident memory of the process in bytes, None when unknown."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in KiB elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+@contextmanager
+def stage(name: str, cells: Optional[int] = None) -> Iterator[StageEvent]:
+    """
+    Measures a processing stage.
+
+    The cell count may also be set on the yielded event inside the block,
+    once it is known. A stage raising an error stops with status 'error'.
+
+    Args:
+        name: Stage name
+        cells: Cells handled by the stage
+
+    Yields:
+        Stop event of the stage
+    """
+    depth = getattr(_state, 'depth', 0)
+    _emit(StageEvent(name, 'start', depth, cells))
+
+    stop = StageEvent(name, 'stop', depth, cells)
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    _state.depth = depth + 1
+    try:
+        if _profile_modes and name in PROFILED_STAGES:
+            with _profile(name, stop):
+                yield stop
+        else:
+            yield stop
+    except BaseException:
+        stop.status = 'error'
+        raise
+    finally:
+        _state.depth = depth
+        stop.wall_time = time.perf_counter() - wall_start
+        stop.cpu_time = time.process_time() - cpu_start
+        stop.peak_rss = get_peak_rss()
+        stop.timestamp = time.time()
+        _emit(stop)
+
+@contextmanager
+def _profile(name: str, event: StageEvent) -> Iterator[None]:
+    """Profiles a stage with the enabled profilers, saving their results on the event."""
+    # cProfile and tracemalloc are process-wide, concurrent stages are not profiled
+    if not _profile_lock.acquire(blocking=False):
+        yield
+        return
+
+    output_dir = os.environ.get(PROFILE_DIR_ENV, os.getcwd())
+    prefix = os.path.join(output_dir, f"{name}-{os.getpid()}-{next(_profile_ids)}")
+    profiler = cProfile.Profile() if 'cpu' in _profile_modes else None
+    try:
+        if 'memory' in _profile_modes:
+            tracemalloc.start()
+        if profiler is not None:
+            profiler.enable()
+        yield
+    finally:
+        event.profile = {}
+        os.makedirs(output_dir, exist_ok=True)
+
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(prefix + '.prof')
+            with open(prefix + '-cpu.txt', 'w') as report_file:
+                stats = pstats.Stats(profiler, stream=report_file)
+                stats.sort_stats('cumulative').print_stats(PROFILE_TOP_ENTRIES)
+            event.profile['cpu'] = prefix + '.prof'
+
+        if 'memory' in _profile_modes:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            with open(prefix + '-memory.txt', 'w') as report_file:
+                report_file.write(f"Peak traced memory: {peak / 1024 ** 2:.1f} MiB\n")
+                for statistic in snapshot.statistics('lineno')[:PROFILE_TOP_ENTRIES]:
+                    report_file.write(f"{statistic}\n")
+            event.profile['memory'] = prefix + '-memory.txt'
+
+        _profile_lock.release()
+
+def _emit(event: StageEvent) -> None:
+    """Sends an event to the sinks of the current thread, or to the active sinks."""
+    sinks = getattr(_state, 'sinks', None)
+    for sink in _sinks if sinks is None else sinks:
+        sink.emit(event)
@@ -0,0 +1,114 @@
+"""
+Topology of a vector drainage network.
+"""
+import numpy as np
+import shapely
+from gbofe.config import REACH_SNAP_TOLERANCE
+
+class ReachGraph:
+    """
+    Directed graph of drainage reaches connected at their junctions.
+
+    Every line is a reach flowing from its first to its last vertex, the same
+    direction the point indices of the raster hierarchy follow. A reach
+    flows into another one where its last vertex touches it, either at the
+    start of the receiving reach or anywhere along it when main stems are
+    not split at confluences. The graph has one node per reach and one edge
+    per junction, so it is far smaller than the drainage raster.
+    """
+
+    def __init__(self, lines: np.ndarray, tolerance: float = REACH_SNAP_TOLERANCE) -> None:
+        self.lengths = shapely.length(lines)
+
+        # Reaches touched by the last vertex of every other reach
+        ends = shapely.get_point(lines, -1)
+        tree = shapely.STRtree(lines)
+        tributaries, hosts = tree.query(ends, predicate='dwithin', distance=tolerance)
+        positions = shapely.line_locate_point(lines[hosts], ends[tributaries])
+
+        # Reaches ending at the same point do not flow into each other
+        joins = (tributaries != hosts) & (positions < self.lengths[hosts] - tolerance)
+        order = np.lexsort((positions[joins], hosts[joins]))
+        self.tributaries = tributaries[joins][order]
+        self.hosts = hosts[joins][order]
+        self.positions = positions[joins][order]
+
+    def __len__(self) -> int:
+        return int(self.lengths.size)
+
+    def get_headwaters(self) -> np.ndarray:
+        """Gets the reaches with no reach flowing into them."""
+        inflows = np.bincount(self.hosts, minlength=len(self))
+        return np.flatnonzero(inflows == 0)
+
+    def get_end_lengths(self) -> np.ndarray:
+        """
+        Computes the longest flow path from a headwater to the end of every reach.
+
+        Reaches are resolved in topological order once all the reaches
+        flowing into them are. Loops in braided networks are entered from
+        reaches that already have a resolved inflow.
+
+        Returns:
+            Flow path length at the last vertex of each reach
+        """
+        upstream = np.zeros(len(self))
+        end_lengths = np.zeros(len(self))
+        pending = np.bincount(self.hosts, minlength=len(self))
+        resolved = np.zeros(len(self), dtype=bool)
+        frontier = np.flatnonzero(pending == 0)
+
+        while not resolved.all():
+            if frontier.size == 0:
+                # Only loops remain: release the reaches fed by resolved ones
+                fed = np.zeros(len(self), dtype=bool)
+                fed[self.hosts[resolved[self.tributaries]]] = True
+                frontier = np.flatnonzero(fed & ~resolved)
+                if frontier.size == 0:
+                    frontier = np.flatnonzero(~resolved)
+
+            resolved[frontier] = True
+            end_lengths[frontier] = upstream[frontier] + self.lengths[frontier]
+
+            joins = np.flatnonzero(np.isin(self.tributaries, frontier))
+            hosts = self.hosts[joins]
+            np.maximum.at(upstream, hosts,
+                          end_lengths[self.tributaries[joins]] - self.positions[joins])
+            np.subtract.at(pending, hosts, 1)
+            frontier = np.unique(hosts[(pending[hosts] <= 0) & ~resolved[hosts]])
+
+        return end_lengths
+
+    def get_path_lengths(self, reach_ids: np.ndarray, distances: np.ndarray) -> np.ndarray:
+        """
+        Computes the longest flow path from a headwater to points on the reaches.
+
+        Args:
+            reach_ids: Reach of each point
+            distances: Distance of each point along its reach
+
+        Returns:
+            Flow path length at each point
+        """
+        # Best upstream length joined before each junction along its reach
+        gains = np.maximum(self.get_end_lengths()[self.tributaries] - self.positions, 0)
+        for k in range(1, gains.size):
+            if self.hosts[k] == self.hosts[k - 1]:
+                gains[k] = max(gains[k], gains[k - 1])
+
+        # Last junction at or before each point, junctions sorted first on ties
+        lines = np.concatenate([self.hosts, reach_ids])
+        values = np.concatenate([self.positions, distances])
+        kinds = np.concatenate([np.zeros(self.hosts.size, dtype=np.int8),
+                                np.ones(reach_ids.size, dtype=np.int8)])
+        order = np.lexsort((kinds, values, lines))
+        junctions = np.where(kinds[order] == 0, order, -1)
+        previous = np.maximum.accumulate(junctions)
+
+        is_point = kinds[order] == 1
+        last = np.empty(reach_ids.size, dtype=np.int64)
+        last[order[is_point] - self.hosts.size] = previous[is_point]
+        joined = last >= 0
+        joined[joined] = self.hosts[last[joined]] == reach_ids[joined]
+
+        return distances + np.where(joined, gains[np.maximum(last, 0)], 0.0)
@@ -1,27 +1,15 @@
 """
 Helper functions for the user interface.
 """
-import sys
-import time
 import os
 from typing import Tuple
-from gbofe.config import FlowEnforcementMethod, METHOD_DESCRIPTIONS, SUPPORTED_RASTER_EXTENSIONS, SUPPORTED_VECTOR_EXTENSIONS
+from gbofe.config import (
+    ENGINE_DESCRIPTIONS, ENGINE_ENV, EnforcementEngine, FlowEnforcementMethod, METHOD_DESCRIPTIONS,
+    RECURSIVE_METHODS, SUPPORTED_RASTER_EXTENSIONS, SUPPORTED_VECTOR_EXTENSIONS
+)
+from gbofe.utils.compiled import NUMBA_AVAILABLE
 from gbofe.utils.file_operations import validate_file_path, create_output_directory
 
-def animated_loading(message: str) -> None:
-    """
-    Shows a loading animation for the user.
-
-    Args:
-        message: Message to display during loading
-    """
-    for _ in range(3):
-        for dots in ['', '.', '..', '...']:
-            sys.stdout.write(f'\r{message}{dots}')
-            sys.stdout.flush()
-            time.sleep(0.5)
-    print()
-
 def display_method_menu() -> None:
     """Displays the menu of available methods."""
     print("Available flow correction methods:")
@@ -84,8 +72,7 @@ def get_user_input() -> Tuple[str, str, float, str, FlowEnforcementMethod, bool]
             print("Please enter a valid number.")
 
     # Determine if it is recursive
-    recursive = method in [FlowEnforcementMethod.NORMAL_EXCAVATION_MODIFIED,
-                           FlowEnforcementMethod.GBOFE]
+    recursive = method in RECURSIVE_METHODS
 
     # Path to the output file
     while True:
@@ -97,4 +84,32 @@ def get_user_input() -> Tuple[str, str, float, str, FlowEnforcementMethod, bool]
         except Exception as e:
             print(f"Error creating directory: {e}")
 
-    return dem_path, drainage_path, gradient, output_path, method, recursive
\ No newline at end of file
+    return dem_path, drainage_path, gradient, output_path, method, recursive
+
+def get_engine() -> EnforcementEngine:
+    """
+    Gets the implementation of the method, from the GBOFE_ENGINE variable or asked to the user.
+
+    Returns:
+        Enforcement engine, REFERENCE when the user just presses Enter
+    """
+    engine_name = os.environ.get(ENGINE_ENV, '').strip().upper()
+    if engine_name in EnforcementEngine.__members__:
+        engine = EnforcementEngine[engine_name]
+    else:
+        if engine_name:
+            print(f"Unknown engine in {ENGINE_ENV}: {engine_name}")
+        print("Available engines:")
+        for engine in EnforcementEngine:
+            print(f"{engine.value}: {ENGINE_DESCRIPTIONS[engine]}")
+        while True:
+            try:
+                engine_choice = input('Choose the engine (Enter for 1): ').strip()
+                engine = EnforcementEngine(int(engine_choice)) if engine_choice else EnforcementEngine.REFERENCE
+                break
+            except ValueError:
+                print("Invalid option. Please select a number from 1 to 3.")
+
+    if engine == EnforcementEngine.COMPILED and not NUMBA_AVAILABLE:
+        print("⚠️  Numba is not installed, the COMPILED engine runs as plain Python (pip install numba)")
+    return engine
\ No newline at end of file
@@ -0,0 +1,49 @@
+"""
+Tests of batch manifest loading.
+"""
+import json
+import pytest
+from gbofe.batch import BatchJob, load_jobs, run_batch
+from gbofe.config import FlowEnforcementMethod
+from gbofe.exceptions import InvalidFileFormatError, InvalidParameterError
+
+JOB = {'dem': 'dem.tif', 'drainage': 'drainage.shp', 'method': 'GBOFE', 'gradient': 0.001,
+       'output': 'out/gbofe.tif'}
+
+def write(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text)
+    return str(path)
+
+def test_loads_job_list_and_mapping(tmp_path):
+    jobs = load_jobs(write(tmp_path, 'jobs.json', json.dumps([JOB])))
+    assert len(jobs) == 1 and jobs[0].method == FlowEnforcementMethod.GBOFE and jobs[0].recursive
+    assert jobs[0].output == str(tmp_path / 'out' / 'gbofe.tif')
+    assert len(load_jobs(write(tmp_path, 'jobs.yaml', json.dumps({'jobs': [JOB]})))) == 1
+
+@pytest.mark.parametrize('name, text', [
+    ('truncated.json', '[{"dem": "dem.tif"'),
+    ('empty.yaml', ''),
+    ('invalid.yaml', 'jobs: [a, b'),
+    ('no_jobs.json', '{"job": []}'),
+    ('jobs_not_list.json', '{"jobs": "a.tif"}'),
+    ('scalar.json', '3'),
+])
+def test_rejects_invalid_manifests(tmp_path, name, text):
+    with pytest.raises(InvalidFileFormatError):
+        load_jobs(write(tmp_path, name, text))
+
+def test_rejects_jobs_that_are_not_objects(tmp_path):
+    with pytest.raises(InvalidParameterError, match='must be an object'):
+        load_jobs(write(tmp_path, 'jobs.json', '["a.tif"]'))
+
+@pytest.mark.parametrize('other_output', ['out/gbofe.tif', 'out/../out/gbofe.tif', 'out/gbofe.tiff'])
+def test_rejects_jobs_writing_the_same_output(tmp_path, other_output):
+    other = dict(JOB, method='R_CARVE', gradient=2, output=other_output)
+    with pytest.raises(InvalidParameterError, match='both write'):
+        load_jobs(write(tmp_path, 'jobs.json', json.dumps([JOB, other])))
+
+def test_run_batch_rejects_jobs_writing_the_same_output(tmp_path):
+    jobs = [BatchJob.from_record(index, JOB, str(tmp_path)) for index in range(2)]
+    with pytest.raises(InvalidParameterError):
+        run_batch(jobs, workers=2)
@@ -0,0 +1,22 @@
+"""
+Tests of the strategy counters.
+"""
+import numpy as np
+from gbofe.utils.counters import AlgorithmCounters
+
+def test_record_bins_by_power_of_two():
+    counters = AlgorithmCounters()
+    counters.record('size', np.array([0, 1, 2, 3, 4, 7, 8]))
+    assert counters.to_dict()['histograms']['size'] == {'0': 1, '1': 1, '2': 2, '4': 2, '8': 1}
+
+def test_merged_levels_match_a_single_run():
+    single = AlgorithmCounters()
+    single.record_levels('level_size', np.array([1, 2, 5]), np.array([2, 3, 1]))
+
+    merged = AlgorithmCounters()
+    for flow_values, sizes in (([1, 2], [1, 2]), ([1, 2, 5], [1, 1, 1])):
+        component = AlgorithmCounters()
+        component.record_levels('level_size', np.array(flow_values), np.array(sizes))
+        merged.merge(component)
+
+    assert merged.to_dict() == single.to_dict() == {'counts': {}, 'histograms': {'level_size': {'1': 1, '2': 2}}}
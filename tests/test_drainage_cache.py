@@ -0,0 +1,36 @@
+"""
+Tests of the drainage cache keys.
+"""
+import pytest
+from gbofe.benchmark import generate_dem, generate_drainage
+from gbofe.config import HierarchyMode
+from gbofe.models.geo_data import GeoDataRaster, GeoDataVector
+from gbofe.utils.drainage_cache import DrainageCache
+
+@pytest.fixture
+def inputs(tmp_path):
+    dem_path = str(tmp_path / 'dem.tif')
+    drainage_path = str(tmp_path / 'drainage.shp')
+    generate_dem(dem_path, 'valleys', 64)
+    generate_drainage(drainage_path, 64, 20)
+    return GeoDataRaster(dem_path, load_data=False), GeoDataVector(drainage_path), drainage_path
+
+def test_key_is_stable(inputs, tmp_path):
+    raster, vector, _ = inputs
+    cache = DrainageCache(str(tmp_path / 'cache'))
+    key = cache.get_key(raster, vector, True, HierarchyMode.TOPOLOGY)
+    assert key == DrainageCache(str(tmp_path / 'other')).get_key(raster, vector, True, HierarchyMode.TOPOLOGY)
+
+def test_key_follows_settings(inputs, tmp_path):
+    raster, vector, _ = inputs
+    cache = DrainageCache(str(tmp_path / 'cache'))
+    keys = {cache.get_key(raster, vector, recursive, hierarchy)
+            for recursive in (True, False) for hierarchy in HierarchyMode}
+    assert len(keys) == len(HierarchyMode) + 1
+
+def test_key_follows_drainage_files(inputs, tmp_path):
+    raster, vector, drainage_path = inputs
+    cache = DrainageCache(str(tmp_path / 'cache'))
+    key = cache.get_key(raster, vector, True, HierarchyMode.TOPOLOGY)
+    generate_drainage(drainage_path, 64, 20, seed=1)
+    assert cache.get_key(raster, GeoDataVector(drainage_path), True, HierarchyMode.TOPOLOGY) != key
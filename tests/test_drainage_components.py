@@ -0,0 +1,26 @@
+"""
+Tests of the overlap search of drainage component windows.
+"""
+import numpy as np
+from gbofe.utils.drainage_components import find_overlapping_windows, link_roots
+
+def test_overlapping_windows_match_all_pairs():
+    rng = np.random.default_rng(0)
+    starts = rng.integers(0, 500, size=(200, 2))
+    spans = rng.integers(1, 40, size=(200, 2))
+    windows = np.stack([starts[:, 0], starts[:, 0] + spans[:, 0],
+                        starts[:, 1], starts[:, 1] + spans[:, 1]], axis=1)
+
+    overlap = ((windows[:, None, 0] < windows[None, :, 1]) & (windows[None, :, 0] < windows[:, None, 1]) &
+               (windows[:, None, 2] < windows[None, :, 3]) & (windows[None, :, 2] < windows[:, None, 3]))
+    expected = {(int(first), int(second)) for first, second in np.argwhere(np.triu(overlap, 1))}
+    pairs = find_overlapping_windows(windows)
+    assert {(int(min(pair)), int(max(pair))) for pair in pairs} == expected
+    assert len(pairs) == len(expected)
+
+def test_touching_windows_do_not_overlap():
+    assert len(find_overlapping_windows(np.array([[0, 5, 0, 5], [5, 9, 0, 5], [0, 5, 5, 9]]))) == 0
+
+def test_link_roots_gives_lowest_item_of_each_group():
+    roots = link_roots(6, np.array([5, 3, 1]), np.array([3, 1, 4]))
+    np.testing.assert_array_equal(roots, [0, 1, 2, 1, 1, 1])
@@ -0,0 +1,27 @@
+"""
+Tests of the enforcement engines against the reference implementations.
+"""
+import json
+import pytest
+from gbofe.equivalence import check_equivalence, check_golden, get_reference_digests
+from gbofe.config import EQUIVALENCE_MAX_SIZE, FlowEnforcementMethod
+
+@pytest.mark.parametrize('method', list(FlowEnforcementMethod), ids=lambda method: method.name)
+def test_engines_match_reference(method):
+    mismatches = check_equivalence([method], cases=25, seed=0)
+    assert not mismatches, '\n\n'.join(mismatch.describe() for mismatch in mismatches)
+
+def test_engines_match_reference_in_pool():
+    mismatches = check_equivalence([FlowEnforcementMethod.GBOFE], cases=5, seed=100, workers=2)
+    assert not mismatches, '\n\n'.join(mismatch.describe() for mismatch in mismatches)
+
+def test_reference_matches_golden_outputs():
+    assert check_golden() == []
+
+def test_golden_check_reports_changed_outputs(tmp_path):
+    digests = get_reference_digests([FlowEnforcementMethod.R_CARVE], cases=3)
+    digests['R_CARVE/1'] = '0' * 64
+    golden_path = tmp_path / 'golden.json'
+    golden_path.write_text(json.dumps({'cases': 3, 'seed': 0, 'max_size': EQUIVALENCE_MAX_SIZE,
+                                       'digests': digests}))
+    assert check_golden(str(golden_path)) == ['R_CARVE/1']
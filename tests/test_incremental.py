@@ -0,0 +1,64 @@
+"""
+Tests of incremental updates against full runs on the edited drainage.
+"""
+import geopandas as gpd
+import numpy as np
+import pytest
+import rasterio
+from shapely.geometry import LineString
+from gbofe.benchmark import generate_dem, generate_drainage
+from gbofe.config import BENCHMARK_CRS, FlowEnforcementMethod
+from gbofe.incremental import RunState, run_full, update_run
+
+METHODS = [(FlowEnforcementMethod.GBOFE, 0.001), (FlowEnforcementMethod.R_CARVE, 2.0),
+           (FlowEnforcementMethod.NORMAL_EXCAVATION_MODIFIED, 2.0)]
+
+@pytest.fixture
+def inputs(tmp_path):
+    dem_path = str(tmp_path / 'dem.tif')
+    drainage_path = str(tmp_path / 'drainage.shp')
+    edited_path = str(tmp_path / 'edited.shp')
+    generate_dem(dem_path, 'valleys', 128)
+    generate_drainage(drainage_path, 128, 40)
+    # Remove a tributary
+    drainage = gpd.read_file(drainage_path)
+    drainage.drop(index=drainage.index[-1]).to_file(edited_path)
+    return dem_path, drainage_path, edited_path
+
+def read(path):
+    with rasterio.open(path) as src:
+        return src.read(1)
+
+@pytest.mark.parametrize('method, gradient', METHODS, ids=lambda value: getattr(value, 'name', str(value)))
+def test_update_matches_full_run(inputs, tmp_path, method, gradient):
+    dem_path, drainage_path, edited_path = inputs
+    state_path = run_full(dem_path, drainage_path, str(tmp_path / 'burn.tif'), method, gradient)
+    summary = update_run(state_path, edited_path, str(tmp_path / 'updated.tif'))
+    run_full(dem_path, edited_path, str(tmp_path / 'expected.tif'), method, gradient)
+
+    assert summary['removed_reaches'] == 1 and summary['changed_cells'] > 0
+    expected = read(str(tmp_path / 'expected.tif'))
+    assert not np.array_equal(read(str(tmp_path / 'burn.tif')), expected)
+    np.testing.assert_array_equal(read(str(tmp_path / 'updated.tif')), expected)
+    assert RunState.load(RunState.get_path(str(tmp_path / 'updated.tif'))).settings['drainage'] == edited_path
+
+@pytest.mark.parametrize('method, gradient', METHODS[:2], ids=lambda value: getattr(value, 'name', str(value)))
+def test_update_rasterizes_the_edited_basin_only(tmp_path, method, gradient):
+    dem_path = str(tmp_path / 'dem.tif')
+    drainage_path = str(tmp_path / 'drainage.shp')
+    edited_path = str(tmp_path / 'edited.shp')
+    generate_dem(dem_path, 'valleys', 128)
+    # Three separate basins, one with a tributary, and the last one moved by the edit
+    lines = [LineString([(x, 1250), (x + 40, 640), (x, 30)]) for x in (150, 600, 1050)]
+    lines.append(LineString([(300, 1100), (170, 900)]))
+    gpd.GeoDataFrame(geometry=lines, crs=BENCHMARK_CRS).to_file(drainage_path)
+    lines[2] = LineString([(1080, 1250), (1120, 640), (1080, 30)])
+    gpd.GeoDataFrame(geometry=lines, crs=BENCHMARK_CRS).to_file(edited_path)
+
+    state_path = run_full(dem_path, drainage_path, str(tmp_path / 'burn.tif'), method, gradient)
+    assert RunState.load(state_path).windows.shape == (4, 4)
+    summary = update_run(state_path, edited_path, str(tmp_path / 'updated.tif'))
+    run_full(dem_path, edited_path, str(tmp_path / 'expected.tif'), method, gradient)
+
+    assert summary['added_reaches'] == summary['removed_reaches'] == summary['rasterized_reaches'] == 1
+    np.testing.assert_array_equal(read(str(tmp_path / 'updated.tif')), read(str(tmp_path / 'expected.tif')))
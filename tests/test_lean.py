@@ -0,0 +1,34 @@
+"""
+Tests of the lean processing mode.
+"""
+import numpy as np
+from gbofe.benchmark import generate_dem, generate_drainage
+from gbofe.config import FlowEnforcementMethod
+from gbofe.main import FlowEnforcementFactory
+from gbofe.models.dem_processor import DEMProcessor
+from gbofe.models.geo_data import GeoDataRaster
+
+def test_lean_run_releases_the_loaded_dem(tmp_path):
+    dem_path = str(tmp_path / 'dem.tif')
+    drainage_path = str(tmp_path / 'drainage.shp')
+    generate_dem(dem_path, 'valleys', 64)
+    generate_drainage(drainage_path, 64, 20)
+    results = []
+    for load_data in (True, False):
+        processor = DEMProcessor.from_files(dem_path, drainage_path, load_data=load_data)
+        strategy = FlowEnforcementFactory.create(FlowEnforcementMethod.GBOFE, 0.001)
+        results.append(processor.process(strategy, recursive=True, lean=True).corrected_data)
+        assert processor.dem_raster.data is None
+
+    assert results[0].dtype == np.float32
+    np.testing.assert_array_equal(results[0], results[1])
+
+def test_lean_run_keeps_shared_rasters(tmp_path):
+    dem_path = str(tmp_path / 'dem.tif')
+    drainage_path = str(tmp_path / 'drainage.shp')
+    generate_dem(dem_path, 'valleys', 64)
+    generate_drainage(drainage_path, 64, 20)
+    raster = GeoDataRaster(dem_path)
+    processor = DEMProcessor(raster, DEMProcessor.from_files(dem_path, drainage_path).drainage_vector)
+    processor.process(FlowEnforcementFactory.create(FlowEnforcementMethod.R_CARVE, 2.0), lean=True)
+    assert raster.data is not None
@@ -0,0 +1,41 @@
+"""
+Tests of the out-of-core processor and its memory budget.
+"""
+import numpy as np
+import pytest
+from gbofe.benchmark import generate_dem, generate_drainage
+from gbofe.config import FlowEnforcementMethod
+from gbofe.exceptions import DEMProcessingError
+from gbofe.main import FlowEnforcementFactory
+from gbofe.models.dem_processor import DEMProcessor
+from gbofe.models.out_of_core import OutOfCoreProcessor
+from gbofe.utils.drainage_footprint import DrainageFootprint
+
+@pytest.fixture
+def inputs(tmp_path):
+    dem_path = str(tmp_path / 'dem.tif')
+    drainage_path = str(tmp_path / 'drainage.shp')
+    generate_dem(dem_path, 'valleys', 64)
+    generate_drainage(drainage_path, 64, 20)
+    return dem_path, drainage_path
+
+def test_footprint_is_taken_from_the_budget(inputs, tmp_path):
+    processor = OutOfCoreProcessor.from_files(*inputs, scratch_dir=str(tmp_path))
+    footprint = DrainageFootprint(processor.get_drainage_graph(recursive=True))
+    footprint_bytes = processor.get_footprint_bytes(footprint)
+    assert footprint_bytes > footprint.nbytes > footprint.graph.nbytes > 0
+
+    processor.memory_budget = footprint_bytes + 3 * 16 * 64
+    assert processor.get_block_rows(footprint) == 3
+    strategy = FlowEnforcementFactory.create(FlowEnforcementMethod.GBOFE, 0.001)
+    corrected = processor.process(strategy, recursive=True).corrected_data
+
+    expected = DEMProcessor.from_files(*inputs).process(
+        FlowEnforcementFactory.create(FlowEnforcementMethod.GBOFE, 0.001), recursive=True).corrected_data
+    np.testing.assert_array_equal(corrected, expected)
+
+def test_fails_when_the_footprint_exceeds_the_budget(inputs, tmp_path):
+    processor = OutOfCoreProcessor.from_files(*inputs, memory_budget=16 * 64, scratch_dir=str(tmp_path))
+    strategy = FlowEnforcementFactory.create(FlowEnforcementMethod.R_CARVE, 2.0)
+    with pytest.raises(DEMProcessingError, match='footprint'):
+        processor.process(strategy)
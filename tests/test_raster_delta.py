@@ -0,0 +1,84 @@
+"""
+Tests of sparse raster deltas and block patching.
+"""
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+from gbofe.models.geo_data import GeoDataRaster
+from gbofe.models.raster_delta import RasterDelta, patch_blocks
+from gbofe.exceptions import DEMProcessingError
+
+NODATA = -9999.0
+
+@pytest.fixture
+def dem_path(tmp_path):
+    """Tiled float32 DEM with NoData cells, in blocks of 16 by 16 cells."""
+    rng = np.random.default_rng(0)
+    data = rng.uniform(0, 100, size=(40, 50)).astype(np.float32)
+    data[5, 7] = data[30, 45] = NODATA
+    path = str(tmp_path / 'dem.tif')
+    with rasterio.open(path, 'w', driver='GTiff', height=40, width=50, count=1, dtype='float32',
+                       crs='EPSG:32633', transform=from_origin(0, 400, 10, 10), nodata=NODATA,
+                       tiled=True, blockxsize=16, blockysize=16) as dst:
+        dst.write(data, 1)
+    return path
+
+def read(path):
+    with rasterio.open(path) as src:
+        return src.read(1)
+
+def test_delta_apply_and_revert_round_trip(dem_path, tmp_path):
+    raster = GeoDataRaster(dem_path)
+    original = read(dem_path)
+    corrected = original.astype(np.float64)
+    corrected[corrected == NODATA] = np.nan
+    corrected[2, 3] -= 5.0
+    corrected[20, 20:24] = 1.5
+    corrected[39, 49] = np.nan
+
+    delta = RasterDelta.from_result(raster, corrected, block_rows=7)
+    assert len(delta) == 6
+    delta.save(str(tmp_path / 'delta.npz'))
+    delta = RasterDelta.load(str(tmp_path / 'delta.npz'))
+
+    assert delta.apply(dem_path) == 3
+    expected = corrected.astype(np.float32)
+    expected[np.isnan(corrected)] = NODATA
+    np.testing.assert_array_equal(read(dem_path), expected)
+
+    delta.apply(dem_path, revert=True)
+    np.testing.assert_array_equal(read(dem_path), original)
+
+def test_delta_apply_checks_replaced_values(dem_path):
+    raster = GeoDataRaster(dem_path)
+    corrected = raster.read_elevations()
+    corrected[10, 10] += 1.0
+    delta = RasterDelta.from_result(raster, corrected)
+
+    delta.apply(dem_path)
+    with pytest.raises(DEMProcessingError):
+        delta.apply(dem_path)
+
+def test_patch_refuses_rasters_with_overviews(dem_path):
+    with rasterio.open(dem_path, 'r+') as dst:
+        dst.build_overviews([2])
+    with pytest.raises(DEMProcessingError, match='overviews'):
+        patch_blocks(dem_path, np.array([0]), np.array([1.0]), NODATA)
+
+def test_delta_apply_refuses_values_an_integer_raster_cannot_hold(tmp_path):
+    path = str(tmp_path / 'dem.tif')
+    with rasterio.open(path, 'w', driver='GTiff', height=8, width=8, count=1, dtype='int16',
+                       crs='EPSG:32633', transform=from_origin(0, 80, 10, 10), nodata=-9999) as dst:
+        dst.write(np.full((8, 8), 100, dtype=np.int16), 1)
+    raster = GeoDataRaster(path)
+    corrected = raster.read_elevations()
+    corrected[3, 3] = 99.5
+
+    with pytest.raises(DEMProcessingError, match='int16'):
+        RasterDelta.from_result(raster, corrected).apply(path)
+    assert read(path)[3, 3] == 100
+
+    corrected[3, 3] = 99.0
+    RasterDelta.from_result(raster, corrected).apply(path)
+    assert read(path)[3, 3] == 99
@@ -0,0 +1,57 @@
+"""
+Tests of sharded runs against full runs.
+"""
+import json
+import geopandas as gpd
+import numpy as np
+import pytest
+import rasterio
+from shapely.geometry import LineString
+from gbofe.benchmark import generate_dem
+from gbofe.config import BENCHMARK_CRS, RECURSIVE_METHODS, FlowEnforcementMethod
+from gbofe.main import FlowEnforcementFactory
+from gbofe.models.dem_processor import DEMProcessor
+from gbofe.sharding import load_manifest, main, merge_shards, plan_shards, process_shard
+
+@pytest.mark.parametrize('method, gradient', [(FlowEnforcementMethod.GBOFE, 0.001),
+                                              (FlowEnforcementMethod.R_CARVE, 2.0)],
+                         ids=lambda value: getattr(value, 'name', str(value)))
+def test_merged_shards_match_full_run(tmp_path, method, gradient):
+    dem_path = str(tmp_path / 'dem.tif')
+    drainage_path = str(tmp_path / 'drainage.shp')
+    generate_dem(dem_path, 'valleys', 128)
+    # Three separate basins, one with a tributary, digitized downstream
+    lines = [LineString([(x, 1250), (x + 40, 640), (x, 30)]) for x in (150, 600, 1050)]
+    lines.append(LineString([(300, 1100), (170, 900)]))
+    gpd.GeoDataFrame(geometry=lines, crs=BENCHMARK_CRS).to_file(drainage_path)
+
+    manifest_path = plan_shards(dem_path, drainage_path, str(tmp_path / 'shards'), 3, method, gradient)
+    manifest = load_manifest(manifest_path)
+    assert manifest['recursive'] == (method in RECURSIVE_METHODS)
+    assert [len(shard['basins']) for shard in manifest['shards']] == [1, 1, 1]
+    process_shard(manifest_path, 0)
+    for shard in range(1, 3):
+        main(['work', manifest_path, str(shard)])
+    merge_shards(manifest_path, str(tmp_path / 'merged.tif'))
+
+    processor = DEMProcessor.from_files(dem_path, drainage_path, load_data=False)
+    strategy = FlowEnforcementFactory.create(method, gradient)
+    processor.process(strategy, recursive=method in RECURSIVE_METHODS).save(str(tmp_path / 'full.tif'))
+
+    with rasterio.open(str(tmp_path / 'merged.tif')) as merged, rasterio.open(str(tmp_path / 'full.tif')) as full:
+        np.testing.assert_array_equal(merged.read(1), full.read(1))
+
+def test_merge_refuses_overlapping_basins(tmp_path, capsys):
+    dem_path = str(tmp_path / 'dem.tif')
+    generate_dem(dem_path, 'plane', 32)
+    manifest = {'dem': dem_path, 'shape': [32, 32], 'shards': [
+        {'id': 0, 'basins': [{'window': [0, 10, 0, 10], 'tile': 'a.tif'}]},
+        {'id': 1, 'basins': [{'window': [5, 20, 8, 20], 'tile': 'b.tif'}]}
+    ]}
+    manifest_path = tmp_path / 'manifest.json'
+    manifest_path.write_text(json.dumps(manifest))
+    for tile in ('a.tif', 'b.tif'):
+        (tmp_path / tile).write_bytes(b'')
+    with pytest.raises(SystemExit):
+        main(['merge', str(manifest_path), str(tmp_path / 'merged.tif')])
+    assert 'overlap' in capsys.readouterr().out
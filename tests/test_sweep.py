@@ -0,0 +1,40 @@
+"""
+Tests of sweep output naming and combinations.
+"""
+import os
+import pytest
+from gbofe.benchmark import generate_dem, generate_drainage
+from gbofe.config import FlowEnforcementMethod, OutputFormat
+from gbofe.models.dem_processor import DEMProcessor
+from gbofe.models.geo_data import OutputOptions
+from gbofe.sweep import get_sweep_path, run_sweep
+from gbofe.exceptions import InvalidParameterError
+
+def test_sweep_path_names_method_and_gradient():
+    path = get_sweep_path('sweep', FlowEnforcementMethod.R_CARVE, 2.0)
+    assert path == os.path.join('sweep', 'r_carve_g2.tif')
+    assert get_sweep_path('sweep', FlowEnforcementMethod.GBOFE, 0.001,
+                          OutputOptions(OutputFormat.COG)).endswith('gbofe_g0.001.tif')
+
+def test_sweep_path_of_deltas():
+    options = OutputOptions(OutputFormat.DELTA)
+    assert get_sweep_path('sweep', FlowEnforcementMethod.R_CARVE, 1.0, options).endswith('r_carve_g1.delta')
+
+def test_sweep_runs_repeated_combinations_once(tmp_path):
+    dem_path = str(tmp_path / 'dem.tif')
+    drainage_path = str(tmp_path / 'drainage.shp')
+    generate_dem(dem_path, 'valleys', 64)
+    generate_drainage(drainage_path, 64, 20)
+    processor = DEMProcessor.from_files(dem_path, drainage_path, load_data=False)
+    combinations = [(FlowEnforcementMethod.GBOFE, 0.001), (FlowEnforcementMethod.R_CARVE, 1.0),
+                     (FlowEnforcementMethod.GBOFE, 0.001)]
+
+    output_paths = run_sweep(processor, combinations, str(tmp_path / 'sweep'), workers=2)
+    assert output_paths == [get_sweep_path(str(tmp_path / 'sweep'), method, gradient)
+                            for method, gradient in combinations[:2]]
+    assert all(os.path.isfile(path) for path in output_paths)
+
+def test_sweep_rejects_gradients_with_the_same_name(tmp_path):
+    combinations = [(FlowEnforcementMethod.GBOFE, 0.001), (FlowEnforcementMethod.GBOFE, 0.0010000001)]
+    with pytest.raises(InvalidParameterError, match='both write'):
+        run_sweep(None, combinations, str(tmp_path / 'sweep'))